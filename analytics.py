@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+"""
+队列eGFR年变化率
+
+每位患者的eGFR年变化率为其全部eGFR检查值对检查时间（年）的最小二乘斜率，
+结果保存在汇总表 egfr_slopes 中，仪表盘据此列出eGFR快速下降的患者。
+
+- 计算：一次查询取出一批患者的 (patient_id, followup_date, egfr)，用NumPy按患者
+  分组（np.bincount）同时算出这批患者的斜率，不逐个患者循环
+- 增量：随访记录新增、删除或修改eGFR、随访日期时，在同一事务中把该患者的
+  pending 加一；刷新只重新计算 pending > 0 的患者，并且只在 pending 未再变化时
+  清零，计算期间又有写入的患者留到下一次刷新
+- 刷新时机：写入随访记录的会话提交后（只有本次写入涉及的患者待更新）、批量导入和回填之后、
+  服务启动预热时，或执行 flask refresh-egfr-slopes；仪表盘只读取 egfr_slopes，不在读请求中写入
+"""
+from datetime import datetime
+import numpy as np
+from flask import current_app
+from sqlalchemy import event, select, update, insert, delete, inspect, bindparam, literal
+from sqlalchemy.orm import Session, object_session
+from database import db
+from models import Patient, FollowupRecord, EgfrSlope
+from cache import cache
+
+DAYS_PER_YEAR = 365.25
+REFRESH_CHUNK_SIZE = 2000
+# 影响斜率的随访记录列
+_SLOPE_COLUMNS = ('patient_id', 'followup_date', 'egfr')
+
+
+def compute_slopes(patient_ids, days, egfr, min_points=3, min_years=0.5):
+    """按患者分组计算eGFR对时间（年）的最小二乘斜率
+
+    三个参数为等长数组，须按患者、日期排序（同一患者的行相邻且日期升序）。
+    返回 (患者ID, 斜率, 点数, 首行下标, 末行下标)，点数或跨度不足的患者斜率为NaN。
+    """
+    ids, first, counts = np.unique(patient_ids, return_index=True, return_counts=True)
+    group = np.repeat(np.arange(len(ids)), counts)
+    years = np.asarray(days, dtype=float) / DAYS_PER_YEAR
+    egfr = np.asarray(egfr, dtype=float)
+
+    # 先减去组内均值再求平方和，避免大数相减损失精度
+    mean_t = np.bincount(group, years) / counts
+    mean_y = np.bincount(group, egfr) / counts
+    dt = years - mean_t[group]
+    sxx = np.bincount(group, dt * dt)
+    sxy = np.bincount(group, dt * (egfr - mean_y[group]))
+
+    last = first + counts - 1
+    valid = (counts >= min_points) & (years[last] - years[first] >= min_years) & (sxx > 0)
+    slopes = np.full(len(ids), np.nan)
+    np.divide(sxy, sxx, out=slopes, where=valid)
+    return ids, slopes, counts, first, last
+
+
+def mark_patients_dirty(connection, patient_ids):
+    """把患者的eGFR斜率标记为待更新，汇总行不存在时创建"""
+    patient_ids = sorted(set(patient_ids))
+    if not patient_ids:
+        return
+    table = EgfrSlope.__table__
+    existing = set(connection.execute(
+        select(table.c.patient_id).where(table.c.patient_id.in_(patient_ids))
+    ).scalars())
+    if existing:
+        connection.execute(
+            update(table).where(table.c.patient_id.in_(existing)).values(pending=table.c.pending + 1)
+        )
+    missing = [patient_id for patient_id in patient_ids if patient_id not in existing]
+    if missing:
+        connection.execute(insert(table), [{'patient_id': i, 'pending': 1, 'n_points': 0} for i in missing])
+
+
+def mark_session_pending(obj):
+    """记下对象所在会话中有患者待更新，提交后刷新"""
+    session = object_session(obj)
+    if session is not None:
+        session.info['egfr_slopes_pending'] = True
+
+
+@event.listens_for(FollowupRecord, 'after_insert')
+@event.listens_for(FollowupRecord, 'after_delete')
+def _record_written(mapper, connection, record):
+    if record.egfr is not None:
+        mark_patients_dirty(connection, [record.patient_id])
+        mark_session_pending(record)
+
+
+@event.listens_for(FollowupRecord, 'after_update')
+def _record_updated(mapper, connection, record):
+    state = inspect(record)
+    if not any(state.attrs[column].history.has_changes() for column in _SLOPE_COLUMNS):
+        return
+    # 记录被改到其他患者名下时，原患者也需要重新计算
+    patient_ids = {record.patient_id, *state.attrs.patient_id.history.deleted}
+    mark_patients_dirty(connection, [i for i in patient_ids if i is not None])
+    mark_session_pending(record)
+
+
+@event.listens_for(Session, 'after_commit')
+def _refresh_after_commit(session):
+    if not session.info.pop('egfr_slopes_pending', False):
+        return
+    try:
+        refresh_slopes()
+    except Exception:
+        # 写入已经提交；待更新的患者留到下一次刷新
+        current_app.logger.exception('eGFR年变化率更新失败')
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_pending(session):
+    session.info.pop('egfr_slopes_pending', None)
+
+
+@event.listens_for(Patient, 'before_delete')
+def _patient_deleted(mapper, connection, patient):
+    # 须在删除患者之前删除，启用外键约束时汇总行不能引用已删除的患者
+    connection.execute(delete(EgfrSlope.__table__).where(EgfrSlope.__table__.c.patient_id == patient.id))
+
+
+def _refresh_chunk(connection, pending, min_points, min_years):
+    """重新计算一批患者，pending 为 [(患者ID, 读取时的pending值)]"""
+    patient_ids = [patient_id for patient_id, _ in pending]
+    rows = connection.execute(
+        select(FollowupRecord.patient_id, FollowupRecord.followup_date, FollowupRecord.egfr)
+        .where(FollowupRecord.patient_id.in_(patient_ids), FollowupRecord.egfr.isnot(None))
+        .order_by(FollowupRecord.patient_id, FollowupRecord.followup_date, FollowupRecord.id)
+    ).all()
+
+    results = {}
+    if rows:
+        ids, slopes, counts, first, last = compute_slopes(
+            np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows)),
+            np.fromiter((row[1].toordinal() for row in rows), dtype=float, count=len(rows)),
+            np.fromiter((row[2] for row in rows), dtype=float, count=len(rows)),
+            min_points, min_years,
+        )
+        for i, patient_id in enumerate(ids.tolist()):
+            results[patient_id] = {
+                'b_slope': None if np.isnan(slopes[i]) else round(float(slopes[i]), 3),
+                'b_n_points': int(counts[i]),
+                'b_first_date': rows[first[i]][1],
+                'b_last_date': rows[last[i]][1],
+                'b_last_egfr': rows[last[i]][2],
+            }
+
+    empty = {'b_slope': None, 'b_n_points': 0, 'b_first_date': None, 'b_last_date': None, 'b_last_egfr': None}
+    table = EgfrSlope.__table__
+    # 只有 pending 仍是读取时的值才清零，计算期间又有写入的患者保持待更新
+    connection.execute(
+        update(table)
+        .where(table.c.patient_id == bindparam('b_patient_id'), table.c.pending == bindparam('b_pending'))
+        .values(slope=bindparam('b_slope'), n_points=bindparam('b_n_points'),
+                first_date=bindparam('b_first_date'), last_date=bindparam('b_last_date'),
+                last_egfr=bindparam('b_last_egfr'), pending=0, updated_at=datetime.now()),
+        [{'b_patient_id': patient_id, 'b_pending': seen, **results.get(patient_id, empty)}
+         for patient_id, seen in pending]
+    )
+
+
+def refresh_slopes(full=False):
+    """重新计算待更新患者的eGFR斜率（full=True 时重新计算全部患者），返回处理的患者数"""
+    min_points = current_app.config.get('EGFR_SLOPE_MIN_POINTS', 3)
+    min_years = current_app.config.get('EGFR_SLOPE_MIN_YEARS', 0.5)
+    table = EgfrSlope.__table__
+
+    if full:
+        with db.engine.begin() as connection:
+            connection.execute(insert(table).from_select(
+                ['patient_id', 'pending', 'n_points'],
+                select(Patient.id, literal(0), literal(0)).where(~Patient.id.in_(select(table.c.patient_id)))
+            ))
+            connection.execute(update(table).values(pending=table.c.pending + 1))
+
+    processed, last_id = 0, 0
+    while True:
+        with db.engine.begin() as connection:
+            pending = connection.execute(
+                select(table.c.patient_id, table.c.pending)
+                .where(table.c.pending > 0, table.c.patient_id > last_id)
+                .order_by(table.c.patient_id).limit(REFRESH_CHUNK_SIZE)
+            ).all()
+            if not pending:
+                break
+            _refresh_chunk(connection, [tuple(row) for row in pending], min_points, min_years)
+        processed += len(pending)
+        if len(pending) < REFRESH_CHUNK_SIZE:
+            break
+        last_id = pending[-1][0]
+    if processed:
+        cache.invalidate_tags('egfr_slopes')
+    return processed
+
+
+def fast_progressors(limit=10, threshold=None):
+    """eGFR年下降速度超过阈值的患者，下降最快的在前"""
+    if threshold is None:
+        threshold = current_app.config.get('EGFR_FAST_DECLINE', -5.0)
+    rows = db.session.execute(
+        select(EgfrSlope.patient_id, EgfrSlope.slope, EgfrSlope.n_points, EgfrSlope.last_egfr,
+               EgfrSlope.last_date, Patient.patient_id, Patient.name)
+        .join(Patient, EgfrSlope.patient_id == Patient.id)
+        .where(EgfrSlope.slope <= threshold)
+        .order_by(EgfrSlope.slope).limit(limit)
+    ).all()
+    return [
+        {
+            'patient_id': row[0],
+            'slope': row[1],
+            'n_points': row[2],
+            'last_egfr': row[3],
+            'last_date': row[4],
+            'patient_code': row[5],
+            'patient_name': row[6],
+        }
+        for row in rows
+    ]
+
+
+def init_analytics(app):
+    """注册eGFR斜率刷新命令"""
+    import click
+    app.config.setdefault('EGFR_SLOPE_MIN_POINTS', 3)
+    app.config.setdefault('EGFR_SLOPE_MIN_YEARS', 0.5)
+    app.config.setdefault('EGFR_FAST_DECLINE', -5.0)
+
+    @app.cli.command('refresh-egfr-slopes')
+    @click.option('--full', is_flag=True, help='重新计算全部患者，而不只是有新记录的患者')
+    def refresh_egfr_slopes_command(full):
+        """重新计算患者eGFR年变化率"""
+        print(f'已重新计算 {refresh_slopes(full)} 位患者的eGFR年变化率')
@@ -0,0 +1,72 @@
+from flask import request, jsonify
+from flask_login import login_required
+from datetime import date
+from app import app
+from worklist import get_worklist, worklist_item, BUCKET_UPCOMING, BUCKET_OVERDUE
+from trends import patient_trends, TREND_METRICS, DEFAULT_TREND_METRICS, MIN_TREND_POINTS
+from query_counter import query_budget
+import typeahead
+
+def json_value(value):
+    """日期转为ISO格式字符串，其余原样返回"""
+    return value.isoformat() if isinstance(value, date) else value
+
+def json_dict(data):
+    return {key: json_value(value) for key, value in data.items()}
+
+@app.route('/api/worklist')
+@login_required
+def api_worklist():
+    """随访工作清单（JSON）"""
+    bucket = request.args.get('bucket', BUCKET_UPCOMING)
+    if bucket not in (BUCKET_UPCOMING, BUCKET_OVERDUE):
+        return jsonify({'success': False, 'message': '未知的清单分组'}), 400
+    
+    today = date.today()
+    per_page = max(1, min(request.args.get('limit', app.config['WORKLIST_PAGE_SIZE'], type=int), 200))
+    pagination = get_worklist(
+        bucket,
+        today=today,
+        horizon_days=request.args.get('horizon', type=int),
+        overdue_days=request.args.get('overdue_days', type=int),
+        per_page=per_page,
+        cursor=request.args.get('cursor')
+    )
+    
+    return jsonify({
+        'success': True,
+        'bucket': bucket,
+        'items': [json_dict(worklist_item(record, today)) for record in pagination.items],
+        'next_cursor': pagination.next_cursor if pagination.has_next else None
+    })
+
+@app.route('/api/patients/search')
+@login_required
+def api_patient_search():
+    """患者选择器检索（按编号、姓名、电话前缀）"""
+    q = request.args.get('q', '').strip()
+    limit = max(1, min(request.args.get('limit', 10, type=int), 50))
+    if not q:
+        return jsonify({'success': True, 'items': []})
+    
+    return jsonify({'success': True, 'items': typeahead.search(q, limit)})
+
+@app.route('/api/patients/<int:patient_id>/trends')
+@query_budget(3)
+@login_required
+def api_patient_trends(patient_id):
+    """患者化验指标趋势（列式JSON，可用 max_points 降采样）"""
+    metrics = [m for m in request.args.get('metrics', '').split(',') if m] or list(DEFAULT_TREND_METRICS)
+    unknown = [m for m in metrics if m not in TREND_METRICS]
+    if unknown:
+        return jsonify({'success': False, 'message': f'未知的指标：{", ".join(unknown)}'}), 400
+    max_points = request.args.get('max_points', type=int)
+    if max_points is not None and max_points < MIN_TREND_POINTS:
+        return jsonify({'success': False, 'message': f'max_points 不能小于{MIN_TREND_POINTS}'}), 400
+    
+    metrics = tuple(dict.fromkeys(metrics))
+    series = patient_trends(patient_id, metrics, max_points)
+    if series is None:
+        return jsonify({'success': False, 'message': '患者不存在'}), 404
+    
+    return jsonify({'success': True, 'patient_id': patient_id, 'metrics': metrics, 'series': series})
@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+"""
+JSON接口 v1（/api/v1）
+
+供病区平板、检验中间件等系统对接，不再需要模拟提交HTML表单。
+
+- 字段使用模型的列名，按列类型校验和转换（与批量导入使用同一套规则），
+  未知字段、BMI等由系统计算的字段会被拒绝
+- 写入通过ORM完成，派生指标、全文索引、缓存和eGFR斜率与页面录入一样自动维护
+- POST /api/v1/records/batch 一次提交多条随访记录：先逐条校验，合法的记录一次刷新写入；
+  数据库拒绝时改为每条记录一个保存点，出错的记录回滚后返回原因，其余记录在同一个事务中提交；
+  请求中 "atomic": true 时任一记录出错则全部不保存
+- 列表接口使用键集分页，响应中的 next_cursor 作为下一页的 cursor 参数
+- 未登录时返回401 JSON，而不是跳转到登录页
+"""
+from flask import request, jsonify
+from flask_login import login_required, current_user
+from sqlalchemy import select, or_
+from sqlalchemy.exc import SQLAlchemyError
+from app import app
+from database import db
+from models import Patient, FollowupRecord, to_dict
+from importer import column_converters, GENDERS
+from derived import compute_age
+from sequences import next_patient_id, advance_patient_id
+from api import json_dict
+from search import patient_search_filter, record_list_filters
+from pagination import keyset_paginate
+from query_counter import query_budget
+
+MAX_PAGE_SIZE = 200
+
+
+def _serialize(obj):
+    return json_dict(to_dict(obj))
+
+
+def _error(message, status=400, **extra):
+    return jsonify({'success': False, 'message': message, **extra}), status
+
+
+def _db_error(e):
+    """数据库异常只返回驱动的错误信息，不包含SQL语句"""
+    return str(getattr(e, 'orig', None) or e)
+
+
+def _page_size():
+    return max(1, min(request.args.get('limit', app.config['API_PAGE_SIZE'], type=int), MAX_PAGE_SIZE))
+
+
+def _parse_values(model, data):
+    """按模型的列校验和转换JSON对象，返回 列名 -> 值；出错时抛出 ValueError"""
+    if not isinstance(data, dict):
+        raise ValueError('数据应为JSON对象')
+    converters = column_converters(model)
+    unknown = [key for key in data if key not in converters]
+    if unknown:
+        raise ValueError(f'未知或不可写入的字段：{", ".join(unknown)}')
+    values = {}
+    for key, value in data.items():
+        label, convert = converters[key]
+        if value is None or (isinstance(value, str) and not value.strip()):
+            values[key] = None
+            continue
+        if isinstance(value, (bool, dict, list)):
+            raise ValueError(f'{key}（{label}）：类型不正确')
+        try:
+            values[key] = convert(value)
+        except ValueError as e:
+            raise ValueError(f'{key}（{label}）：{e}')
+    return values
+
+
+def _parse_record(item):
+    """解析一条随访记录，患者可以用 patient_id（数据库ID）或 patient_code（患者编号）指定"""
+    if not isinstance(item, dict):
+        raise ValueError('数据应为JSON对象')
+    item = dict(item)
+    code = item.pop('patient_code', None)
+    values = _parse_values(FollowupRecord, item)
+    if code is not None:
+        code = str(code).strip()
+    if code is None and values.get('patient_id') is None:
+        raise ValueError('缺少 patient_id 或 patient_code')
+    if values.get('followup_date') is None:
+        raise ValueError('随访日期不能为空')
+    return values, code
+
+
+def _resolve_patients(parsed):
+    """一次查询所有记录引用的患者，返回 (患者编号 -> 患者ID, 存在的患者ID集合)"""
+    codes = {code for values, code in parsed if code}
+    ids = {values['patient_id'] for values, _ in parsed if values.get('patient_id') is not None}
+    if not codes and not ids:
+        return {}, set()
+    rows = db.session.execute(
+        select(Patient.id, Patient.patient_id).where(or_(Patient.patient_id.in_(codes), Patient.id.in_(ids)))
+    ).all()
+    return {code: patient_id for patient_id, code in rows}, {patient_id for patient_id, _ in rows}
+
+
+def _bind_patient(values, code, by_code, existing_ids):
+    if code:
+        if code not in by_code:
+            raise ValueError(f'患者编号 {code} 不存在')
+        if values.get('patient_id') not in (None, by_code[code]):
+            raise ValueError('patient_id 与 patient_code 不是同一位患者')
+        values['patient_id'] = by_code[code]
+    elif values['patient_id'] not in existing_ids:
+        raise ValueError(f'患者 {values["patient_id"]} 不存在')
+    return values
+
+
+def _add_record(values):
+    """在保存点中写入一条随访记录，失败时只回滚这一条"""
+    with db.session.begin_nested():
+        record = FollowupRecord(**values, recorded_by=current_user.id)
+        db.session.add(record)
+    return record
+
+
+def _add_records(valid, results):
+    """写入已校验的记录 [(下标, 值)]，把每条的结果追加到 results，返回写入的记录
+
+    先在一个保存点中一次刷新全部记录（INSERT按批执行）；数据库拒绝时回滚这个保存点，
+    改为每条记录一个保存点，只跳过出错的记录。
+    """
+    try:
+        with db.session.begin_nested():
+            created = [(index, FollowupRecord(**values, recorded_by=current_user.id)) for index, values in valid]
+            db.session.add_all([record for _, record in created])
+    except SQLAlchemyError:
+        created = []
+        for index, values in valid:
+            try:
+                created.append((index, _add_record(values)))
+            except SQLAlchemyError as e:
+                results.append({'index': index, 'success': False, 'message': _db_error(e)})
+    results.extend({'index': index, 'success': True, 'id': record.id} for index, record in created)
+    return [record for _, record in created]
+
+
+@app.route('/api/v1/patients')
+@query_budget(3)
+@login_required
+def api_v1_patients():
+    """患者列表，可用 search 检索，按数据库ID升序分页"""
+    query = Patient.query
+    search = request.args.get('search', '').strip()
+    if search:
+        query = query.filter(patient_search_filter(search))
+    pagination = keyset_paginate(query, (Patient.id,), cursor=request.args.get('cursor'),
+                                 per_page=_page_size(), descending=False)
+    return jsonify({
+        'success': True,
+        'items': [_serialize(patient) for patient in pagination.items],
+        'next_cursor': pagination.next_cursor if pagination.has_next else None,
+    })
+
+
+@app.route('/api/v1/patients/<int:patient_id>')
+@query_budget(2)
+@login_required
+def api_v1_patient(patient_id):
+    """患者详情"""
+    patient = db.session.get(Patient, patient_id)
+    if patient is None:
+        return _error('患者不存在', 404)
+    return jsonify({'success': True, 'patient': _serialize(patient)})
+
+
+@app.route('/api/v1/patients', methods=['POST'])
+@login_required
+def api_v1_create_patient():
+    """新建患者；未提供 patient_id（患者编号）时自动分配"""
+    try:
+        values = _parse_values(Patient, request.get_json(silent=True))
+        if not values.get('name'):
+            raise ValueError('姓名不能为空')
+        if values.get('gender') not in GENDERS:
+            raise ValueError('性别应为“男”或“女”')
+    except ValueError as e:
+        return _error(str(e))
+
+    if values.get('patient_id'):
+        if db.session.scalar(select(Patient.id).where(Patient.patient_id == values['patient_id'])):
+            return _error(f'患者编号 {values["patient_id"]} 已存在', 409)
+        # 与新患者在同一事务中推进编号序列，以后自动分配的编号不会与之重复
+        advance_patient_id(db.session, [values['patient_id']])
+    else:
+        values['patient_id'] = next_patient_id()
+    if values.get('birth_date'):
+        values['age'] = compute_age(values['birth_date'])
+
+    try:
+        patient = Patient(**values, created_by=current_user.id)
+        db.session.add(patient)
+        db.session.commit()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        return _error(f'添加患者失败：{_db_error(e)}', 500)
+    return jsonify({'success': True, 'patient': _serialize(patient)}), 201
+
+
+@app.route('/api/v1/records')
+@query_budget(3)
+@login_required
+def api_v1_records():
+    """随访记录列表，筛选参数与 /records 相同（search、q、patient_id），按随访日期倒序分页"""
+    query = FollowupRecord.query.join(Patient, FollowupRecord.patient_id == Patient.id).filter(
+        *record_list_filters(request.args.get('search', ''), request.args.get('q', ''),
+                             request.args.get('patient_id', type=int))
+    )
+    pagination = keyset_paginate(query, (FollowupRecord.followup_date, FollowupRecord.id),
+                                 cursor=request.args.get('cursor'), per_page=_page_size())
+    return jsonify({
+        'success': True,
+        'items': [_serialize(record) for record in pagination.items],
+        'next_cursor': pagination.next_cursor if pagination.has_next else None,
+    })
+
+
+@app.route('/api/v1/records/<int:record_id>')
+@query_budget(2)
+@login_required
+def api_v1_record(record_id):
+    """随访记录详情"""
+    record = db.session.get(FollowupRecord, record_id)
+    if record is None:
+        return _error('随访记录不存在', 404)
+    return jsonify({'success': True, 'record': _serialize(record)})
+
+
+@app.route('/api/v1/records', methods=['POST'])
+@login_required
+def api_v1_create_record():
+    """新建一条随访记录"""
+    try:
+        values, code = _parse_record(request.get_json(silent=True))
+        values = _bind_patient(values, code, *_resolve_patients([(values, code)]))
+        record = _add_record(values)
+        db.session.commit()
+    except ValueError as e:
+        db.session.rollback()
+        return _error(str(e))
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        return _error(f'保存随访记录失败：{_db_error(e)}', 500)
+    return jsonify({'success': True, 'record': _serialize(record)}), 201
+
+
+@app.route('/api/v1/records/batch', methods=['POST'])
+@login_required
+def api_v1_records_batch():
+    """批量新建随访记录，请求体为 {"records": [...], "atomic": false}，逐条返回结果"""
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict) or not isinstance(payload.get('records'), list):
+        return _error('请求体应为 {"records": [...]}')
+    items = payload['records']
+    max_records = app.config['API_BATCH_MAX_RECORDS']
+    if not items:
+        return _error('records 不能为空')
+    if len(items) > max_records:
+        return _error(f'每次最多提交{max_records}条记录', 413)
+
+    # 先校验全部记录并一次查出引用的患者，再逐条写入
+    parsed, results = [], []
+    for index, item in enumerate(items):
+        try:
+            parsed.append((index, _parse_record(item)))
+        except ValueError as e:
+            results.append({'index': index, 'success': False, 'message': str(e)})
+    by_code, existing_ids = _resolve_patients([entry for _, entry in parsed])
+
+    valid = []
+    for index, (values, code) in parsed:
+        try:
+            valid.append((index, _bind_patient(values, code, by_code, existing_ids)))
+        except ValueError as e:
+            results.append({'index': index, 'success': False, 'message': str(e)})
+    created = _add_records(valid, results)
+    results.sort(key=lambda result: result['index'])
+    failed = len(items) - len(created)
+
+    if payload.get('atomic') and failed:
+        db.session.rollback()
+        for result in results:
+            result.pop('id', None)
+        return _error(f'{failed}条记录有误，全部未保存', results=results, created=0, failed=failed)
+    try:
+        db.session.commit()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        return _error(f'保存随访记录失败：{_db_error(e)}', 500)
+    return jsonify({'success': failed == 0, 'created': len(created), 'failed': failed, 'results': results})
@@ -1,36 +1,105 @@
-from flask import Flask
+from flask import Flask, request, jsonify, flash, redirect
 from config import Config
-from flask_login import LoginManager
+from flask_login import LoginManager, login_url
 from database import db
+from sqlite_profile import init_database
+from replica import init_replica
+from query_counter import init_query_counter
+from cache import init_cache, invalidates, current_and_previous
 import os
 
 app = Flask(__name__)
 app.config.from_object(Config)
 
-# 初始化数据库
-db.init_app(app)
+# 初始化数据库（只读副本、连接池参数和SQLite连接的PRAGMA）
+init_replica(app)
+init_database(app, db)
+init_query_counter(app)
 
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
 login_manager.login_message = '请先登录以访问此页面。'
 login_manager.login_message_category = 'info'
 
+# 请求耗时、SQL和模板耗时等指标，/metrics 输出
+from metrics import init_metrics
+init_metrics(app)
+
 # 确保static目录存在
 os.makedirs('static', exist_ok=True)
 
 # 导入模型（必须在db初始化之后）
 from models import User, Patient, FollowupRecord, SystemSetting
+from search import init_search
+
+init_search(app)
+
+# 慢查询记录（超过阈值的语句连同执行计划保存，系统设置页面查看）
+from slow_queries import init_slow_queries
+init_slow_queries(app)
+
+# 缓存：提交后按写入的对象失效对应标签
+init_cache(app)
+invalidates(User, lambda user: ('users', f'user:{user.id}'))
+invalidates(Patient, lambda patient: ('patients', f'patient:{patient.id}'))
+# 随访记录改到另一位患者名下时，原患者的详情页也要失效
+invalidates(FollowupRecord, lambda record: (
+    'records', *(f'patient:{patient_id}' for patient_id in current_and_previous(record, 'patient_id'))))
+
+# 模板字节码缓存和 {% cache %} 片段缓存
+from templating import init_templating
+init_templating(app)
+
+# 批量导入、导出命令行命令
+from importer import init_importer
+from export import init_export
+init_importer(app)
+init_export(app)
+
+# eGFR年变化率汇总（随访记录写入后标记待更新）
+from analytics import init_analytics
+init_analytics(app)
+
+# 派生指标（BMI、CKD-EPI eGFR）写入时计算和回填命令
+from derived import init_derived
+init_derived(app)
+
+# 系统设置读入内存，按计数器表中的版本号在进程间同步
+from settings import init_settings
+init_settings(app)
+
+# 登录用户按ID缓存，不再每个请求查询一次
+import users
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return users.load_user(int(user_id))
+
+# 未登录访问：JSON接口（/api/v1）返回401，页面跳转到登录页
+API_V1_PREFIX = '/api/v1'
+
+@login_manager.unauthorized_handler
+def unauthorized():
+    if request.path.startswith(API_V1_PREFIX + '/'):
+        return jsonify({'success': False, 'message': '请先登录'}), 401
+    flash(login_manager.login_message, login_manager.login_message_category)
+    return redirect(login_url(login_manager.login_view, request.url))
+
+# 数据库版本迁移、索引检查命令
+from migrate import init_migrate, upgrade
+from index_advisor import init_index_advisor
+init_migrate(app)
+init_index_advisor(app)
 
 from routes import *
+from api import *
+import api_v1
+import typeahead
 
 if __name__ == '__main__':
     with app.app_context():
         try:
-            db.create_all()
+            upgrade(out=print)
             print("数据库表创建成功")
             # 初始化示例数据
             try:
@@ -40,6 +109,8 @@ if __name__ == '__main__':
                 print(f"示例数据初始化错误: {e}")
                 import traceback
                 traceback.print_exc()
+            # 预加载患者选择器索引
+            typeahead.warm()
         except Exception as e:
             print(f"数据库初始化错误: {e}")
             import traceback
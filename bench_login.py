@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+登录吞吐量测试
+
+对每组密码哈希参数，用临时SQLite数据库和多个并发客户端反复请求 /login，
+输出每秒成功登录数和延迟，用于在本机硬件上选择 PASSWORD_HASH_METHOD。
+
+用法：
+    python bench_login.py
+    python bench_login.py --methods scrypt:16384:8:1 pbkdf2:sha256:600000 --requests 200 --concurrency 16
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+DEFAULT_METHODS = ['scrypt:32768:8:1', 'scrypt:16384:8:1', 'pbkdf2:sha256:600000', 'pbkdf2:sha256:100000']
+USERNAME = 'bench'
+PASSWORD = 'bench-password'
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='测试不同密码哈希参数下的登录吞吐量')
+    parser.add_argument('--methods', nargs='+', default=DEFAULT_METHODS, help='Werkzeug格式的哈希参数')
+    parser.add_argument('--requests', type=int, default=100, help='每组参数的登录请求数')
+    parser.add_argument('--concurrency', type=int, default=8, help='并发客户端数')
+    parser.add_argument('--workers', type=int, default=None, help='校验线程数（默认使用 PASSWORD_HASH_WORKERS）')
+    return parser.parse_args()
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def run(app, total, concurrency):
+    """并发发送 total 个登录请求，返回 (耗时, 成功数, 繁忙数, 延迟列表)"""
+    latencies, statuses = [], []
+    lock = threading.Lock()
+    remaining = iter(range(total))
+
+    def client():
+        while True:
+            with lock:
+                if next(remaining, None) is None:
+                    return
+            # 每次使用新的客户端，已登录的会话不会再校验密码
+            started = time.perf_counter()
+            response = app.test_client().post('/login', data={'username': USERNAME, 'password': PASSWORD})
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                statuses.append(response.status_code)
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    return elapsed, statuses.count(302), statuses.count(503), latencies
+
+
+def main():
+    args = parse_args()
+    directory = tempfile.mkdtemp()
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(directory, 'bench_login.db')
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    from app import app
+    from database import db
+    from models import User
+    from search import ensure_indexes
+    import passwords
+
+    if args.workers:
+        app.config['PASSWORD_HASH_WORKERS'] = args.workers
+    with app.app_context():
+        db.create_all()
+        # 先建好全文索引，避免并发的第一批请求同时创建
+        ensure_indexes()
+
+    print(f'每组 {args.requests} 次登录，{args.concurrency} 个并发客户端，'
+          f'{app.config["PASSWORD_HASH_WORKERS"]} 个校验线程')
+    print(f'{"参数":<26}{"单次哈希(ms)":>14}{"登录/秒":>10}{"p50(ms)":>10}{"p95(ms)":>10}{"繁忙":>6}')
+    for method in args.methods:
+        method = passwords.normalize_method(method)
+        app.config['PASSWORD_HASH_METHOD'] = method
+        with app.app_context():
+            started = time.perf_counter()
+            password_hash = passwords.hash_password(PASSWORD)
+            hash_ms = (time.perf_counter() - started) * 1000
+            user = User.query.filter_by(username=USERNAME).first()
+            if user is None:
+                user = User(username=USERNAME, real_name='压测用户', role='staff')
+                db.session.add(user)
+            user.password_hash = password_hash
+            db.session.commit()
+
+        elapsed, succeeded, busy, latencies = run(app, args.requests, args.concurrency)
+        print(f'{method:<26}{hash_ms:>14.1f}{succeeded / elapsed:>10.1f}'
+              f'{statistics.median(latencies) * 1000:>10.1f}{percentile(latencies, 95) * 1000:>10.1f}{busy:>6}')
+    passwords.shutdown()
+
+
+if __name__ == '__main__':
+    main()
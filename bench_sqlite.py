@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+SQLite并发读写测试
+
+分别用SQLite默认参数（回滚日志、synchronous=FULL）和当前配置的连接参数（sqlite_profile.py）
+建立测试数据库，多个读进程和写进程同时运行一段时间，输出每秒读写次数、写入延迟和
+database is locked 错误数。
+
+用法：
+    python bench_sqlite.py
+    python bench_sqlite.py --readers 8 --writers 4 --seconds 10 --patients 2000
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+READ_SQL = ('SELECT id, followup_date, serum_creatinine, egfr FROM followup_records '
+            'WHERE patient_id = :patient_id ORDER BY followup_date DESC LIMIT 20')
+COUNT_SQL = 'SELECT count(*) FROM followup_records WHERE followup_date >= :since'
+WRITE_SQL = ('INSERT INTO followup_records (patient_id, followup_date, serum_creatinine, egfr, created_at, updated_at) '
+             'VALUES (:patient_id, :followup_date, :serum_creatinine, :egfr, :now, :now)')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='比较SQLite默认参数和当前配置下的并发读写吞吐量')
+    parser.add_argument('--readers', type=int, default=4, help='读进程数')
+    parser.add_argument('--writers', type=int, default=2, help='写进程数')
+    parser.add_argument('--seconds', type=float, default=5, help='每组参数的运行秒数')
+    parser.add_argument('--patients', type=int, default=1000, help='测试数据的患者数（每人10条随访记录）')
+    return parser.parse_args()
+
+
+def make_engine(url, pragmas):
+    from sqlalchemy import create_engine
+    from sqlite_profile import listen_pragmas
+
+    engine = create_engine(url)
+    if pragmas:
+        listen_pragmas(engine, pragmas)
+    return engine
+
+
+def setup_database(url, pragmas, patients):
+    from sqlalchemy import insert
+    from database import db
+    import models  # noqa: F401  注册全部表
+
+    engine = make_engine(url, pragmas)
+    db.metadata.create_all(engine)
+    today = date.today()
+    with engine.begin() as connection:
+        connection.execute(insert(models.Patient.__table__), [
+            {'patient_id': f'B-{i:06d}', 'name': f'测试{i}', 'gender': '男' if i % 2 else '女'}
+            for i in range(1, patients + 1)
+        ])
+        connection.execute(insert(models.FollowupRecord.__table__), [
+            {'patient_id': i, 'followup_date': today - timedelta(days=30 * k),
+             'serum_creatinine': 80 + k, 'egfr': 90 - k}
+            for i in range(1, patients + 1) for k in range(10)
+        ])
+    engine.dispose()
+
+
+def worker(kind, url, pragmas, patients, seconds, results):
+    """在 seconds 秒内循环读或写，结果放入 results 队列"""
+    from datetime import datetime
+    from sqlalchemy import text
+    from sqlalchemy.exc import OperationalError
+
+    engine = make_engine(url, pragmas)
+    rng = random.Random(os.getpid())
+    operations, errors, latencies = 0, 0, []
+    since = date.today() - timedelta(days=90)
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        try:
+            if kind == 'read':
+                with engine.connect() as connection:
+                    connection.execute(text(READ_SQL), {'patient_id': rng.randint(1, patients)}).all()
+                    connection.execute(text(COUNT_SQL), {'since': since}).scalar()
+            else:
+                with engine.begin() as connection:
+                    connection.execute(text(WRITE_SQL), {
+                        'patient_id': rng.randint(1, patients), 'followup_date': date.today(),
+                        'serum_creatinine': rng.uniform(60, 200), 'egfr': rng.uniform(20, 110),
+                        'now': datetime.now(),
+                    })
+        except OperationalError:
+            errors += 1
+            continue
+        operations += 1
+        latencies.append(time.perf_counter() - started)
+    engine.dispose()
+    results.put((kind, operations, errors, latencies))
+
+
+def run_profile(name, pragmas, args):
+    directory = tempfile.mkdtemp()
+    url = 'sqlite:///' + os.path.join(directory, 'bench.db')
+    setup_database(url, pragmas, args.patients)
+
+    results = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=worker, args=(kind, url, pragmas, args.patients, args.seconds, results))
+        for kind in ['read'] * args.readers + ['write'] * args.writers
+    ]
+    for process in processes:
+        process.start()
+    collected = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    summary = {}
+    for kind in ('read', 'write'):
+        rows = [row for row in collected if row[0] == kind]
+        latencies = sorted(latency for row in rows for latency in row[3])
+        summary[kind] = {
+            'per_second': sum(row[1] for row in rows) / args.seconds,
+            'errors': sum(row[2] for row in rows),
+            'p50': statistics.median(latencies) * 1000 if latencies else 0.0,
+            'p95': latencies[int(len(latencies) * 0.95)] * 1000 if latencies else 0.0,
+        }
+    print(f'{name:<10}'
+          f'{summary["read"]["per_second"]:>10.0f}{summary["read"]["p95"]:>10.1f}'
+          f'{summary["write"]["per_second"]:>10.0f}{summary["write"]["p50"]:>10.1f}{summary["write"]["p95"]:>10.1f}'
+          f'{summary["read"]["errors"] + summary["write"]["errors"]:>8}')
+
+
+def main():
+    args = parse_args()
+    from config import Config
+    from sqlite_profile import sqlite_pragmas
+
+    configured = sqlite_pragmas({key: getattr(Config, key) for key in dir(Config) if key.startswith('SQLITE_')})
+    print(f'{args.readers} 个读进程，{args.writers} 个写进程，每组 {args.seconds} 秒，{args.patients} 位患者')
+    print('当前配置：' + '，'.join(f'{pragma}={value}' for pragma, value in configured))
+    print(f'{"参数":<10}{"读/秒":>10}{"读p95ms":>10}{"写/秒":>10}{"写p50ms":>10}{"写p95ms":>10}{"锁错误":>8}')
+    run_profile('默认', [], args)
+    run_profile('当前配置', configured, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,338 @@
+# -*- coding: utf-8 -*-
+"""
+服务端缓存
+
+提供带标签失效的缓存，用于缓存仪表盘统计、患者详情等读多写少的页面数据。
+
+- memory 后端：进程内LRU缓存，条目带TTL，默认使用
+- redis 后端：本地Redis（或兼容服务），多个工作进程共享缓存，需要安装 redis 包
+
+标签失效采用“版本号”方式：每个标签对应一个版本号，缓存键中带上其标签的
+当前版本号；失效一个标签只需把版本号加一，旧条目自然无法再命中并在LRU/TTL下淘汰。
+会话提交（after_commit）后，根据本次事务中新增、修改、删除的患者和随访记录
+自动失效对应的标签。
+
+memory 后端的缓存条目在每个进程中各自保存，标签版本号则默认保存在数据库计数器表
+（counters，名称为 cache_tag:<标签>）中：会话刷新时在同一事务中加一，所有工作进程
+读取同一个版本号，一个进程中的修改提交后其他进程的旧条目立即失效。每个请求第一次
+用到标签时查询一次版本号，并顺带读取本进程最近用过的其他标签（登录用户、页面数据的标签
+通常在同一条查询中读出），同一请求内不再重复查询。
+单进程部署可设置 CACHE_SHARED_TAGS=0，版本号改为保存在进程内存中。
+
+缓存的值应当是普通数据（dict、list、数字、日期），不要缓存ORM对象。
+"""
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from flask import g, has_app_context
+from sqlalchemy import event, inspect, select, text
+from sqlalchemy.orm import Session
+from database import db
+from replica import primary
+
+_MISSING = object()
+
+
+class MemoryBackend:
+    """进程内LRU缓存，条目超过TTL后视为过期"""
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return _MISSING
+            value, expires_at = item
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._data[key]
+                return _MISSING
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def get_counters(self, names):
+        with self._lock:
+            return [self._counters.get(name, 0) for name in names]
+
+    def incr(self, name):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._counters.clear()
+
+    def size(self):
+        return len(self._data)
+
+
+class RedisBackend:
+    """Redis缓存后端，多个工作进程共享缓存和标签版本号"""
+
+    def __init__(self, url, prefix='iga:'):
+        import redis
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        raw = self._client.get(self.prefix + key)
+        return _MISSING if raw is None else pickle.loads(raw)
+
+    def set(self, key, value, ttl=None):
+        self._client.set(self.prefix + key, pickle.dumps(value), ex=ttl or None)
+
+    def delete(self, key):
+        self._client.delete(self.prefix + key)
+
+    def get_counters(self, names):
+        if not names:
+            return []
+        return [int(v or 0) for v in self._client.mget([self.prefix + 'tag:' + n for n in names])]
+
+    def incr(self, name):
+        self._client.incr(self.prefix + 'tag:' + name)
+
+    def clear(self):
+        for key in self._client.scan_iter(self.prefix + '*'):
+            self._client.delete(key)
+
+    def size(self):
+        return self._client.dbsize()
+
+
+class DatabaseTagVersions:
+    """标签版本号保存在数据库计数器表中，所有工作进程共享"""
+
+    prefix = 'cache_tag:'
+
+    def __init__(self, max_recent=256):
+        # 本进程最近用过的标签，请求中第一次查询版本号时一并读取
+        self._recent = OrderedDict()
+        self._max_recent = max_recent
+        self._lock = threading.Lock()
+
+    def _remember(self, names):
+        with self._lock:
+            for name in names:
+                self._recent[name] = None
+                self._recent.move_to_end(name)
+            while len(self._recent) > self._max_recent:
+                self._recent.popitem(last=False)
+
+    def get(self, names):
+        """读取版本号（不存在的为0），同一请求内读过的标签不再查询"""
+        if has_app_context():
+            known = g.setdefault('cache_tag_versions', {})
+            with self._lock:
+                recent = [name for name in self._recent if name not in known]
+        else:
+            known, recent = {}, []
+        missing = [name for name in names if name not in known]
+        if missing:
+            from models import Counter
+            wanted = list(dict.fromkeys(missing + recent))
+            # 版本号须从主库读取，副本上的旧版本号会命中已失效的条目
+            with primary():
+                rows = dict(db.session.execute(
+                    select(Counter.name, Counter.value).where(Counter.name.in_([self.prefix + n for n in wanted]))
+                ).all())
+            for name in wanted:
+                known[name] = rows.get(self.prefix + name, 0)
+        self._remember(names)
+        return [known[name] for name in names]
+
+    def bump(self, connection, names):
+        """在 connection 的事务中把标签的版本号加一，计数器不存在时创建"""
+        if not names:
+            return
+        connection.execute(
+            text('INSERT INTO counters (name, value) VALUES (:name, 1) '
+                 'ON CONFLICT (name) DO UPDATE SET value = value + 1'),
+            [{'name': self.prefix + name} for name in names]
+        )
+        if has_app_context():
+            known = g.get('cache_tag_versions')
+            for name in names if known else ():
+                known.pop(name, None)
+
+    def incr(self, names):
+        with db.engine.begin() as connection:
+            self.bump(connection, names)
+
+
+class Cache:
+    """带标签失效和命中统计的缓存"""
+
+    def __init__(self, backend=None, default_ttl=300):
+        self.backend = backend or MemoryBackend()
+        self.default_ttl = default_ttl
+        self.enabled = True
+        # 不为空时标签版本号保存在数据库中（DatabaseTagVersions）
+        self.tag_versions = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @property
+    def distributed(self):
+        """缓存条目和标签版本号是否由所有工作进程共享（redis 后端）"""
+        return self.enabled and isinstance(self.backend, RedisBackend)
+
+    @property
+    def shared(self):
+        """标签失效是否对所有工作进程生效"""
+        return not self.enabled or self.tag_versions is not None or isinstance(self.backend, RedisBackend)
+
+    def _versioned_key(self, key, tags):
+        if not tags:
+            return key
+        if self.tag_versions is not None:
+            versions = self.tag_versions.get(list(tags))
+        else:
+            versions = self.backend.get_counters(list(tags))
+        return key + '|' + ','.join(f'{tag}={version}' for tag, version in zip(tags, versions))
+
+    def get(self, key, tags=()):
+        """读取缓存，未命中返回None"""
+        value = self.backend.get(self._versioned_key(key, tags)) if self.enabled else _MISSING
+        if value is _MISSING:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def set(self, key, value, tags=(), ttl=None):
+        if self.enabled:
+            self.backend.set(self._versioned_key(key, tags), value, ttl or self.default_ttl)
+
+    def get_or_set(self, key, creator, tags=(), ttl=None):
+        """命中时返回缓存值，否则调用creator()计算并写入缓存；creator()返回None（如记录不存在）时不缓存"""
+        if not self.enabled:
+            return creator()
+        versioned_key = self._versioned_key(key, tags)
+        value = self.backend.get(versioned_key)
+        if value is not _MISSING:
+            self.hits += 1
+            return value
+        self.misses += 1
+        # 缓存的值从主库计算，不把只读副本上尚未同步的旧数据写进缓存
+        with primary():
+            value = creator()
+        if value is not None:
+            self.backend.set(versioned_key, value, ttl or self.default_ttl)
+        return value
+
+    def invalidate_tags(self, *tags):
+        """使带有这些标签的缓存全部失效"""
+        if self.tag_versions is not None:
+            self.tag_versions.incr(tags)
+        else:
+            for tag in tags:
+                self.backend.incr(tag)
+        self.invalidations += len(tags)
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'backend': type(self.backend).__name__,
+            'enabled': self.enabled,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 4) if total else 0.0,
+            'invalidations': self.invalidations,
+            'size': self.backend.size(),
+        }
+
+
+cache = Cache()
+
+# 写入后需要失效的标签：model类 -> 根据对象返回标签列表的函数
+_tag_rules = {}
+
+
+def invalidates(model, tags_for):
+    """登记某个模型的对象被写入后需要失效的缓存标签"""
+    _tag_rules[model] = tags_for
+
+
+def current_and_previous(obj, key):
+    """对象某个属性的当前值和本次刷新前的旧值（用于外键被修改时同时失效原来的对象），不含None"""
+    values = {getattr(obj, key)}
+    values.update(inspect(obj).attrs[key].history.deleted)
+    values.discard(None)
+    return values
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_tags(session, flush_context):
+    tags = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        tags_for = _tag_rules.get(type(obj))
+        if tags_for is not None:
+            tags.update(tags_for(obj))
+    invalidate_in_session(session, tags)
+
+
+def invalidate_in_session(session, tags):
+    """随会话的当前事务失效标签，用于不经过ORM对象的写入（如按条件批量更新）"""
+    if not tags:
+        return
+    if cache.tag_versions is not None:
+        # 版本号与数据在同一事务中修改，提交后所有进程同时看到
+        cache.tag_versions.bump(session.connection(), sorted(tags))
+        cache.invalidations += len(tags)
+    else:
+        session.info.setdefault('cache_tags', set()).update(tags)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_committed(session):
+    tags = session.info.pop('cache_tags', None)
+    if tags:
+        cache.invalidate_tags(*sorted(tags))
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_tags(session):
+    session.info.pop('cache_tags', None)
+
+
+def init_cache(app):
+    """根据配置创建缓存后端"""
+    app.config.setdefault('CACHE_BACKEND', 'memory')
+    app.config.setdefault('CACHE_DEFAULT_TTL', 300)
+    app.config.setdefault('CACHE_MAX_ENTRIES', 1024)
+    app.config.setdefault('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+    app.config.setdefault('CACHE_SHARED_TAGS', True)
+
+    if app.config['CACHE_BACKEND'] == 'redis':
+        cache.backend = RedisBackend(app.config['CACHE_REDIS_URL'])
+    elif app.config['CACHE_BACKEND'] == 'none':
+        cache.enabled = False
+    else:
+        cache.backend = MemoryBackend(app.config['CACHE_MAX_ENTRIES'])
+        if app.config['CACHE_SHARED_TAGS']:
+            cache.tag_versions = DatabaseTagVersions()
+    cache.default_ttl = app.config['CACHE_DEFAULT_TTL']
+    app.extensions['cache'] = cache
@@ -5,3 +5,106 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///iga_followup.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    # SQLite连接参数（每个连接建立时执行PRAGMA）：日志模式、等待写锁的毫秒数、同步级别、
+    # 页缓存大小（负数为KiB）、内存映射字节数、是否启用外键约束
+    SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE') or 'WAL'
+    SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT') or 5000)
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS') or 'NORMAL'
+    SQLITE_CACHE_SIZE = int(os.environ.get('SQLITE_CACHE_SIZE') or -65536)
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE') or 268435456)
+    SQLITE_FOREIGN_KEYS = os.environ.get('SQLITE_FOREIGN_KEYS', '1') != '0'
+
+    # 数据库连接池：常驻连接数、允许额外创建的连接数、等待空闲连接的秒数
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE') or 10)
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW') or 20)
+    DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT') or 30)
+
+    # 只读副本（可选）：GET请求的查询改从副本读取，写入和刚写入后的读取使用主库
+    SQLALCHEMY_REPLICA_URI = os.environ.get('DATABASE_REPLICA_URL') or None
+    # 用户提交写入后多少秒内，该用户的请求仍读主库（读己之写）
+    REPLICA_STICKY_SECONDS = int(os.environ.get('REPLICA_STICKY_SECONDS') or 10)
+
+    # 单次请求默认允许的最大SQL查询数（未设置则只检查声明了预算的页面）
+    SQL_QUERY_BUDGET = int(os.environ['SQL_QUERY_BUDGET']) if os.environ.get('SQL_QUERY_BUDGET') else None
+    # 是否在响应头 X-SQL-Query-Count 中返回查询数（调试和测试模式下总是返回）
+    SQL_QUERY_COUNT_HEADER = os.environ.get('SQL_QUERY_COUNT_HEADER') == '1'
+    # 慢查询阈值（毫秒），超过的语句连同执行计划记录下来；设置为0则不记录
+    SLOW_QUERY_THRESHOLD_MS = float(os.environ.get('SLOW_QUERY_THRESHOLD_MS') or 200)
+    # 保存最近多少条慢查询
+    SLOW_QUERY_LOG_SIZE = int(os.environ.get('SLOW_QUERY_LOG_SIZE') or 100)
+    # 是否记录慢查询的参数（可能包含患者姓名、电话等信息，默认不记录，排查问题时设为1）
+    SLOW_QUERY_LOG_PARAMETERS = os.environ.get('SLOW_QUERY_LOG_PARAMETERS', '0') == '1'
+    # 是否统计请求指标（/metrics）
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') != '0'
+    # 采集程序访问 /metrics 时使用的令牌（Authorization: Bearer <令牌>），未设置则只允许管理员登录后访问
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN') or None
+    # 多进程部署时各进程指标的汇总目录
+    METRICS_DIR = os.environ.get('METRICS_DIR') or None
+    # 各进程把指标写入汇总目录的间隔（秒）
+    METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL') or 5)
+
+    # 密码哈希算法和参数（Werkzeug格式，如 scrypt:32768:8:1、pbkdf2:sha256:600000），修改后用户下次登录时按新参数重新哈希
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD') or 'scrypt:32768:8:1'
+    # 同时校验密码的线程数、允许排队的登录数、等待校验结果的最长秒数
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS') or min(os.cpu_count() or 2, 4))
+    PASSWORD_HASH_QUEUE = int(os.environ.get('PASSWORD_HASH_QUEUE') or 32)
+    PASSWORD_HASH_TIMEOUT = float(os.environ.get('PASSWORD_HASH_TIMEOUT') or 10)
+
+    # 列表分页模式：keyset（游标分页，翻页代价恒定）或 offset（传统页码分页）
+    PAGINATION_MODE = os.environ.get('PAGINATION_MODE') or 'keyset'
+    # 游标分页时是否显示估算的总条数
+    PAGINATION_APPROX_TOTAL = os.environ.get('PAGINATION_APPROX_TOTAL', '1') != '0'
+
+    # 生产环境启动（serve.py）：监听地址、工作进程数、每个进程的线程数、请求超时和平滑退出等待时间（秒）、
+    # 每个工作进程处理多少请求后自动替换（0为不替换）
+    SERVER_BIND = os.environ.get('SERVER_BIND') or '0.0.0.0:5001'
+    SERVER_WORKERS = int(os.environ.get('SERVER_WORKERS') or (os.cpu_count() or 1) + 1)
+    SERVER_THREADS = int(os.environ.get('SERVER_THREADS') or 4)
+    SERVER_TIMEOUT = int(os.environ.get('SERVER_TIMEOUT') or 60)
+    SERVER_GRACEFUL_TIMEOUT = int(os.environ.get('SERVER_GRACEFUL_TIMEOUT') or 30)
+    SERVER_MAX_REQUESTS = int(os.environ.get('SERVER_MAX_REQUESTS') or 0)
+
+    # 服务端缓存：memory（进程内LRU，默认）、redis（多进程共享）或 none（关闭）
+    CACHE_BACKEND = os.environ.get('CACHE_BACKEND') or 'memory'
+    CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL') or 'redis://localhost:6379/0'
+    CACHE_DEFAULT_TTL = int(os.environ.get('CACHE_DEFAULT_TTL') or 300)
+    CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES') or 1024)
+    # memory 后端的标签版本号保存在数据库计数器表中，多个工作进程的失效互相可见（单进程部署可设为0）
+    CACHE_SHARED_TAGS = os.environ.get('CACHE_SHARED_TAGS', '1') != '0'
+    # 模板字节码缓存目录（未设置时使用 instance/jinja_cache），重启后不再重新编译模板
+    JINJA_BYTECODE_CACHE_DIR = os.environ.get('JINJA_BYTECODE_CACHE_DIR') or None
+    # 是否缓存模板中 {% cache %} 包住的片段，以及片段的有效期（秒，默认与 CACHE_DEFAULT_TTL 相同）
+    TEMPLATE_FRAGMENT_CACHE = os.environ.get('TEMPLATE_FRAGMENT_CACHE', '1') != '0'
+    TEMPLATE_FRAGMENT_TTL = int(os.environ['TEMPLATE_FRAGMENT_TTL']) if os.environ.get('TEMPLATE_FRAGMENT_TTL') else None
+
+    # 登录用户缓存的有效期（秒），设置为0则每个请求都查询数据库
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL') or 60)
+
+    # 系统设置在其他工作进程修改后，本进程最长多少秒内重新加载
+    SETTINGS_CHECK_INTERVAL = float(os.environ.get('SETTINGS_CHECK_INTERVAL') or 5)
+
+    # 随访工作清单：即将随访的天数范围、逾期回溯天数、接口每页条数
+    WORKLIST_HORIZON_DAYS = int(os.environ.get('WORKLIST_HORIZON_DAYS') or 7)
+    WORKLIST_OVERDUE_DAYS = int(os.environ.get('WORKLIST_OVERDUE_DAYS') or 30)
+    WORKLIST_PAGE_SIZE = int(os.environ.get('WORKLIST_PAGE_SIZE') or 50)
+
+    # 每个进程一次从计数器表预留的患者编号个数
+    PATIENT_ID_BLOCK_SIZE = int(os.environ.get('PATIENT_ID_BLOCK_SIZE') or 10)
+
+    # 患者选择器前缀索引的重新加载间隔（秒），用于同步其他工作进程的修改
+    PATIENT_TYPEAHEAD_TTL = int(os.environ.get('PATIENT_TYPEAHEAD_TTL') or 300)
+
+    # 批量导入时每个事务写入的行数
+    IMPORT_CHUNK_SIZE = int(os.environ.get('IMPORT_CHUNK_SIZE') or 1000)
+
+    # JSON接口v1：列表默认每页条数、批量接口每次最多提交的记录数
+    API_PAGE_SIZE = int(os.environ.get('API_PAGE_SIZE') or 50)
+    API_BATCH_MAX_RECORDS = int(os.environ.get('API_BATCH_MAX_RECORDS') or 500)
+
+    # eGFR年变化率：参与计算的最少检查次数、最短检查跨度（年），以及仪表盘列出的快速下降阈值(ml/min/1.73m²/年)
+    EGFR_SLOPE_MIN_POINTS = int(os.environ.get('EGFR_SLOPE_MIN_POINTS') or 3)
+    EGFR_SLOPE_MIN_YEARS = float(os.environ.get('EGFR_SLOPE_MIN_YEARS') or 0.5)
+    EGFR_FAST_DECLINE = float(os.environ.get('EGFR_FAST_DECLINE') or -5.0)
+
+    # 填写血肌酐的随访记录按CKD-EPI 2021公式自动计算eGFR（设置为0则保留手工填写的值）
+    EGFR_AUTO_CALCULATE = os.environ.get('EGFR_AUTO_CALCULATE', '1') != '0'
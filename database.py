@@ -1,5 +1,5 @@
 from flask_sqlalchemy import SQLAlchemy
+from replica import RoutingSession
 
-# 创建数据库实例，将在app.py中初始化
-db = SQLAlchemy()
-
+# 创建数据库实例，将在app.py中初始化（会话按请求把只读查询路由到副本，见replica.py）
+db = SQLAlchemy(session_options={'class_': RoutingSession})
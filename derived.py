@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+"""
+派生指标计算
+
+表单录入、批量导入等各处写入数据时共用的计算，保证同一指标只有一种算法。
+
+- BMI：体重(kg) / 身高(m)²
+- eGFR：CKD-EPI 2021公式（不含种族系数），由血肌酐、性别和随访时的年龄计算，
+  仅适用于18岁及以上的患者。能计算时覆盖手工填写的eGFR，
+  缺少血肌酐、性别或年龄时保留手工填写的值
+
+随访记录写入（insert/update）前由ORM事件自动计算；患者的性别、出生日期或年龄
+修改后，在同一事务中重新计算该患者全部随访记录的eGFR。已有数据（以及不经过ORM
+修改的患者）用 flask backfill-derived-metrics 按块向量化重新计算，默认只输出差异报告。
+"""
+from datetime import date, datetime
+import numpy as np
+from flask import current_app
+from sqlalchemy import event, select, update, bindparam, inspect
+from sqlalchemy.orm import object_session
+from database import db
+from models import Patient, FollowupRecord
+from cache import cache, invalidate_in_session
+from analytics import mark_patients_dirty, mark_session_pending, refresh_slopes
+
+# 血肌酐 μmol/L 换算为 mg/dL
+CREATININE_UMOL_PER_MG_DL = 88.4
+# CKD-EPI 2021：性别 -> (κ, α, 性别系数)
+CKD_EPI_2021 = {'女': (0.7, -0.241, 1.012), '男': (0.9, -0.302, 1.0)}
+EGFR_MIN_AGE = 18
+BACKFILL_CHUNK_SIZE = 5000
+# 影响派生指标的随访记录列
+_DERIVED_INPUTS = ('patient_id', 'followup_date', 'serum_creatinine', 'egfr', 'body_weight', 'height', 'bmi')
+# 影响eGFR的患者列
+_PATIENT_EGFR_INPUTS = ('gender', 'birth_date', 'age')
+
+
+def compute_age(birth_date, today=None):
+    """按出生日期计算周岁"""
+    if birth_date is None:
+        return None
+    today = today or date.today()
+    return today.year - birth_date.year - ((today.month, today.day) < (birth_date.month, birth_date.day))
+
+
+def compute_bmi(body_weight, height):
+    """按体重(kg)和身高(cm)计算BMI，缺少数据或数据无效时返回None"""
+    if body_weight in (None, '') or height in (None, ''):
+        return None
+    try:
+        weight = float(body_weight)
+        height = float(height) / 100  # 转换为米
+    except (TypeError, ValueError):
+        return None
+    if height <= 0:
+        return None
+    return weight / (height * height)
+
+
+def compute_egfr(serum_creatinine, gender, age):
+    """CKD-EPI 2021公式计算eGFR(ml/min/1.73m²)，血肌酐单位μmol/L；无法计算时返回None"""
+    if serum_creatinine in (None, '') or gender not in CKD_EPI_2021 or age is None or age < EGFR_MIN_AGE:
+        return None
+    scr = float(serum_creatinine) / CREATININE_UMOL_PER_MG_DL
+    if scr <= 0:
+        return None
+    kappa, alpha, factor = CKD_EPI_2021[gender]
+    ratio = scr / kappa
+    return round(142 * min(ratio, 1) ** alpha * max(ratio, 1) ** -1.200 * 0.9938 ** age * factor, 1)
+
+
+def age_on(birth_date, on_date, recorded_age=None):
+    """随访日期时的年龄；没有出生日期时使用登记的年龄"""
+    if birth_date is not None and on_date is not None:
+        return compute_age(birth_date, on_date)
+    return recorded_age
+
+
+def record_derived_values(values, patient):
+    """按随访记录的值和患者 (gender, birth_date, age) 计算派生指标
+
+    返回 {'bmi': ..., 'egfr': ...}；eGFR无法计算时不包含 egfr，保留原值。
+    """
+    derived = {'bmi': compute_bmi(values.get('body_weight'), values.get('height'))}
+    if patient is not None and current_app.config.get('EGFR_AUTO_CALCULATE', True):
+        gender, birth_date, age = patient
+        egfr = compute_egfr(values.get('serum_creatinine'), gender, age_on(birth_date, values.get('followup_date'), age))
+        if egfr is not None:
+            derived['egfr'] = egfr
+    return derived
+
+
+@event.listens_for(FollowupRecord, 'before_insert')
+@event.listens_for(FollowupRecord, 'before_update')
+def _apply_derived_values(mapper, connection, record):
+    state = inspect(record)
+    if state.persistent and not any(state.attrs[c].history.has_changes() for c in _DERIVED_INPUTS):
+        return
+    patient = connection.execute(
+        select(Patient.gender, Patient.birth_date, Patient.age).where(Patient.id == record.patient_id)
+    ).first()
+    values = {column: getattr(record, column) for column in _DERIVED_INPUTS}
+    for column, value in record_derived_values(values, patient).items():
+        setattr(record, column, value)
+
+
+@event.listens_for(Patient, 'after_update')
+def _recompute_patient_egfr(mapper, connection, patient):
+    """患者性别、出生日期或年龄修改后，重新计算其随访记录的eGFR"""
+    if not current_app.config.get('EGFR_AUTO_CALCULATE', True):
+        return
+    state = inspect(patient)
+    if not any(state.attrs[c].history.has_changes() for c in _PATIENT_EGFR_INPUTS):
+        return
+    table = FollowupRecord.__table__
+    rows = connection.execute(
+        select(table.c.id, table.c.followup_date, table.c.serum_creatinine, table.c.egfr)
+        .where(table.c.patient_id == patient.id, table.c.serum_creatinine.isnot(None))
+    ).all()
+    changes = []
+    for record_id, followup_date, creatinine, old_egfr in rows:
+        egfr = compute_egfr(creatinine, patient.gender, age_on(patient.birth_date, followup_date, patient.age))
+        # 与随访记录的计算一致：无法计算时保留原值
+        if egfr is not None and egfr != old_egfr:
+            changes.append({'b_id': record_id, 'b_egfr': egfr})
+    if not changes:
+        return
+    connection.execute(
+        update(table).where(table.c.id == bindparam('b_id'))
+        .values(egfr=bindparam('b_egfr'), updated_at=datetime.now()),
+        changes
+    )
+    mark_patients_dirty(connection, [patient.id])
+    mark_session_pending(patient)
+    session = object_session(patient)
+    if session is not None:
+        invalidate_in_session(session, ['records'])
+
+
+def _floats(values):
+    return np.array([np.nan if v is None else float(v) for v in values], dtype=float)
+
+
+def _date_parts(values):
+    """日期列拆成年、月、日三个数组，空值为NaN"""
+    parts = np.full((3, len(values)), np.nan)
+    for i, value in enumerate(values):
+        if value is not None:
+            parts[:, i] = (value.year, value.month, value.day)
+    return parts
+
+
+def compute_age_array(birth_dates, on_dates, recorded_ages):
+    """age_on 的向量化版本"""
+    by, bm, bd = _date_parts(birth_dates)
+    oy, om, od = _date_parts(on_dates)
+    before_birthday = (om < bm) | ((om == bm) & (od < bd))
+    ages = oy - by - before_birthday
+    return np.where(np.isnan(ages), _floats(recorded_ages), ages)
+
+
+def compute_bmi_array(body_weight, height):
+    """compute_bmi 的向量化版本，无法计算的位置为NaN"""
+    meters = np.asarray(height, dtype=float) / 100
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(meters > 0, np.asarray(body_weight, dtype=float) / (meters * meters), np.nan)
+
+
+def compute_egfr_array(serum_creatinine, genders, ages):
+    """compute_egfr 的向量化版本，无法计算的位置为NaN"""
+    genders = np.asarray(genders, dtype=object)
+    female = genders == '女'
+    valid_gender = female | (genders == '男')
+    scr = np.asarray(serum_creatinine, dtype=float) / CREATININE_UMOL_PER_MG_DL
+    ages = np.asarray(ages, dtype=float)
+    female_params, male_params = CKD_EPI_2021['女'], CKD_EPI_2021['男']
+    kappa = np.where(female, female_params[0], male_params[0])
+    alpha = np.where(female, female_params[1], male_params[1])
+    factor = np.where(female, female_params[2], male_params[2])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ratio = scr / kappa
+        egfr = 142 * np.minimum(ratio, 1) ** alpha * np.maximum(ratio, 1) ** -1.200 * 0.9938 ** ages * factor
+    egfr = np.round(egfr, 1)
+    return np.where(valid_gender & (scr > 0) & (ages >= EGFR_MIN_AGE), egfr, np.nan)
+
+
+def _changed(old, new):
+    """新旧两列数值是否不同（都为空视为相同）"""
+    both_nan = np.isnan(old) & np.isnan(new)
+    with np.errstate(invalid='ignore'):
+        return ~both_nan & ~(np.abs(old - new) < 1e-6)
+
+
+def _value(x):
+    return None if np.isnan(x) else float(x)
+
+
+def backfill_derived_metrics(dry_run=True, chunk_size=BACKFILL_CHUNK_SIZE, sample_size=20):
+    """按主键分块重新计算全部随访记录的BMI和eGFR，返回差异报告；dry_run 为False时写入"""
+    auto_egfr = current_app.config.get('EGFR_AUTO_CALCULATE', True)
+    report = {'scanned': 0, 'changed': 0, 'egfr': 0, 'bmi': 0, 'samples': []}
+    touched_patients = set()
+    last_id = 0
+    while True:
+        with db.engine.begin() as connection:
+            rows = connection.execute(
+                select(FollowupRecord.id, FollowupRecord.patient_id, FollowupRecord.followup_date,
+                       FollowupRecord.serum_creatinine, FollowupRecord.body_weight, FollowupRecord.height,
+                       FollowupRecord.egfr, FollowupRecord.bmi,
+                       Patient.patient_id, Patient.gender, Patient.birth_date, Patient.age)
+                .join(Patient, FollowupRecord.patient_id == Patient.id)
+                .where(FollowupRecord.id > last_id)
+                .order_by(FollowupRecord.id).limit(chunk_size)
+            ).all()
+            if not rows:
+                break
+            (ids, patient_ids, followup_dates, creatinine, weight, height,
+             old_egfr, old_bmi, codes, genders, birth_dates, ages) = zip(*rows)
+
+            old_egfr, old_bmi = _floats(old_egfr), _floats(old_bmi)
+            new_bmi = compute_bmi_array(_floats(weight), _floats(height))
+            new_egfr = old_egfr
+            if auto_egfr:
+                computed = compute_egfr_array(
+                    _floats(creatinine), genders, compute_age_array(birth_dates, followup_dates, ages)
+                )
+                new_egfr = np.where(np.isnan(computed), old_egfr, computed)
+            egfr_changed = _changed(old_egfr, new_egfr)
+            bmi_changed = _changed(old_bmi, new_bmi)
+            changed = np.flatnonzero(egfr_changed | bmi_changed)
+
+            report['scanned'] += len(rows)
+            report['changed'] += len(changed)
+            report['egfr'] += int(egfr_changed.sum())
+            report['bmi'] += int(bmi_changed.sum())
+            for i in changed[:max(0, sample_size - len(report['samples']))]:
+                report['samples'].append({
+                    'record_id': ids[i], 'patient_code': codes[i],
+                    'egfr': (_value(old_egfr[i]), _value(new_egfr[i])) if egfr_changed[i] else None,
+                    'bmi': (_value(old_bmi[i]), _value(new_bmi[i])) if bmi_changed[i] else None,
+                })
+
+            if not dry_run and len(changed):
+                connection.execute(
+                    update(FollowupRecord.__table__)
+                    .where(FollowupRecord.__table__.c.id == bindparam('b_id'))
+                    .values(egfr=bindparam('b_egfr'), bmi=bindparam('b_bmi')),
+                    [{'b_id': ids[i], 'b_egfr': _value(new_egfr[i]), 'b_bmi': _value(new_bmi[i])} for i in changed]
+                )
+                mark_patients_dirty(connection, [patient_ids[i] for i in np.flatnonzero(egfr_changed)])
+                touched_patients.update(patient_ids[i] for i in changed)
+        last_id = rows[-1][0]
+
+    if touched_patients:
+        cache.invalidate_tags('records', *sorted(f'patient:{i}' for i in touched_patients))
+        refresh_slopes()
+    return report
+
+
+def init_derived(app):
+    """注册派生指标回填命令"""
+    import click
+    app.config.setdefault('EGFR_AUTO_CALCULATE', True)
+
+    @app.cli.command('backfill-derived-metrics')
+    @click.option('--apply', 'apply_changes', is_flag=True, help='写入数据库（默认只输出差异报告）')
+    @click.option('--chunk-size', type=int, default=BACKFILL_CHUNK_SIZE, help='每个事务处理的记录数')
+    def backfill_derived_metrics_command(apply_changes, chunk_size):
+        """按CKD-EPI 2021公式和身高体重重新计算已有随访记录的eGFR和BMI"""
+        report = backfill_derived_metrics(dry_run=not apply_changes, chunk_size=chunk_size)
+        action = '已更新' if apply_changes else '需要更新'
+        print(f'共检查{report["scanned"]}条随访记录，{action}{report["changed"]}条'
+              f'（eGFR {report["egfr"]}条，BMI {report["bmi"]}条）')
+        for item in report['samples']:
+            changes = [f'{name} {old} -> {new}' for name in ('egfr', 'bmi') if item[name]
+                       for old, new in [item[name]]]
+            print(f'  记录{item["record_id"]}（{item["patient_code"]}）：{"，".join(changes)}')
+        if not apply_changes and report['changed']:
+            print('以上为预览，加 --apply 参数写入数据库')
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+随访记录导出
+
+按 /records 列表相同的筛选条件把随访记录导出为CSV。查询只读取导出需要的列，
+用 yield_per 分批从数据库游标取行，每批写成一段CSV文本后立即交给调用方，
+因此导出整张表时内存占用也与批大小相关，而与记录总数无关。
+
+表头使用列注释中的中文名称，与批量导入（importer.py）识别的表头一致，
+导出的文件可以直接再导入。文件以UTF-8 BOM开头，Excel可直接打开。
+"""
+import csv
+import io
+import sys
+from datetime import datetime
+from sqlalchemy import select
+from sqlalchemy.orm import aliased
+from database import db
+from models import User, Patient, FollowupRecord, column_label
+from search import record_list_filters, ensure_indexes
+
+EXPORT_BATCH_SIZE = 1000
+# 单独处理的列：患者ID导出为患者编号，记录人导出为姓名，创建时间放在最后
+_SKIPPED_COLUMNS = {'id', 'patient_id', 'recorded_by', 'created_at', 'updated_at'}
+
+
+def _export_columns():
+    """(表头, 查询列) 列表"""
+    recorder = aliased(User)
+    columns = [
+        ('记录ID', FollowupRecord.id),
+        ('患者编号', Patient.patient_id),
+        ('姓名', Patient.name),
+        ('性别', Patient.gender),
+    ]
+    columns.extend(
+        (column_label(column) or column.name, getattr(FollowupRecord, column.name))
+        for column in FollowupRecord.__table__.columns
+        if column.name not in _SKIPPED_COLUMNS
+    )
+    columns.append(('记录人', recorder.real_name))
+    columns.append(('创建时间', FollowupRecord.created_at))
+    return columns, recorder
+
+
+def export_query(search='', q='', patient_id=None):
+    """导出用的查询：只选择导出的列，按随访日期倒序（与列表页一致）"""
+    columns, recorder = _export_columns()
+    return select(*[column for _, column in columns]).select_from(FollowupRecord).join(
+        Patient, FollowupRecord.patient_id == Patient.id
+    ).outerjoin(
+        recorder, FollowupRecord.recorded_by == recorder.id
+    ).where(
+        *record_list_filters(search, q, patient_id)
+    ).order_by(FollowupRecord.followup_date.desc(), FollowupRecord.id.desc())
+
+
+def _format(value):
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    return value
+
+
+def generate_csv(search='', q='', patient_id=None, batch_size=EXPORT_BATCH_SIZE):
+    """逐批产生CSV文本，第一段包含BOM和表头"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')
+    writer.writerow([title for title, _ in _export_columns()[0]])
+
+    result = db.session.execute(export_query(search, q, patient_id).execution_options(yield_per=batch_size))
+    for rows in result.partitions():
+        writer.writerows([_format(value) for value in row] for row in rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def export_filename():
+    return f'followup_records_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
+
+
+def init_export(app):
+    """注册导出的命令行命令"""
+    import click
+
+    @app.cli.command('export-records')
+    @click.option('--output', '-o', type=click.Path(dir_okay=False), default=None,
+                  help='输出文件，默认写到标准输出')
+    @click.option('--search', default='', help='按患者编号、姓名、电话、身份证号检索')
+    @click.option('--q', default='', help='按症状、备注、用药内容检索')
+    @click.option('--patient-id', type=int, default=None, help='只导出指定患者（数据库ID）')
+    def export_records_command(output, search, q, patient_id):
+        """把随访记录导出为CSV"""
+        ensure_indexes()
+        chunks = generate_csv(search, q, patient_id)
+        if output is None:
+            for chunk in chunks:
+                sys.stdout.write(chunk)
+            return
+        with open(output, 'w', encoding='utf-8', newline='') as f:
+            for chunk in chunks:
+                f.write(chunk)
+        print(f'已导出到 {output}')
@@ -0,0 +1,421 @@
+# -*- coding: utf-8 -*-
+"""
+批量导入患者和随访记录
+
+从CSV或Excel(xlsx)文件流式读取，每 IMPORT_CHUNK_SIZE 行为一块：逐行按模型的列
+校验和转换，一块中合法的行用一条批量INSERT（executemany）写入，并在同一个事务中
+同步全文索引后提交。出错的行记录行号和原因后跳过，不影响其他行；整块写入失败时
+（如违反数据库约束）改为逐行写入，找出具体出错的行。
+
+- 表头可以使用列名（如 name）或中文名称（如 姓名，取自模型列注释），无法识别的列会被忽略
+- 患者文件中患者编号为空的行，按块一次从编号序列分配新编号；文件中自带的编号会推进编号序列
+- 随访记录文件用患者编号（如 IGA-000001）关联患者，BMI、eGFR与录入表单一样由 derived 模块计算
+- 读取Excel文件需要安装 openpyxl
+"""
+import csv
+import io
+import os
+import time
+from datetime import date, datetime
+from itertools import islice
+from flask import current_app
+from sqlalchemy import select
+from sqlalchemy.exc import SQLAlchemyError
+from database import db
+from models import User, Patient, FollowupRecord, column_label
+from cache import cache
+from derived import compute_age, record_derived_values
+from sequences import allocate_patient_ids, advance_patient_id
+from search import index_patients, index_records
+from analytics import mark_patients_dirty, refresh_slopes
+import typeahead
+
+KIND_PATIENTS = 'patients'
+KIND_RECORDS = 'records'
+KIND_LABELS = {KIND_PATIENTS: '患者', KIND_RECORDS: '随访记录'}
+
+# 由系统填写、不从文件读取的列
+_SYSTEM_COLUMNS = {'id', 'created_by', 'recorded_by', 'created_at', 'updated_at', 'bmi'}
+_DATE_FORMATS = ('%Y-%m-%d', '%Y/%m/%d', '%Y.%m.%d', '%Y%m%d')
+GENDERS = ('男', '女')
+# 导入结果中最多保留的错误明细条数
+MAX_REPORTED_ERRORS = 1000
+
+
+class ImportFileError(ValueError):
+    """文件无法读取或缺少必需的列"""
+
+
+class ImportResult:
+    """一次导入的统计和逐行错误"""
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.total = 0
+        self.inserted = 0
+        self.error_count = 0
+        self.errors = []
+        self.ignored_columns = []
+        self.elapsed = 0.0
+
+    def add_error(self, line, message, count=1):
+        self.error_count += count
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+    def summary(self):
+        return (f'共读取{self.total}行，成功导入{self.inserted}条{KIND_LABELS[self.kind]}，'
+                f'失败{self.error_count}行，用时{self.elapsed:.1f}秒')
+
+
+def _to_str(value, length=None):
+    if isinstance(value, float) and value.is_integer():
+        # Excel中的手机号、身份证号等可能被读成浮点数
+        value = int(value)
+    value = str(value).strip()
+    if length and len(value) > length:
+        raise ValueError(f'长度不能超过{length}个字符')
+    return value
+
+
+def _to_int(value):
+    if isinstance(value, float):
+        if not value.is_integer():
+            raise ValueError('应为整数')
+        return int(value)
+    try:
+        return int(str(value).strip())
+    except ValueError:
+        raise ValueError('应为整数')
+
+
+def _to_float(value):
+    if isinstance(value, bool):
+        raise ValueError('应为数字')
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        # xlsx的数值列中可能混有日期等其他类型的单元格
+        raise ValueError('应为数字')
+
+
+def _to_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    value = str(value).strip()
+    for fmt in _DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            pass
+    raise ValueError('日期格式应为YYYY-MM-DD')
+
+
+def _converter(column):
+    python_type = column.type.python_type
+    if python_type is int:
+        return _to_int
+    if python_type is float:
+        return _to_float
+    if python_type is date:
+        return _to_date
+    length = getattr(column.type, 'length', None)
+    return lambda value: _to_str(value, length)
+
+
+def _importable_columns(model):
+    """列名 -> 列对象，不含由系统填写的列"""
+    return {column.name: column for column in model.__table__.columns if column.name not in _SYSTEM_COLUMNS}
+
+
+def column_converters(model):
+    """可写入的列：列名 -> (中文名称, 转换函数)，JSON接口按同样的规则校验字段"""
+    return {name: (column_label(column) or name, _converter(column))
+            for name, column in _importable_columns(model).items()}
+
+
+def _header_aliases(kind, columns):
+    aliases = {}
+    for name, column in columns.items():
+        aliases[name.lower()] = name
+        if column.comment:
+            aliases[column.comment] = name
+            aliases[column_label(column)] = name
+    if kind == KIND_RECORDS:
+        # 随访记录文件中的患者编号是 IGA-000001 这样的编号，而不是数据库ID
+        aliases.pop('患者ID', None)
+        aliases['患者编号'] = 'patient_id'
+    return aliases
+
+
+def _open_csv(stream):
+    reader = csv.reader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''))
+    try:
+        yield from reader
+    except UnicodeDecodeError:
+        raise ImportFileError('CSV文件需要使用UTF-8编码保存')
+
+
+def _open_xlsx(stream):
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ImportFileError('读取Excel文件需要安装 openpyxl，也可以另存为CSV后导入')
+    try:
+        workbook = load_workbook(stream, read_only=True, data_only=True)
+    except Exception as e:
+        raise ImportFileError(f'无法读取Excel文件：{e}')
+    try:
+        yield from workbook.active.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def read_rows(stream, filename):
+    """按扩展名读取CSV或xlsx文件，返回 (表头, 产生 (行号, 值列表) 的迭代器)"""
+    extension = os.path.splitext(filename or '')[1].lower()
+    if extension == '.csv':
+        rows = _open_csv(stream)
+    elif extension == '.xlsx':
+        rows = _open_xlsx(stream)
+    else:
+        raise ImportFileError('只支持 .csv 和 .xlsx 文件')
+
+    header = next(rows, None)
+    if not header:
+        raise ImportFileError('文件为空或缺少表头')
+
+    def numbered():
+        for line, values in enumerate(rows, start=2):
+            if any(value not in (None, '') for value in values):
+                yield line, values
+    return [str(value or '').strip() for value in header], numbered()
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class _RowParser:
+    """把文件中的一行按表头转换为列名 -> 值的字典"""
+
+    def __init__(self, kind, model, header, required, result, converters=None):
+        columns = _importable_columns(model)
+        converters = converters or {}
+        aliases = _header_aliases(kind, columns)
+        self.fields = []
+        mapped = set()
+        for index, title in enumerate(header):
+            name = aliases.get(title) or aliases.get(title.lower())
+            if name is None or name in mapped:
+                if title:
+                    result.ignored_columns.append(title)
+                continue
+            mapped.add(name)
+            column = columns[name]
+            convert = converters.get(name) or _converter(column)
+            self.fields.append((index, name, column_label(column) or name, convert))
+        missing = [column_label(columns[name]) or name for name in required if name not in mapped]
+        if missing:
+            raise ImportFileError(f'缺少必需的列：{"、".join(missing)}')
+
+    def parse(self, values):
+        row = {}
+        for index, name, label, convert in self.fields:
+            value = values[index] if index < len(values) else None
+            if value is None or (isinstance(value, str) and not value.strip()):
+                row[name] = None
+                continue
+            try:
+                row[name] = convert(value)
+            except ValueError as e:
+                raise ValueError(f'{label}：{e}')
+        return row
+
+
+def _import_patients(chunk, result, user_id, seen_codes):
+    rows, lines = [], []
+    for line, row in chunk:
+        if row.get('name') is None:
+            result.add_error(line, '姓名不能为空')
+        elif row.get('gender') not in GENDERS:
+            result.add_error(line, '性别应为“男”或“女”')
+        elif row.get('patient_id') and row['patient_id'] in seen_codes:
+            result.add_error(line, f'患者编号 {row["patient_id"]} 在文件中重复')
+        else:
+            if row.get('patient_id'):
+                seen_codes.add(row['patient_id'])
+            if row.get('birth_date'):
+                row['age'] = compute_age(row['birth_date'])
+            row['created_by'] = user_id
+            rows.append(row)
+            lines.append(line)
+
+    codes = [row['patient_id'] for row in rows if row.get('patient_id')]
+    if codes:
+        existing = set(db.session.execute(
+            select(Patient.patient_id).where(Patient.patient_id.in_(codes))
+        ).scalars())
+        if existing:
+            kept = [(line, row) for line, row in zip(lines, rows) if row.get('patient_id') not in existing]
+            for line, row in zip(lines, rows):
+                if row.get('patient_id') in existing:
+                    result.add_error(line, f'患者编号 {row["patient_id"]} 已存在')
+            lines = [line for line, _ in kept]
+            rows = [row for _, row in kept]
+    if not rows:
+        return
+
+    new_ids = iter(allocate_patient_ids(sum(1 for row in rows if not row.get('patient_id'))))
+    for row in rows:
+        if not row.get('patient_id'):
+            row['patient_id'] = next(new_ids)
+
+    def after_insert(connection, new_ids):
+        index_patients(connection, new_ids)
+        # 文件中自带的编号可能大于计数器，推进计数器以免以后自动分配到相同的编号
+        advance_patient_id(connection, codes)
+
+    _write_chunk(Patient, rows, lines, result, after_insert)
+    cache.invalidate_tags('patients')
+    typeahead.invalidate()
+
+
+def _import_records(chunk, result, user_id):
+    codes = {row['patient_id'] for _, row in chunk if row.get('patient_id')}
+    # 患者编号 -> (患者ID, (性别, 出生日期, 年龄))，后者用于计算eGFR
+    patients = {row[0]: (row[1], tuple(row[2:])) for row in db.session.execute(
+        select(Patient.patient_id, Patient.id, Patient.gender, Patient.birth_date, Patient.age)
+        .where(Patient.patient_id.in_(codes))
+    )} if codes else {}
+
+    rows, lines = [], []
+    for line, row in chunk:
+        if row.get('patient_id') is None:
+            result.add_error(line, '患者编号不能为空')
+        elif row['patient_id'] not in patients:
+            result.add_error(line, f'患者编号 {row["patient_id"]} 不存在')
+        elif row.get('followup_date') is None:
+            result.add_error(line, '随访日期不能为空')
+        else:
+            row['patient_id'], patient = patients[row['patient_id']]
+            row.update(record_derived_values(row, patient))
+            row['recorded_by'] = user_id
+            rows.append(row)
+            lines.append(line)
+    if not rows:
+        return
+
+    def after_insert(connection, new_ids):
+        index_records(connection, new_ids)
+        mark_patients_dirty(connection, [row['patient_id'] for row in rows if row.get('egfr') is not None])
+
+    _write_chunk(FollowupRecord, rows, lines, result, after_insert)
+    cache.invalidate_tags('records', *sorted({f'patient:{row["patient_id"]}' for row in rows}))
+
+
+def _write_chunk(model, rows, lines, result, after_insert):
+    """一块数据在一个事务中写入主表，并调用 after_insert(connection, 新ID) 维护索引等；
+    整块写入失败时改为逐行写入，报告出错的行"""
+    table = model.__table__
+    # executemany要求每行的键相同
+    keys = set().union(*rows)
+    rows = [{key: row.get(key) for key in keys} for row in rows]
+    try:
+        with db.engine.begin() as connection:
+            new_ids = connection.execute(table.insert().returning(table.c.id), rows).scalars().all()
+            after_insert(connection, new_ids)
+    except (SQLAlchemyError, ValueError):
+        _write_rows(table, rows, lines, result, after_insert)
+        return
+    result.inserted += len(rows)
+
+
+def _write_rows(table, rows, lines, result, after_insert):
+    """逐行写入（每行一个事务），用于找出整块写入失败的原因"""
+    for line, row in zip(lines, rows):
+        try:
+            with db.engine.begin() as connection:
+                new_id = connection.execute(table.insert().returning(table.c.id), row).scalar_one()
+                after_insert(connection, [new_id])
+        except (SQLAlchemyError, ValueError) as e:
+            result.add_error(line, f'写入失败：{getattr(e, "orig", None) or e}')
+        else:
+            result.inserted += 1
+
+
+def import_file(stream, filename, kind, user_id=None, chunk_size=None):
+    """从文件流批量导入患者或随访记录，返回 ImportResult"""
+    if kind not in KIND_LABELS:
+        raise ImportFileError(f'未知的导入类型：{kind}')
+    chunk_size = chunk_size or current_app.config.get('IMPORT_CHUNK_SIZE', 1000)
+    started = time.perf_counter()
+    result = ImportResult(kind)
+
+    header, rows = read_rows(stream, filename)
+    if kind == KIND_PATIENTS:
+        parser = _RowParser(kind, Patient, header, ('name', 'gender'), result)
+    else:
+        parser = _RowParser(kind, FollowupRecord, header, ('patient_id', 'followup_date'), result,
+                            converters={'patient_id': lambda value: _to_str(value)})
+
+    seen_codes = set()
+    for chunk in _chunks(rows, chunk_size):
+        parsed = []
+        for line, values in chunk:
+            result.total += 1
+            try:
+                parsed.append((line, parser.parse(values)))
+            except ValueError as e:
+                result.add_error(line, str(e))
+        if kind == KIND_PATIENTS:
+            _import_patients(parsed, result, user_id, seen_codes)
+        else:
+            _import_records(parsed, result, user_id)
+        # 查询患者编号用的是会话连接，每块结束后归还，避免长时间占用
+        db.session.remove()
+
+    if kind == KIND_RECORDS and result.inserted:
+        refresh_slopes()
+    result.errors.sort()
+    result.elapsed = time.perf_counter() - started
+    return result
+
+
+def init_importer(app):
+    """注册批量导入的命令行命令"""
+    import click
+    app.config.setdefault('IMPORT_CHUNK_SIZE', 1000)
+
+    @app.cli.command('import-data')
+    @click.argument('kind', type=click.Choice([KIND_PATIENTS, KIND_RECORDS]))
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--chunk-size', type=int, default=None, help='每个事务写入的行数')
+    @click.option('--user', 'username', default=None, help='记为创建人/记录人的用户名')
+    def import_data_command(kind, path, chunk_size, username):
+        """从CSV或xlsx文件批量导入患者（patients）或随访记录（records）"""
+        user_id = None
+        if username:
+            user = User.query.filter_by(username=username).first()
+            if user is None:
+                print(f'用户 {username} 不存在')
+                return
+            user_id = user.id
+        try:
+            with open(path, 'rb') as stream:
+                result = import_file(stream, path, kind, user_id, chunk_size)
+        except ImportFileError as e:
+            print(f'导入失败：{e}')
+            return
+        print(result.summary())
+        if result.ignored_columns:
+            print(f'已忽略无法识别的列：{"、".join(result.ignored_columns)}')
+        for line, message in result.errors:
+            print(f'第{line}行：{message}')
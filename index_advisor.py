@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+索引检查
+
+以管理员身份用测试客户端依次请求每个GET路由（路径参数取各表的第一行，另加几个带检索条件的地址），
+记录请求中执行的SELECT语句，对每条语句执行 EXPLAIN QUERY PLAN，列出全表扫描（SCAN 表名，
+未使用索引）和为排序建立临时B树的语句，用于发现需要补充的索引。
+
+    flask --app app index-advisor [--all]
+
+结果与数据量有关，应在有真实规模数据的数据库上运行；执行过 ANALYZE 的数据库结果更接近线上。
+按主键顺序分页（ORDER BY id LIMIT n）的查询显示为 SCAN 表名，但读到n行即停止，属于正常情况。
+检查前会清空缓存（cache.clear()），使用共享Redis缓存时各进程之后的首次请求需重新计算。
+"""
+import re
+from flask import url_for
+from sqlalchemy import event, select, func
+from database import db
+from cache import cache
+from models import User, Patient, FollowupRecord, SystemSetting
+
+# 不检查的端点
+SKIPPED_ENDPOINTS = {'static', 'logout', 'login'}
+# 额外检查的地址（检索、筛选等带参数的查询）
+EXTRA_URLS = (
+    '/patients?search=张',
+    '/patients?search=IGA-0000',
+    '/records?search=张',
+    '/records?q=头痛',
+    '/api/worklist?bucket=overdue',
+    '/api/patients/search?q=张',
+    '/api/v1/records?q=头痛',
+)
+# 路径参数 -> 取样的表
+_SAMPLE_MODELS = {
+    'patient_id': Patient,
+    'record_id': FollowupRecord,
+    'staff_id': User,
+    'setting_id': SystemSetting,
+}
+_FULL_SCAN = re.compile(r'^SCAN (\w+)$')
+
+
+def _sample_ids():
+    return {
+        argument: db.session.scalar(select(func.min(model.id)))
+        for argument, model in _SAMPLE_MODELS.items()
+    }
+
+
+def route_urls(app):
+    """可检查的GET地址列表"""
+    samples = _sample_ids()
+    urls = []
+    for rule in sorted(app.url_map.iter_rules(), key=lambda r: r.rule):
+        if 'GET' not in rule.methods or rule.endpoint in SKIPPED_ENDPOINTS:
+            continue
+        values = {argument: samples.get(argument) for argument in rule.arguments}
+        if any(value is None for value in values.values()):
+            continue
+        with app.test_request_context():
+            urls.append(url_for(rule.endpoint, **values))
+    return urls + list(EXTRA_URLS)
+
+
+def collect_queries(app, urls, user_id):
+    """请求每个地址，返回 [(地址, 状态码, [(语句, 参数)])]"""
+    captured = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+            captured.append((statement, parameters))
+
+    with app.app_context():
+        engines = list(db.engines.values())
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', capture)
+    results = []
+    try:
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user_id)
+            session['_fresh'] = True
+        for url in urls:
+            captured.clear()
+            response = client.get(url)
+            response.close()
+            results.append((url, response.status_code, list(captured)))
+    finally:
+        for engine in engines:
+            event.remove(engine, 'before_cursor_execute', capture)
+    return results
+
+
+def explain(statement, parameters):
+    """EXPLAIN QUERY PLAN 的各行说明"""
+    with db.engine.connect() as connection:
+        rows = connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters).all()
+    return [row[-1] for row in rows]
+
+
+def problems(plan):
+    """计划中的全表扫描和临时排序"""
+    found = []
+    for step in plan:
+        step = step.strip()
+        if _FULL_SCAN.match(step):
+            found.append(step)
+        elif step.startswith('USE TEMP B-TREE FOR ORDER BY'):
+            found.append(step)
+    return found
+
+
+def advise(app, show_all=False, out=print):
+    """检查全部路由的查询，返回发现问题的语句数"""
+    with app.app_context():
+        admin = db.session.scalar(select(User.id).where(User.role == 'admin').order_by(User.id).limit(1))
+        if admin is None:
+            raise RuntimeError('数据库中没有管理员账户')
+        urls = route_urls(app)
+        db.session.remove()
+    # 清空缓存，否则命中缓存的页面不执行查询；每个请求使用各自的应用上下文，查询计数不会累加
+    cache.clear()
+    results = collect_queries(app, urls, admin)
+
+    flagged = 0
+    seen = set()
+    with app.app_context():
+        for url, status, queries in results:
+            lines = []
+            for statement, parameters in queries:
+                if statement in seen and not show_all:
+                    continue
+                seen.add(statement)
+                plan = explain(statement, parameters)
+                found = problems(plan)
+                if found:
+                    flagged += 1
+                if found or show_all:
+                    summary = ' '.join(statement.split())
+                    lines.append(f'  {summary[:160]}{"..." if len(summary) > 160 else ""}')
+                    lines.extend(f'    {"!!" if step.strip() in found else "  "} {step}' for step in plan)
+            out(f'{url} [{status}] {len(queries)}条查询')
+            for line in lines:
+                out(line)
+    out(f'共检查{len(results)}个地址，{len(seen)}条不同的查询，{flagged}条存在全表扫描或临时排序')
+    return flagged
+
+
+def init_index_advisor(app):
+    """注册索引检查命令"""
+    import click
+
+    @app.cli.command('index-advisor')
+    @click.option('--all', 'show_all', is_flag=True, help='输出全部查询的执行计划')
+    def index_advisor_command(show_all):
+        """对每个页面和接口的查询执行 EXPLAIN QUERY PLAN，列出全表扫描"""
+        advise(app, show_all)
@@ -0,0 +1,406 @@
+# -*- coding: utf-8 -*-
+"""
+HTTP压力测试
+
+多个虚拟用户（线程）各自用示例账户登录，按权重随机请求仪表盘、患者检索、随访记录列表、
+患者详情和添加随访记录，持续一段时间后按路由统计吞吐量和 p50/p95/p99 延迟，写入JSON文件，
+便于不同版本之间比较。只使用标准库，可以在没有安装项目依赖的机器上运行。
+
+用法：
+    python loadtest.py                                   # 测试已启动的 http://127.0.0.1:5001
+    python loadtest.py --spawn --seed-patients 500       # 用临时数据库启动 serve.py 后测试
+    python loadtest.py --concurrency 16 --duration 60 --output loadtest-new.json --baseline loadtest-old.json
+
+--spawn 时用临时SQLite数据库执行迁移、初始化示例数据并以 serve.py 启动服务，结束后关闭；
+--seed-patients 通过 /api/v1 接口补充患者（每人 --records-per-patient 条随访记录）。
+默认账户为 init_sample_data() 创建的 admin、doctor1、nurse1。
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_USERS = ['admin:admin123', 'doctor1:123456', 'nurse1:123456']
+DEFAULT_MIX = 'dashboard=2,patients=3,records=3,patient_detail=3,add_record=1'
+SEARCH_TERMS = ['王', '张', '李', '刘', '陈', 'IGA-00', '明', '华']
+SURNAMES = '王李张刘陈杨黄赵周吴徐孙马朱胡郭何林高罗'
+GIVEN_NAMES = '明华伟芳娜敏静丽强磊军洋勇艳杰娟涛超'
+SYMPTOMS = ['无明显不适', '乏力', '眼睑水肿', '肉眼血尿', '泡沫尿', '腰酸', '头痛', '下肢水肿']
+# --spawn 时初始化临时数据库
+SETUP_SCRIPT = '''
+from app import app
+from migrate import upgrade
+from routes import init_sample_data
+with app.app_context():
+    upgrade()
+    init_sample_data()
+'''
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='按路由统计吞吐量和延迟百分位的HTTP压力测试')
+    parser.add_argument('--base-url', default='http://127.0.0.1:5001', help='被测服务地址（--spawn 时忽略）')
+    parser.add_argument('--users', nargs='+', default=DEFAULT_USERS, help='登录账户，格式 用户名:密码，虚拟用户轮流使用')
+    parser.add_argument('--concurrency', type=int, default=8, help='虚拟用户数')
+    parser.add_argument('--duration', type=float, default=30, help='计入统计的测试时长（秒）')
+    parser.add_argument('--warmup', type=float, default=5, help='开始统计前的预热时长（秒）')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='各路由的请求权重，如 dashboard=2,records=3')
+    parser.add_argument('--think-time', type=float, default=0, help='每个虚拟用户两次请求之间的间隔（秒）')
+    parser.add_argument('--timeout', type=float, default=30, help='单个请求的超时（秒）')
+    parser.add_argument('--seed', type=int, default=1, help='随机数种子，相同种子的请求序列相同')
+    parser.add_argument('--output', default='loadtest.json', help='结果JSON文件')
+    parser.add_argument('--baseline', default=None, help='上一次的结果JSON，输出与之对比的变化')
+    parser.add_argument('--spawn', action='store_true', help='用临时数据库启动 serve.py 进行测试')
+    parser.add_argument('--server-workers', type=int, default=None, help='--spawn 时的工作进程数')
+    parser.add_argument('--server-threads', type=int, default=None, help='--spawn 时每个工作进程的线程数')
+    parser.add_argument('--seed-patients', type=int, default=0, help='测试前通过接口补充的患者数')
+    parser.add_argument('--records-per-patient', type=int, default=5, help='补充的每位患者的随访记录数')
+    return parser.parse_args()
+
+
+def parse_mix(text):
+    mix = {}
+    for item in text.split(','):
+        name, _, weight = item.partition('=')
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise SystemExit(f'未知路由 {name}，可选：{", ".join(SCENARIOS)}')
+        mix[name] = float(weight or 1)
+    return mix
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    """不跟随跳转，按原始状态码统计（跳转到登录页视为失败）"""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+class Client:
+    """一个带会话cookie的HTTP客户端"""
+
+    def __init__(self, base_url, timeout):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect,
+        )
+
+    def request(self, path, form=None, payload=None):
+        """发送请求并读完响应，返回 (状态码, 响应体)；连接错误时状态码为0"""
+        data, headers = None, {}
+        if form is not None:
+            data = urllib.parse.urlencode(form).encode()
+        elif payload is not None:
+            data = json.dumps(payload).encode()
+            headers['Content-Type'] = 'application/json'
+        req = urllib.request.Request(self.base_url + path, data=data, headers=headers)
+        try:
+            with self.opener.open(req, timeout=self.timeout) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            body = e.read()
+            e.close()
+            return e.code, body
+        except (urllib.error.URLError, OSError):
+            return 0, b''
+
+    def login(self, username, password, attempts=5):
+        for _ in range(attempts):
+            status, _ = self.request('/login', form={'username': username, 'password': password})
+            if status == 302:
+                return
+            # 503：密码校验繁忙，稍后重试
+            time.sleep(0.5)
+        raise RuntimeError(f'账户 {username} 登录失败（状态码 {status}）')
+
+    def json(self, path, payload=None):
+        status, body = self.request(path, payload=payload)
+        if status not in (200, 201):
+            raise RuntimeError(f'{path} 返回 {status}：{body[:200].decode("utf-8", "replace")}')
+        return json.loads(body)
+
+
+# 各路由的请求：(client, rng, patient_ids) -> (路径, 表单, 期望的状态码)
+def _dashboard(client, rng, patient_ids):
+    return '/dashboard', None, 200
+
+
+def _patients(client, rng, patient_ids):
+    return '/patients?' + urllib.parse.urlencode({'search': rng.choice(SEARCH_TERMS)}), None, 200
+
+
+def _records(client, rng, patient_ids):
+    return '/records', None, 200
+
+
+def _patient_detail(client, rng, patient_ids):
+    return f'/patients/{rng.choice(patient_ids)}', None, 200
+
+
+def _add_record(client, rng, patient_ids):
+    followup_date = date.today() - timedelta(days=rng.randint(0, 365))
+    return '/records/add', {
+        'patient_id': rng.choice(patient_ids),
+        'followup_date': followup_date.isoformat(),
+        'followup_type': rng.choice(['门诊', '电话', '住院']),
+        'symptoms': rng.choice(SYMPTOMS),
+        'serum_creatinine': f'{rng.uniform(60, 250):.1f}',
+        'urine_protein_24h': f'{rng.uniform(0.1, 3.5):.2f}',
+        'next_followup_date': (followup_date + timedelta(days=rng.choice([30, 60, 90]))).isoformat(),
+    }, 302
+
+
+SCENARIOS = {
+    'dashboard': _dashboard,
+    'patients': _patients,
+    'records': _records,
+    'patient_detail': _patient_detail,
+    'add_record': _add_record,
+}
+
+
+def percentile(values, p):
+    """最近秩百分位（values 已排序）"""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, int(round(len(values) * p / 100)) - 1))]
+
+
+def summarize(samples, seconds):
+    """samples: [(延迟秒, 状态码, 是否成功)]"""
+    latencies = sorted(sample[0] * 1000 for sample in samples)
+    statuses = defaultdict(int)
+    for _, status, _ in samples:
+        statuses[str(status)] += 1
+    return {
+        'requests': len(samples),
+        'errors': sum(1 for sample in samples if not sample[2]),
+        'throughput': round(len(samples) / seconds, 2) if seconds else 0.0,
+        'mean_ms': round(sum(latencies) / len(latencies), 2) if latencies else 0.0,
+        'p50_ms': round(percentile(latencies, 50), 2),
+        'p95_ms': round(percentile(latencies, 95), 2),
+        'p99_ms': round(percentile(latencies, 99), 2),
+        'max_ms': round(latencies[-1], 2) if latencies else 0.0,
+        'status': dict(sorted(statuses.items())),
+    }
+
+
+def seed_data(base_url, credentials, patients, records_per_patient, timeout, rng):
+    """以第一个账户通过 /api/v1 接口补充患者和随访记录"""
+    client = Client(base_url, timeout)
+    client.login(*credentials)
+    today = date.today()
+    created = []
+    for _ in range(patients):
+        birth = today - timedelta(days=rng.randint(18 * 365, 75 * 365))
+        patient = client.json('/api/v1/patients', {
+            'name': rng.choice(SURNAMES) + ''.join(rng.choices(GIVEN_NAMES, k=rng.randint(1, 2))),
+            'gender': rng.choice(['男', '女']),
+            'birth_date': birth.isoformat(),
+        })['patient']
+        created.append(patient['id'])
+    batch = []
+    for patient_id in created:
+        for k in range(records_per_patient):
+            batch.append({
+                'patient_id': patient_id,
+                'followup_date': (today - timedelta(days=90 * k + rng.randint(0, 30))).isoformat(),
+                'followup_type': '门诊',
+                'symptoms': rng.choice(SYMPTOMS),
+                'serum_creatinine': round(rng.uniform(60, 250), 1),
+                'urine_protein_24h': round(rng.uniform(0.1, 3.5), 2),
+                'next_followup_date': (today + timedelta(days=rng.randint(-40, 40))).isoformat(),
+            })
+    for start in range(0, len(batch), 500):
+        client.json('/api/v1/records/batch', {'records': batch[start:start + 500], 'atomic': True})
+    return len(created), len(batch)
+
+
+def fetch_patient_ids(client, limit=5000):
+    ids, cursor = [], None
+    while len(ids) < limit:
+        path = '/api/v1/patients?limit=200' + (f'&cursor={urllib.parse.quote(cursor)}' if cursor else '')
+        data = client.json(path)
+        ids.extend(item['id'] for item in data['items'])
+        cursor = data['next_cursor']
+        if not cursor:
+            break
+    if not ids:
+        raise RuntimeError('数据库中没有患者，请使用 --seed-patients 补充')
+    return ids
+
+
+def run(args, base_url, mix, patient_ids):
+    """运行压力测试，返回 ({路由: [(延迟, 状态码, 是否成功)]}, 计入统计的秒数)"""
+    credentials = [user.split(':', 1) for user in args.users]
+    names, weights = list(mix), list(mix.values())
+    samples = defaultdict(list)
+    lock = threading.Lock()
+    errors = []
+    started = time.perf_counter()
+    measure_from = started + args.warmup
+    deadline = measure_from + args.duration
+
+    def virtual_user(index):
+        rng = random.Random(args.seed * 1000 + index)
+        client = Client(base_url, args.timeout)
+        try:
+            client.login(*credentials[index % len(credentials)])
+        except RuntimeError as e:
+            errors.append(str(e))
+            return
+        while True:
+            now = time.perf_counter()
+            if now >= deadline:
+                return
+            name = rng.choices(names, weights)[0]
+            path, form, expected = SCENARIOS[name](client, rng, patient_ids)
+            request_started = time.perf_counter()
+            status, _ = client.request(path, form=form)
+            elapsed = time.perf_counter() - request_started
+            if request_started >= measure_from:
+                with lock:
+                    samples[name].append((elapsed, status, status == expected))
+            if args.think_time:
+                time.sleep(args.think_time)
+
+    threads = [threading.Thread(target=virtual_user, args=(i,), daemon=True) for i in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise RuntimeError('；'.join(errors))
+    # 最后一批请求可能在截止时间之后才完成
+    return samples, max(time.perf_counter(), deadline) - measure_from
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def print_report(report, baseline=None):
+    previous = (baseline or {}).get('routes', {})
+    print(f'{"路由":<16}{"请求数":>8}{"错误":>6}{"请求/秒":>10}{"p50ms":>9}{"p95ms":>9}{"p99ms":>9}'
+          + (f'{"吞吐变化":>10}{"p95变化":>10}' if baseline else ''))
+    rows = list(report['routes'].items()) + [('合计', report['summary'])]
+    for name, row in rows:
+        line = (f'{name:<16}{row["requests"]:>8}{row["errors"]:>6}{row["throughput"]:>10.1f}'
+                f'{row["p50_ms"]:>9.1f}{row["p95_ms"]:>9.1f}{row["p99_ms"]:>9.1f}')
+        old = baseline.get('summary') if baseline and name == '合计' else previous.get(name)
+        if old:
+            line += f'{_change(row["throughput"], old["throughput"]):>10}{_change(row["p95_ms"], old["p95_ms"]):>10}'
+        print(line)
+
+
+def _change(new, old):
+    return f'{(new - old) / old * 100:+.1f}%' if old else '-'
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def spawn_server(args):
+    """用临时数据库启动 serve.py，返回 (进程, 地址)"""
+    directory = tempfile.mkdtemp(prefix='loadtest-')
+    env = dict(os.environ, DATABASE_URL='sqlite:///' + os.path.join(directory, 'loadtest.db'))
+    env.pop('DATABASE_REPLICA_URL', None)
+    subprocess.run([sys.executable, '-c', SETUP_SCRIPT], cwd=HERE, env=env, check=True,
+                   stdout=subprocess.DEVNULL)
+    port = _free_port()
+    command = [sys.executable, os.path.join(HERE, 'serve.py'), '--bind', f'127.0.0.1:{port}']
+    if args.server_workers:
+        command += ['--workers', str(args.server_workers)]
+    if args.server_threads:
+        command += ['--threads', str(args.server_threads)]
+    log_path = os.path.join(directory, 'server.log')
+    with open(log_path, 'ab') as log:
+        process = subprocess.Popen(command, cwd=HERE, env=env, stdout=log, stderr=subprocess.STDOUT)
+    print(f'服务日志：{log_path}')
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'serve.py 启动失败（退出码 {process.returncode}），见 {log_path}')
+        if Client(base_url, 2).request('/login')[0] == 200:
+            return process, base_url
+        time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError('serve.py 60秒内未就绪')
+
+
+def main():
+    args = parse_args()
+    mix = parse_mix(args.mix)
+    process, base_url = spawn_server(args) if args.spawn else (None, args.base_url)
+    try:
+        rng = random.Random(args.seed)
+        credentials = args.users[0].split(':', 1)
+        if args.seed_patients:
+            patients, records = seed_data(base_url, credentials, args.seed_patients,
+                                          args.records_per_patient, args.timeout, rng)
+            print(f'已补充 {patients} 位患者、{records} 条随访记录')
+        client = Client(base_url, args.timeout)
+        client.login(*credentials)
+        patient_ids = fetch_patient_ids(client)
+
+        print(f'{base_url}：{args.concurrency} 个虚拟用户，预热 {args.warmup} 秒，统计 {args.duration} 秒，'
+              f'{len(patient_ids)} 位患者')
+        started_at = datetime.now()
+        samples, seconds = run(args, base_url, mix, patient_ids)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+
+    report = {
+        'meta': {
+            'started_at': started_at.isoformat(timespec='seconds'),
+            'base_url': base_url,
+            'revision': git_revision(),
+            'concurrency': args.concurrency,
+            'duration': args.duration,
+            'warmup': args.warmup,
+            'think_time': args.think_time,
+            'seed': args.seed,
+            'mix': mix,
+            'patients': len(patient_ids),
+        },
+        'summary': summarize([sample for name in samples for sample in samples[name]], seconds),
+        'routes': {name: summarize(samples[name], seconds) for name in mix if samples[name]},
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+        f.write('\n')
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    print(f'结果已写入 {args.output}')
+
+
+if __name__ == '__main__':
+    main()
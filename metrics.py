@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+"""
+请求指标
+
+按端点（视图函数名）统计每个请求的：
+
+- 请求数（按方法、状态码）和耗时直方图（流式响应只计到开始发送）
+- SQL语句数和SQL执行总耗时（SQLAlchemy before/after_cursor_execute 事件）
+- 模板渲染耗时（before_render_template / template_rendered 信号）
+- 响应大小直方图（流式响应没有长度，不计入）
+
+/metrics 以Prometheus文本格式输出，仅管理员可以访问；采集程序可在请求头中带
+Authorization: Bearer <METRICS_TOKEN>。
+
+指标保存在进程内存中，每个请求只做几次计时和一次加锁累加。多进程部署时
+设置 METRICS_DIR：各工作进程每隔 METRICS_FLUSH_INTERVAL 秒把自己的指标写入该目录，
+/metrics 输出所有进程合计的值（serve.py 以多个工作进程启动且未设置时自动使用临时目录）。
+"""
+import bisect
+import hmac
+import json
+import os
+import threading
+import time
+from flask import Response, g, has_app_context, request
+from flask import before_render_template, template_rendered
+from flask_login import current_user
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from query_counter import current_query_count
+
+PREFIX = 'iga'
+# 请求耗时直方图的桶（秒）
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# 响应大小直方图的桶（字节）
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+# 未匹配到路由的请求（404等）的端点名
+UNMATCHED_ENDPOINT = '<unmatched>'
+
+# 指标名 -> (类型, 说明)
+_METRICS = {
+    'http_requests_total': ('counter', '请求数'),
+    'http_request_duration_seconds': ('histogram', '请求处理耗时'),
+    'http_response_size_bytes': ('histogram', '响应大小'),
+    'sql_queries_total': ('counter', 'SQL语句数'),
+    'sql_duration_seconds_total': ('counter', 'SQL执行耗时合计'),
+    'template_render_seconds_total': ('counter', '模板渲染耗时合计'),
+}
+
+
+class Histogram:
+    """累计直方图：各桶计数、总和、次数"""
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.counts):
+            self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    """进程内的指标，键为 (指标名, 标签元组)"""
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, method, status, duration, size, queries, sql_seconds, template_seconds):
+        """记录一个请求"""
+        labels = (('endpoint', endpoint), ('method', method))
+        with self._lock:
+            counters = self.counters
+            key = ('http_requests_total', labels + (('status', str(status)),))
+            counters[key] = counters.get(key, 0) + 1
+            self._histogram('http_request_duration_seconds', labels, DURATION_BUCKETS).observe(duration)
+            if size is not None:
+                self._histogram('http_response_size_bytes', labels, SIZE_BUCKETS).observe(size)
+            if queries:
+                key = ('sql_queries_total', labels)
+                counters[key] = counters.get(key, 0) + queries
+                key = ('sql_duration_seconds_total', labels)
+                counters[key] = counters.get(key, 0.0) + sql_seconds
+            if template_seconds:
+                key = ('template_render_seconds_total', labels)
+                counters[key] = counters.get(key, 0.0) + template_seconds
+
+    def _histogram(self, name, labels, buckets):
+        histogram = self.histograms.get((name, labels))
+        if histogram is None:
+            histogram = self.histograms[(name, labels)] = Histogram(buckets)
+        return histogram
+
+    def snapshot(self):
+        """可写成JSON的副本"""
+        with self._lock:
+            return {
+                'counters': [[name, list(labels), value] for (name, labels), value in self.counters.items()],
+                'histograms': [[name, list(labels), list(h.buckets), list(h.counts), h.sum, h.count]
+                               for (name, labels), h in self.histograms.items()],
+            }
+
+    def merge(self, snapshot):
+        """累加另一进程的快照"""
+        with self._lock:
+            for name, labels, value in snapshot['counters']:
+                key = (name, tuple(tuple(label) for label in labels))
+                self.counters[key] = self.counters.get(key, 0) + value
+            for name, labels, buckets, counts, total, count in snapshot['histograms']:
+                histogram = self._histogram(name, tuple(tuple(label) for label in labels), tuple(buckets))
+                histogram.counts = [a + b for a, b in zip(histogram.counts, counts)]
+                histogram.sum += total
+                histogram.count += count
+
+
+registry = Registry()
+
+
+def _labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ''
+    return '{' + ','.join('%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                          for key, value in items) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(registry):
+    """Prometheus文本格式"""
+    series = {}
+    for (name, labels), value in sorted(registry.counters.items()):
+        series.setdefault(name, []).append(f'{PREFIX}_{name}{_labels(labels)} {_number(value)}')
+    for (name, labels), histogram in sorted(registry.histograms.items(), key=lambda item: item[0]):
+        lines = series.setdefault(name, [])
+        cumulative = 0
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            cumulative += count
+            lines.append(f'{PREFIX}_{name}_bucket{_labels(labels, [("le", bound)])} {cumulative}')
+        lines.append(f'{PREFIX}_{name}_bucket{_labels(labels, [("le", "+Inf")])} {histogram.count}')
+        lines.append(f'{PREFIX}_{name}_sum{_labels(labels)} {_number(histogram.sum)}')
+        lines.append(f'{PREFIX}_{name}_count{_labels(labels)} {histogram.count}')
+
+    output = []
+    for name, (kind, description) in _METRICS.items():
+        output.append(f'# HELP {PREFIX}_{name} {description}')
+        output.append(f'# TYPE {PREFIX}_{name} {kind}')
+        output.extend(series.get(name, ()))
+    return '\n'.join(output) + '\n'
+
+
+def _snapshot_path(directory):
+    return os.path.join(directory, f'metrics-{os.getpid()}.json')
+
+
+def flush(directory):
+    """把本进程的指标写入 directory（先写临时文件再改名，读取方不会读到半个文件）"""
+    os.makedirs(directory, exist_ok=True)
+    path = _snapshot_path(directory)
+    temporary = path + '.tmp'
+    with open(temporary, 'w', encoding='utf-8') as f:
+        json.dump(registry.snapshot(), f)
+    os.replace(temporary, path)
+
+
+def collect(directory=None):
+    """本进程指标的副本；设置了 directory 时合计其中所有进程的快照"""
+    combined = Registry()
+    if not directory:
+        combined.merge(registry.snapshot())
+        return combined
+    flush(directory)
+    for filename in os.listdir(directory):
+        if filename.startswith('metrics-') and filename.endswith('.json'):
+            try:
+                with open(os.path.join(directory, filename), encoding='utf-8') as f:
+                    combined.merge(json.load(f))
+            except (OSError, ValueError):
+                continue
+    return combined
+
+
+def reset_directory(directory):
+    """删除上次运行留下的快照（服务启动时调用）"""
+    if not directory or not os.path.isdir(directory):
+        return
+    for filename in os.listdir(directory):
+        if filename.startswith('metrics-') and filename.endswith(('.json', '.tmp')):
+            os.remove(os.path.join(directory, filename))
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._metrics_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_metrics_started', None)
+    if started is not None and has_app_context():
+        g.sql_seconds = g.get('sql_seconds', 0.0) + time.perf_counter() - started
+
+
+def _before_render(sender, template, context, **extra):
+    g.template_started = time.perf_counter()
+
+
+def _rendered(sender, template, context, **extra):
+    started = g.pop('template_started', None)
+    if started is not None:
+        g.template_seconds = g.get('template_seconds', 0.0) + time.perf_counter() - started
+
+
+def _authorized(app):
+    token = app.config['METRICS_TOKEN']
+    if token:
+        header = request.headers.get('Authorization', '')
+        if header.startswith('Bearer ') and hmac.compare_digest(header[7:].encode(), token.encode()):
+            return True
+    return current_user.is_authenticated and current_user.role == 'admin'
+
+
+def init_metrics(app):
+    """注册请求计时、SQL和模板计时以及 /metrics"""
+    app.config.setdefault('METRICS_ENABLED', True)
+    app.config.setdefault('METRICS_TOKEN', None)
+    app.config.setdefault('METRICS_DIR', None)
+    app.config.setdefault('METRICS_FLUSH_INTERVAL', 5)
+    if not app.config['METRICS_ENABLED']:
+        return
+    state = {'flushed_at': time.monotonic()}
+
+    if not getattr(Engine, '_metrics_installed', False):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        Engine._metrics_installed = True
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_rendered, app)
+
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def record_request_metrics(response):
+        started = g.get('request_started')
+        if started is None:
+            return response
+        registry.record(
+            request.endpoint or UNMATCHED_ENDPOINT, request.method, response.status_code,
+            time.perf_counter() - started,
+            None if response.is_streamed else response.content_length,
+            current_query_count(), g.get('sql_seconds', 0.0), g.get('template_seconds', 0.0),
+        )
+        directory = app.config['METRICS_DIR']
+        if directory and time.monotonic() - state['flushed_at'] >= app.config['METRICS_FLUSH_INTERVAL']:
+            state['flushed_at'] = time.monotonic()
+            flush(directory)
+        return response
+
+    @app.route('/metrics')
+    def metrics():
+        """Prometheus格式的请求指标（管理员）"""
+        if not _authorized(app):
+            if not current_user.is_authenticated:
+                return app.login_manager.unauthorized()
+            return Response('没有权限\n', status=403, mimetype='text/plain')
+        return Response(render(collect(app.config['METRICS_DIR'])), content_type='text/plain; version=0.0.4; charset=utf-8')
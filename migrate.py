@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+数据库版本迁移
+
+db.create_all() 只创建不存在的表，已有表上新增的索引、列不会生效。表结构变更写成
+migrations/ 目录下按编号命名的脚本（如 0001_list_indexes.py），每个脚本包含说明文字（模块文档字符串）
+和 upgrade(connection) 函数；已执行的版本号记录在 schema_version 表中。
+
+- upgrade()：先 create_all 创建缺少的表，再按编号依次执行未执行过的脚本，每个脚本一个事务
+- 脚本应可重复执行（CREATE INDEX IF NOT EXISTS 等）：新建的数据库由 create_all 按模型建表，
+  模型中已声明的索引此时已存在
+- 命令行：flask --app app migrate [--status]
+"""
+import importlib.util
+import os
+import re
+from datetime import datetime
+from sqlalchemy import Column, DateTime, Integer, String, Table, select
+from database import db
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+_SCRIPT_NAME = re.compile(r'^(\d{4})_(\w+)\.py$')
+
+schema_version = Table(
+    'schema_version', db.metadata,
+    Column('version', Integer, primary_key=True, autoincrement=False, comment='迁移脚本编号'),
+    Column('name', String(100), nullable=False, comment='脚本名称'),
+    Column('applied_at', DateTime, nullable=False, comment='执行时间'),
+)
+
+
+class Migration:
+    """一个迁移脚本"""
+
+    def __init__(self, version, name, path):
+        self.version = version
+        self.name = name
+        self.path = path
+        self._module = None
+
+    @property
+    def module(self):
+        if self._module is None:
+            spec = importlib.util.spec_from_file_location(f'migrations.m{self.version:04d}_{self.name}', self.path)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            if not callable(getattr(module, 'upgrade', None)):
+                raise RuntimeError(f'迁移脚本 {os.path.basename(self.path)} 缺少 upgrade(connection) 函数')
+            self._module = module
+        return self._module
+
+    @property
+    def description(self):
+        doc = (self.module.__doc__ or '').strip()
+        return doc.splitlines()[0] if doc else self.name
+
+
+def load_migrations(directory=MIGRATIONS_DIR):
+    """按编号返回全部迁移脚本"""
+    migrations = []
+    for filename in sorted(os.listdir(directory)) if os.path.isdir(directory) else ():
+        match = _SCRIPT_NAME.match(filename)
+        if match:
+            migrations.append(Migration(int(match.group(1)), match.group(2), os.path.join(directory, filename)))
+    versions = [migration.version for migration in migrations]
+    if len(versions) != len(set(versions)):
+        raise RuntimeError('迁移脚本编号重复')
+    return migrations
+
+
+def applied_versions(connection):
+    return set(connection.execute(select(schema_version.c.version)).scalars())
+
+
+def pending_migrations(directory=MIGRATIONS_DIR):
+    """尚未执行的迁移脚本（须在应用上下文中调用）"""
+    schema_version.create(db.engine, checkfirst=True)
+    with db.engine.connect() as connection:
+        applied = applied_versions(connection)
+    return [migration for migration in load_migrations(directory) if migration.version not in applied]
+
+
+def upgrade(directory=MIGRATIONS_DIR, out=None):
+    """创建缺少的表并执行未执行的迁移脚本，返回执行的脚本列表（须在应用上下文中调用）"""
+    db.create_all()
+    executed = []
+    for migration in pending_migrations(directory):
+        with db.engine.begin() as connection:
+            migration.module.upgrade(connection)
+            connection.execute(schema_version.insert().values(
+                version=migration.version, name=migration.name, applied_at=datetime.now(),
+            ))
+        executed.append(migration)
+        if out:
+            out(f'已执行 {migration.version:04d} {migration.description}')
+    return executed
+
+
+def init_migrate(app):
+    """注册迁移命令"""
+    import click
+
+    @app.cli.command('migrate')
+    @click.option('--status', is_flag=True, help='只列出各迁移脚本的执行状态，不执行')
+    def migrate_command(status):
+        """执行数据库迁移脚本（migrations/目录）"""
+        if status:
+            schema_version.create(db.engine, checkfirst=True)
+            with db.engine.connect() as connection:
+                applied = dict(connection.execute(
+                    select(schema_version.c.version, schema_version.c.applied_at)
+                ).all())
+            for migration in load_migrations():
+                applied_at = applied.get(migration.version)
+                state = applied_at.strftime('%Y-%m-%d %H:%M:%S') if applied_at else '未执行'
+                print(f'{migration.version:04d} {migration.description}  [{state}]')
+            return
+        executed = upgrade(out=print)
+        print(f'数据库已是最新版本（本次执行{len(executed)}个迁移脚本）')
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+"""列表排序和筛选用的组合索引
+
+- followup_records(patient_id, followup_date, id)：患者详情、趋势图按患者取随访记录并按日期排序
+- followup_records(followup_date, id)：随访记录列表、导出、仪表盘最近记录按随访日期倒序分页
+- followup_records(next_followup_date, id)：随访工作清单按下次随访日期分页
+- patients(created_at, id)、users(created_at, id)：患者列表、工作人员列表按创建时间分页
+
+与 models.py 中 __table_args__ 声明的索引同名，新建的数据库由 create_all 创建，这里不会重复创建。
+"""
+
+INDEXES = (
+    ('ix_followup_records_patient_date', 'followup_records', ('patient_id', 'followup_date', 'id')),
+    ('ix_followup_records_date', 'followup_records', ('followup_date', 'id')),
+    ('ix_followup_records_next_date', 'followup_records', ('next_followup_date', 'id')),
+    ('ix_patients_created', 'patients', ('created_at', 'id')),
+    ('ix_users_created', 'users', ('created_at', 'id')),
+)
+
+
+def upgrade(connection):
+    for name, table, columns in INDEXES:
+        connection.exec_driver_sql(f'CREATE INDEX IF NOT EXISTS {name} ON {table} ({", ".join(columns)})')
@@ -1,11 +1,17 @@
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import check_password_hash
+from passwords import hash_password
+import re
 from datetime import datetime
 from database import db
 
 class User(UserMixin, db.Model):
     """用户模型（工作人员）"""
     __tablename__ = 'users'
+    __table_args__ = (
+        # 工作人员列表按创建时间分页
+        db.Index('ix_users_created', 'created_at', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False, index=True)
@@ -20,8 +26,8 @@ class User(UserMixin, db.Model):
     updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now, comment='更新时间')
     
     def set_password(self, password):
-        """设置密码"""
-        self.password_hash = generate_password_hash(password)
+        """设置密码（按配置的哈希参数）"""
+        self.password_hash = hash_password(password)
     
     def check_password(self, password):
         """验证密码"""
@@ -33,10 +39,14 @@ class User(UserMixin, db.Model):
 class Patient(db.Model):
     """患者模型"""
     __tablename__ = 'patients'
+    __table_args__ = (
+        # 患者列表按创建时间分页
+        db.Index('ix_patients_created', 'created_at', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     patient_id = db.Column(db.String(50), unique=True, nullable=False, index=True, comment='患者编号')
-    name = db.Column(db.String(100), nullable=False, comment='姓名')
+    name = db.Column(db.String(100), nullable=False, index=True, comment='姓名')
     gender = db.Column(db.String(10), nullable=False, comment='性别：男/女')
     birth_date = db.Column(db.Date, comment='出生日期')
     age = db.Column(db.Integer, comment='年龄')
@@ -62,6 +72,14 @@ class Patient(db.Model):
 class FollowupRecord(db.Model):
     """随访记录模型"""
     __tablename__ = 'followup_records'
+    __table_args__ = (
+        # 患者详情、趋势图：按患者取记录并按随访日期排序
+        db.Index('ix_followup_records_patient_date', 'patient_id', 'followup_date', 'id'),
+        # 随访记录列表、导出、仪表盘：按随访日期倒序分页
+        db.Index('ix_followup_records_date', 'followup_date', 'id'),
+        # 随访工作清单：按下次随访日期分页
+        db.Index('ix_followup_records_next_date', 'next_followup_date', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     patient_id = db.Column(db.Integer, db.ForeignKey('patients.id'), nullable=False, index=True, comment='患者ID')
@@ -93,7 +111,7 @@ class FollowupRecord(db.Model):
     
     # 其他
     notes = db.Column(db.Text, comment='备注')
-    next_followup_date = db.Column(db.Date, comment='下次随访日期')
+    next_followup_date = db.Column(db.Date, index=True, comment='下次随访日期')
     recorded_by = db.Column(db.Integer, db.ForeignKey('users.id'), comment='记录人')
     created_at = db.Column(db.DateTime, default=datetime.now, comment='创建时间')
     updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now, comment='更新时间')
@@ -121,3 +139,39 @@ class SystemSetting(db.Model):
     def __repr__(self):
         return f'<SystemSetting {self.key}>'
 
+class Counter(db.Model):
+    """计数器模型（编号序列等），由sequences模块原子地更新"""
+    __tablename__ = 'counters'
+    
+    name = db.Column(db.String(100), primary_key=True, comment='计数器名称')
+    value = db.Column(db.BigInteger, nullable=False, default=0, comment='当前值（已分配出去的最大值）')
+    
+    def __repr__(self):
+        return f'<Counter {self.name}={self.value}>'
+
+class EgfrSlope(db.Model):
+    """患者eGFR年变化率汇总（由analytics模块计算，随访记录写入后标记待更新）"""
+    __tablename__ = 'egfr_slopes'
+    
+    patient_id = db.Column(db.Integer, db.ForeignKey('patients.id'), primary_key=True, comment='患者ID')
+    slope = db.Column(db.Float, index=True, comment='eGFR年变化率(ml/min/1.73m²/年)')
+    n_points = db.Column(db.Integer, nullable=False, default=0, comment='参与计算的eGFR次数')
+    first_date = db.Column(db.Date, comment='首次eGFR日期')
+    last_date = db.Column(db.Date, comment='最近eGFR日期')
+    last_egfr = db.Column(db.Float, comment='最近eGFR(ml/min/1.73m²)')
+    pending = db.Column(db.Integer, nullable=False, default=0, index=True, comment='上次计算后的写入次数，大于0表示待更新')
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now, comment='更新时间')
+    
+    # 关系
+    patient = db.relationship('Patient')
+    
+    def __repr__(self):
+        return f'<EgfrSlope patient={self.patient_id} slope={self.slope}>'
+
+def to_dict(obj):
+    """将模型对象的列值转换为字典（用于缓存和JSON接口）"""
+    return {attr.key: getattr(obj, attr.key) for attr in obj.__mapper__.column_attrs}
+
+def column_label(column):
+    """列注释中的中文名称（用于导入导出的表头）：'性别：男/女' -> '性别'，'体重(kg)' -> '体重'"""
+    return re.split(r'[：(（]', column.comment or '')[0].strip()
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+键集（游标）分页
+
+OFFSET分页翻到第N页需要先扫描前面所有行，而且每页都要执行一次COUNT(*)。
+键集分页记住当前页首尾行的排序键，下一页直接从索引上的该位置继续读取，
+因此第N页和第1页的代价相同。游标是对排序键编码后的不透明字符串。
+"""
+import base64
+import json
+from datetime import date, datetime
+from flask import current_app, request
+from sqlalchemy import and_, or_, false, func
+from database import db
+
+
+class KeysetPagination:
+    """键集分页结果，接口与Flask-SQLAlchemy的Pagination保持相近"""
+
+    is_keyset = True
+
+    def __init__(self, items, per_page, has_next, has_prev, next_cursor, prev_cursor, total=None):
+        self.items = items
+        self.per_page = per_page
+        self.has_next = has_next
+        self.has_prev = has_prev
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.total = total
+
+    @property
+    def pages(self):
+        """总页数（仅在有估算总数时可用）"""
+        if self.total is None:
+            return None
+        return max(1, -(-self.total // self.per_page))
+
+
+def encode_cursor(direction, values):
+    """将翻页方向和排序键值编码为不透明游标"""
+    payload = [direction, [v.isoformat() if isinstance(v, (date, datetime)) else v for v in values]]
+    raw = json.dumps(payload, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, keys):
+    """解析游标，返回 (方向, 排序键值)；游标无效时返回 None"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        direction, values = json.loads(raw.decode('utf-8'))
+        if direction not in ('n', 'p') or len(values) != len(keys):
+            return None
+        parsed = []
+        for key, value in zip(keys, values):
+            python_type = key.type.python_type
+            if value is None:
+                parsed.append(None)
+            elif python_type is datetime:
+                parsed.append(datetime.fromisoformat(value))
+            elif python_type is date:
+                parsed.append(date.fromisoformat(value))
+            else:
+                parsed.append(python_type(value))
+        return direction, parsed
+    except (ValueError, TypeError, NotImplementedError):
+        return None
+
+
+def _equal(key, value):
+    return key.is_(None) if value is None else key == value
+
+
+def _step(key, value, descending):
+    """key 排在 value 之后的条件。SQLite中NULL最小：升序排在最前，降序排在最后"""
+    if value is None:
+        return false() if descending else key.isnot(None)
+    if descending:
+        return or_(key < value, key.is_(None)) if getattr(key.expression, 'nullable', False) else key < value
+    return key > value
+
+
+def _after(keys, values, descending):
+    """构造“排在游标之后”的条件：(a, b) < (x, y) 展开为 a < x OR (a = x AND b < y)
+
+    可为空的排序键（如 created_at）按SQLite的NULL顺序处理，值为NULL的行不会在翻页时丢失。
+    """
+    conditions = []
+    for i, key in enumerate(keys):
+        equal = [_equal(keys[j], values[j]) for j in range(i)]
+        conditions.append(and_(*equal, _step(key, values[i], descending)))
+    return or_(*conditions)
+
+
+def keyset_paginate(query, keys, cursor=None, per_page=20, descending=True, total=None):
+    """按排序键 keys 做键集分页，keys 最后一列必须唯一（通常是主键）"""
+    decoded = decode_cursor(cursor, keys) if cursor else None
+    direction, values = decoded if decoded else ('n', None)
+
+    # 向前翻页时按相反方向读取，取出后再倒序
+    forward = direction == 'n'
+    order_desc = descending if forward else not descending
+    if values is not None:
+        query = query.filter(_after(keys, values, order_desc))
+    query = query.order_by(*[key.desc() if order_desc else key.asc() for key in keys])
+    rows = query.limit(per_page + 1).all()
+
+    has_more = len(rows) > per_page
+    items = rows[:per_page]
+    if forward:
+        has_next, has_prev = has_more, values is not None
+    else:
+        items.reverse()
+        has_next, has_prev = True, has_more
+
+    next_cursor = prev_cursor = None
+    if items:
+        next_cursor = encode_cursor('n', [getattr(items[-1], key.key) for key in keys])
+        prev_cursor = encode_cursor('p', [getattr(items[0], key.key) for key in keys])
+
+    return KeysetPagination(items, per_page, has_next, has_prev, next_cursor, prev_cursor, total)
+
+
+def estimate_total(model):
+    """用主键最大值估算表的行数，只读取主键索引的一端，不做全表COUNT"""
+    return db.session.query(func.max(model.id)).scalar() or 0
+
+
+def paginate(query, keys, per_page=20, count_model=None):
+    """按 PAGINATION_MODE 配置对列表查询分页
+
+    keyset 模式读取 ?cursor= 参数，offset 模式读取 ?page= 参数。
+    count_model 不为空时（通常是未加筛选条件的列表），在键集模式下返回估算总数。
+    """
+    if current_app.config.get('PAGINATION_MODE', 'keyset') == 'offset':
+        page = request.args.get('page', 1, type=int)
+        return query.order_by(*[key.desc() for key in keys]).paginate(
+            page=page, per_page=per_page, error_out=False
+        )
+
+    total = None
+    if count_model is not None and current_app.config.get('PAGINATION_APPROX_TOTAL', True):
+        total = estimate_total(count_model)
+    return keyset_paginate(query, keys, cursor=request.args.get('cursor'), per_page=per_page, total=total)
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+密码哈希
+
+- 算法和参数由 PASSWORD_HASH_METHOD 配置（Werkzeug格式，如 scrypt:32768:8:1、
+  pbkdf2:sha256:600000），可用 bench_login.py 测出各参数下每秒能处理的登录数后选择
+- 存储的哈希带有生成时的参数，参数修改后用户下次登录成功时按新参数重新哈希
+- 登录时的校验在有界线程池中执行：同时计算的哈希数不超过 PASSWORD_HASH_WORKERS，
+  排队的请求超过 PASSWORD_HASH_QUEUE 时直接返回繁忙，避免交接班集中登录时占满CPU、
+  拖慢其他页面（hashlib 计算时会释放GIL，线程池即可并行）。请求线程仍然等待校验结果，
+  线程池只限制同时计算的哈希数，并不释放请求线程
+- 用户不存在或账户已停用时也用 dummy_hash() 计算一次哈希，响应时间不会暴露哪些用户名存在
+"""
+import secrets
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from flask import current_app
+from werkzeug.security import generate_password_hash, check_password_hash, DEFAULT_PBKDF2_ITERATIONS
+
+DEFAULT_HASH_METHOD = 'scrypt:32768:8:1'
+
+_executor = None
+_slots = None
+_lock = threading.Lock()
+# 算法参数 -> 随机密码的哈希
+_dummy_hashes = {}
+
+
+def normalize_method(method):
+    """补全省略的参数：'scrypt' -> 'scrypt:32768:8:1'，'pbkdf2' -> 'pbkdf2:sha256:<默认迭代次数>'"""
+    name, *args = method.split(':')
+    if name == 'scrypt' and not args:
+        return DEFAULT_HASH_METHOD
+    if name == 'pbkdf2' and len(args) < 2:
+        return f'pbkdf2:{args[0] if args else "sha256"}:{DEFAULT_PBKDF2_ITERATIONS}'
+    return method
+
+
+def hash_method():
+    return normalize_method(current_app.config.get('PASSWORD_HASH_METHOD') or DEFAULT_HASH_METHOD)
+
+
+def hash_password(password, method=None):
+    return generate_password_hash(password, method=method or hash_method())
+
+
+def needs_rehash(password_hash, method=None):
+    """存储的哈希是否用的是当前配置以外的算法或参数"""
+    return password_hash.split('$', 1)[0] != (method or hash_method())
+
+
+def dummy_hash():
+    """按当前参数生成的随机密码哈希，用于用户不存在时的校验，任何输入都不会通过"""
+    method = hash_method()
+    if method not in _dummy_hashes:
+        _dummy_hashes[method] = hash_password(secrets.token_hex(16), method)
+    return _dummy_hashes[method]
+
+
+def _pool():
+    global _executor, _slots
+    with _lock:
+        if _executor is None:
+            workers = current_app.config.get('PASSWORD_HASH_WORKERS') or 2
+            queue = current_app.config.get('PASSWORD_HASH_QUEUE', 32)
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+            _slots = threading.BoundedSemaphore(workers + queue)
+    return _executor, _slots
+
+
+def verify_password(password_hash, password):
+    """在线程池中校验密码，返回 True/False；排队已满或等待超时返回 None"""
+    executor, slots = _pool()
+    if not slots.acquire(blocking=False):
+        return None
+    try:
+        future = executor.submit(check_password_hash, password_hash, password)
+    except RuntimeError:
+        slots.release()
+        raise
+    future.add_done_callback(lambda _: slots.release())
+    try:
+        return future.result(timeout=current_app.config.get('PASSWORD_HASH_TIMEOUT', 10))
+    except FutureTimeoutError:
+        return None
+
+
+def shutdown():
+    """关闭校验线程池（测试或重新配置时使用）"""
+    global _executor, _slots
+    with _lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+        _executor = _slots = None
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+SQL查询计数器
+
+按请求统计发往数据库的SQL语句数量，用于发现N+1查询。
+视图函数可以通过 query_budget 声明查询预算，超出预算时：
+- 测试模式（app.testing）下抛出 QueryBudgetExceeded，使测试失败
+- 其他情况下记录警告日志
+
+测试中也可以直接使用 count_queries 统计一段代码的查询数量：
+
+    with count_queries(budget=5) as counter:
+        client.get('/records')
+"""
+import threading
+from contextlib import contextmanager
+from flask import g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+_local = threading.local()
+
+
+class QueryBudgetExceeded(AssertionError):
+    """SQL查询数量超出预算"""
+
+
+class QueryCounter:
+    """一段代码内执行的SQL语句统计"""
+
+    def __init__(self):
+        self.count = 0
+        self.statements = []
+
+    def __repr__(self):
+        return f'<QueryCounter {self.count}>'
+
+
+def _active_counters():
+    if not hasattr(_local, 'counters'):
+        _local.counters = []
+    return _local.counters
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    """每条SQL语句执行前计数"""
+    for counter in _active_counters():
+        counter.count += 1
+        counter.statements.append(statement)
+    if has_app_context():
+        g.sql_query_count = g.get('sql_query_count', 0) + 1
+
+
+@contextmanager
+def count_queries(budget=None):
+    """统计代码块内的SQL查询数量，超出budget时抛出QueryBudgetExceeded"""
+    counter = QueryCounter()
+    counters = _active_counters()
+    counters.append(counter)
+    try:
+        yield counter
+    finally:
+        counters.remove(counter)
+    if budget is not None and counter.count > budget:
+        raise QueryBudgetExceeded(
+            f'执行了 {counter.count} 条SQL，超出预算 {budget} 条：\n' + '\n'.join(counter.statements)
+        )
+
+
+def query_budget(max_queries):
+    """为视图函数声明单次请求允许的最大SQL查询数"""
+    def decorator(view):
+        view.query_budget = max_queries
+        return view
+    return decorator
+
+
+def current_query_count():
+    """当前请求已执行的SQL查询数"""
+    return g.get('sql_query_count', 0) if has_app_context() else 0
+
+
+def init_query_counter(app):
+    """在应用上注册查询计数和预算检查"""
+    app.config.setdefault('SQL_QUERY_BUDGET', None)
+    app.config.setdefault('SQL_QUERY_COUNT_HEADER', False)
+
+    if not getattr(Engine, '_query_counter_installed', False):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        Engine._query_counter_installed = True
+
+    @app.after_request
+    def check_query_budget(response):
+        count = current_query_count()
+        if app.debug or app.testing or app.config['SQL_QUERY_COUNT_HEADER']:
+            response.headers['X-SQL-Query-Count'] = str(count)
+
+        view = app.view_functions.get(request.endpoint)
+        budget = getattr(view, 'query_budget', None)
+        if budget is None:
+            budget = app.config['SQL_QUERY_BUDGET']
+        if budget is not None and count > budget:
+            message = f'{request.method} {request.path} 执行了 {count} 条SQL，超出预算 {budget} 条'
+            if app.testing:
+                raise QueryBudgetExceeded(message)
+            app.logger.warning(message)
+        return response
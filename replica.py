@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+只读副本读写分离
+
+配置 DATABASE_REPLICA_URL 后，GET请求中 db.session 发出的SELECT查询改从只读副本读取，
+列表、导出、统计等读取负载不再与录入争用主库。以下情况仍使用主库：
+
+- 非GET请求，以及会话中有待写入或本次请求已写入过数据之后的查询
+- 读己之写：用户提交写入后 REPLICA_STICKY_SECONDS 秒内，该用户的请求全部读主库
+- 缓存的计算（cache.get_or_set）、登录用户加载等包在 primary() 中的读取，
+  避免把副本上的旧数据写进缓存
+- 直接使用 db.engine 的代码（序列号、eGFR斜率、设置等）
+
+副本可以是主从复制的数据库，本地测试时也可以用SQLite快照：
+flask --app app refresh-replica [--interval 秒] 用SQLite在线备份接口把主库复制到副本文件。
+"""
+import sqlite3
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from flask import g, has_request_context, request, session as flask_session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.sql import Select
+
+REPLICA_BIND = 'replica'
+# 会话cookie中“在此时间之前读主库”的键
+_STICKY_KEY = '_primary_until'
+_force_primary = ContextVar('force_primary', default=False)
+
+
+@contextmanager
+def primary():
+    """其中的查询一律使用主库"""
+    token = _force_primary.set(True)
+    try:
+        yield
+    finally:
+        _force_primary.reset(token)
+
+
+class RoutingSession(Session):
+    """GET请求中的只读查询发往副本，其余发往主库"""
+
+    def _use_replica(self, clause):
+        if not (has_request_context() and g.get('read_replica')):
+            return False
+        if _force_primary.get() or self._flushing or self.info.get('wrote'):
+            return False
+        if self.new or self.dirty or self.deleted:
+            return False
+        return isinstance(clause, Select)
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self._use_replica(clause):
+            engine = self._db.engines.get(REPLICA_BIND)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _mark_written(session, flush_context):
+    session.info['wrote'] = True
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _stick_to_primary(session):
+    if session.info.pop('wrote', None) and has_request_context():
+        # 本次请求剩余部分和该用户之后一段时间的请求都读主库
+        g.read_replica = False
+        sticky = g.get('replica_sticky_seconds', 0)
+        if sticky:
+            flask_session[_STICKY_KEY] = time.time() + sticky
+
+
+def _sqlite_path(url):
+    url = make_url(url)
+    if url.get_backend_name() != 'sqlite' or url.database in (None, '', ':memory:'):
+        return None
+    return url.database
+
+
+def refresh_snapshot(primary_url, replica_url):
+    """用SQLite在线备份接口把主库完整复制到副本文件，复制期间主库可以正常读写"""
+    source_path, target_path = _sqlite_path(primary_url), _sqlite_path(replica_url)
+    if source_path is None or target_path is None:
+        raise ValueError('主库和副本都必须是SQLite数据库文件')
+    source = sqlite3.connect(source_path)
+    target = sqlite3.connect(target_path)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+
+
+def init_replica(app):
+    """配置了副本时登记副本连接（须在 db.init_app 之前调用），并注册请求路由和快照命令"""
+    import click
+    app.config.setdefault('SQLALCHEMY_REPLICA_URI', None)
+    app.config.setdefault('REPLICA_STICKY_SECONDS', 10)
+    replica_uri = app.config['SQLALCHEMY_REPLICA_URI']
+    if not replica_uri:
+        return
+    app.config.setdefault('SQLALCHEMY_BINDS', {})[REPLICA_BIND] = replica_uri
+
+    @app.before_request
+    def route_reads_to_replica():
+        g.replica_sticky_seconds = app.config['REPLICA_STICKY_SECONDS']
+        g.read_replica = (request.method in ('GET', 'HEAD')
+                          and flask_session.get(_STICKY_KEY, 0) < time.time())
+
+    @app.cli.command('refresh-replica')
+    @click.option('--interval', type=float, default=None, help='每隔多少秒刷新一次（默认只刷新一次）')
+    def refresh_replica_command(interval):
+        """把主库复制到SQLite副本文件（本地测试读写分离用）"""
+        from database import db
+        # 使用引擎的URL：Flask-SQLAlchemy已把SQLite相对路径解析到instance目录
+        primary_url, replica_url = db.engine.url, db.engines[REPLICA_BIND].url
+        while True:
+            started = time.perf_counter()
+            refresh_snapshot(primary_url, replica_url)
+            print(f'副本已刷新，用时{time.perf_counter() - started:.2f}秒')
+            if not interval:
+                break
+            time.sleep(interval)
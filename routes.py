@@ -1,9 +1,23 @@
-from flask import render_template, request, redirect, url_for, flash, jsonify
+from flask import render_template, request, redirect, url_for, flash, jsonify, abort, Response, stream_with_context
 from flask_login import login_user, logout_user, login_required, current_user
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload, contains_eager
 from datetime import datetime, date
 from app import app
 from database import db
-from models import User, Patient, FollowupRecord, SystemSetting
+from models import User, Patient, FollowupRecord, SystemSetting, to_dict
+from cache import cache
+from sequences import next_patient_id
+from worklist import get_worklist, worklist_item, BUCKET_UPCOMING, BUCKET_OVERDUE
+from query_counter import query_budget
+from pagination import paginate
+from search import patient_search_filter, record_list_filters
+from derived import compute_age
+from importer import import_file, ImportFileError, KIND_PATIENTS, KIND_LABELS
+from export import generate_csv, export_filename
+from analytics import fast_progressors
+from passwords import verify_password, needs_rehash, dummy_hash
+from slow_queries import slow_query_log
 
 @app.route('/')
 def index():
@@ -34,7 +48,18 @@ def login():
         
         user = User.query.filter_by(username=username).first()
         
-        if user and user.check_password(password) and user.is_active:
+        # 用户不存在或已停用时同样计算一次哈希，响应时间不暴露用户名是否存在、是否停用
+        valid = verify_password(user.password_hash if user else dummy_hash(), password)
+        if valid and not user.is_active:
+            valid = False
+        if valid is None:
+            flash('登录请求较多，请稍后重试', 'error')
+            return render_template('login.html'), 503
+        if valid:
+            # 哈希参数修改后，用本次输入的密码按新参数重新保存
+            if needs_rehash(user.password_hash):
+                user.set_password(password)
+                db.session.commit()
             login_user(user)
             next_page = request.args.get('next')
             return redirect(next_page) if next_page else redirect(url_for('dashboard'))
@@ -51,50 +76,61 @@ def logout():
     flash('您已成功登出', 'info')
     return redirect(url_for('login'))
 
+def _record_summary(record, with_patient=False, with_recorder=False):
+    """随访记录转为可缓存的字典，关联的患者和记录人只保留页面用到的字段"""
+    data = to_dict(record)
+    if with_patient:
+        data['patient'] = {'name': record.patient.name, 'patient_id': record.patient.patient_id}
+    if with_recorder:
+        data['recorder'] = {'real_name': record.recorder.real_name} if record.recorder else None
+    return data
+
+def _dashboard_data(today):
+    """仪表盘统计数据"""
+    total_patients = Patient.query.count()
+    total_records = FollowupRecord.query.count()
+    recent_records = FollowupRecord.query.options(
+        joinedload(FollowupRecord.patient)
+    ).order_by(FollowupRecord.followup_date.desc()).limit(10).all()
+    
+    # 随访工作清单：即将随访和已逾期的患者（每位患者只看最近一次记录中的计划）
+    upcoming_followups = get_worklist(BUCKET_UPCOMING, today, per_page=10).items
+    overdue_followups = get_worklist(BUCKET_OVERDUE, today, per_page=10).items
+    
+    return {
+        'total_patients': total_patients,
+        'total_records': total_records,
+        'recent_records': [_record_summary(r, with_patient=True) for r in recent_records],
+        'upcoming_followups': [worklist_item(r, today) for r in upcoming_followups],
+        'overdue_followups': [worklist_item(r, today) for r in overdue_followups],
+        'worklist_horizon': app.config['WORKLIST_HORIZON_DAYS'],
+        'fast_progressors': fast_progressors(limit=10),
+        'fast_decline_threshold': app.config['EGFR_FAST_DECLINE'],
+    }
+
 @app.route('/dashboard')
+@query_budget(10)
 @login_required
 def dashboard():
     """仪表盘/主页"""
-    # 统计信息
-    total_patients = Patient.query.count()
-    total_records = FollowupRecord.query.count()
-    recent_records = FollowupRecord.query.order_by(FollowupRecord.followup_date.desc()).limit(10).all()
-    
-    # 最近需要随访的患者（下次随访日期在7天内）
     today = date.today()
-    upcoming_followups = FollowupRecord.query.filter(
-        FollowupRecord.next_followup_date.isnot(None),
-        FollowupRecord.next_followup_date >= today,
-        FollowupRecord.next_followup_date <= date(today.year, today.month, today.day + 7)
-    ).order_by(FollowupRecord.next_followup_date.asc()).limit(10).all()
-    
-    return render_template('dashboard.html', 
-                         total_patients=total_patients,
-                         total_records=total_records,
-                         recent_records=recent_records,
-                         upcoming_followups=upcoming_followups)
+    data = cache.get_or_set(f'dashboard:{today.isoformat()}', lambda: _dashboard_data(today),
+                            tags=('patients', 'records', 'egfr_slopes'))
+    return render_template('dashboard.html', today=today, **data)
 
 @app.route('/patients')
 @login_required
 def patients():
     """患者列表"""
-    page = request.args.get('page', 1, type=int)
     per_page = 20
     search = request.args.get('search', '')
     
     query = Patient.query
     if search:
-        query = query.filter(
-            db.or_(
-                Patient.patient_id.like(f'%{search}%'),
-                Patient.name.like(f'%{search}%'),
-                Patient.phone.like(f'%{search}%')
-            )
-        )
+        query = query.filter(patient_search_filter(search))
     
-    pagination = query.order_by(Patient.created_at.desc()).paginate(
-        page=page, per_page=per_page, error_out=False
-    )
+    pagination = paginate(query, (Patient.created_at, Patient.id), per_page=per_page,
+                          count_model=None if search else Patient)
     
     return render_template('patients.html', 
                          patients=pagination.items,
@@ -108,19 +144,12 @@ def add_patient():
     if request.method == 'POST':
         try:
             # 生成患者编号
-            last_patient = Patient.query.order_by(Patient.id.desc()).first()
-            if last_patient:
-                last_id = int(last_patient.patient_id.split('-')[-1]) if '-' in last_patient.patient_id else 0
-                patient_id = f'IGA-{str(last_id + 1).zfill(6)}'
-            else:
-                patient_id = 'IGA-000001'
+            patient_id = next_patient_id()
             
             # 计算年龄
             age = None
             if request.form.get('birth_date'):
-                birth_date = datetime.strptime(request.form.get('birth_date'), '%Y-%m-%d').date()
-                today = date.today()
-                age = today.year - birth_date.year - ((today.month, today.day) < (birth_date.month, birth_date.day))
+                age = compute_age(datetime.strptime(request.form.get('birth_date'), '%Y-%m-%d').date())
             elif request.form.get('age'):
                 age = int(request.form.get('age'))
             
@@ -151,13 +180,32 @@ def add_patient():
     
     return render_template('patient_form.html', patient=None)
 
+def _patient_detail_data(patient_id):
+    """患者详情页数据：患者信息和全部随访记录"""
+    patient = db.session.get(Patient, patient_id, options=[joinedload(Patient.creator)])
+    if patient is None:
+        return None
+    records = FollowupRecord.query.options(
+        joinedload(FollowupRecord.recorder)
+    ).filter_by(patient_id=patient_id).order_by(FollowupRecord.followup_date.desc()).all()
+    
+    patient_data = to_dict(patient)
+    patient_data['creator'] = {'real_name': patient.creator.real_name} if patient.creator else None
+    return {
+        'patient': patient_data,
+        'records': [_record_summary(r, with_recorder=True) for r in records],
+    }
+
 @app.route('/patients/<int:patient_id>')
+@query_budget(5)
 @login_required
 def patient_detail(patient_id):
     """患者详情"""
-    patient = Patient.query.get_or_404(patient_id)
-    records = FollowupRecord.query.filter_by(patient_id=patient_id).order_by(FollowupRecord.followup_date.desc()).all()
-    return render_template('patient_detail.html', patient=patient, records=records)
+    data = cache.get_or_set(f'patient_detail:{patient_id}', lambda: _patient_detail_data(patient_id),
+                            tags=(f'patient:{patient_id}', 'users'))
+    if data is None:
+        abort(404)
+    return render_template('patient_detail.html', **data)
 
 @app.route('/patients/<int:patient_id>/edit', methods=['GET', 'POST'])
 @login_required
@@ -170,9 +218,7 @@ def edit_patient(patient_id):
             # 计算年龄
             age = None
             if request.form.get('birth_date'):
-                birth_date = datetime.strptime(request.form.get('birth_date'), '%Y-%m-%d').date()
-                today = date.today()
-                age = today.year - birth_date.year - ((today.month, today.day) < (birth_date.month, birth_date.day))
+                age = compute_age(datetime.strptime(request.form.get('birth_date'), '%Y-%m-%d').date())
             elif request.form.get('age'):
                 age = int(request.form.get('age'))
             
@@ -213,35 +259,47 @@ def delete_patient(patient_id):
     return redirect(url_for('patients'))
 
 @app.route('/records')
+@query_budget(5)
 @login_required
 def records():
     """随访记录列表"""
-    page = request.args.get('page', 1, type=int)
     per_page = 20
     search = request.args.get('search', '')
+    q = request.args.get('q', '')
     patient_id = request.args.get('patient_id', type=int)
     
-    query = FollowupRecord.query
-    if search:
-        query = query.join(Patient).filter(
-            db.or_(
-                Patient.patient_id.like(f'%{search}%'),
-                Patient.name.like(f'%{search}%')
-            )
-        )
-    if patient_id:
-        query = query.filter_by(patient_id=patient_id)
-    
-    pagination = query.order_by(FollowupRecord.followup_date.desc()).paginate(
-        page=page, per_page=per_page, error_out=False
+    # 患者和记录人随记录一次查出，避免模板中逐行懒加载
+    query = FollowupRecord.query.join(FollowupRecord.patient).options(
+        contains_eager(FollowupRecord.patient),
+        joinedload(FollowupRecord.recorder)
     )
+    query = query.filter(*record_list_filters(search, q, patient_id))
+    
+    pagination = paginate(query, (FollowupRecord.followup_date, FollowupRecord.id), per_page=per_page,
+                          count_model=None if search or q or patient_id else FollowupRecord)
     
     return render_template('records.html', 
                          records=pagination.items,
                          pagination=pagination,
                          search=search,
+                         q=q,
                          patient_id=patient_id)
 
+@app.route('/records/export')
+@login_required
+def export_records():
+    """按列表页的筛选条件流式导出随访记录CSV"""
+    chunks = generate_csv(
+        request.args.get('search', ''),
+        request.args.get('q', ''),
+        request.args.get('patient_id', type=int),
+    )
+    return Response(
+        stream_with_context(chunks),
+        mimetype='text/csv',
+        headers={'Content-Disposition': f'attachment; filename={export_filename()}'}
+    )
+
 @app.route('/records/add', methods=['GET', 'POST'])
 @login_required
 def add_record():
@@ -251,19 +309,6 @@ def add_record():
             patient_id = int(request.form.get('patient_id'))
             patient = Patient.query.get_or_404(patient_id)
             
-            # 计算BMI
-            bmi = None
-            weight = request.form.get('body_weight')
-            height = request.form.get('height')
-            if weight and height:
-                try:
-                    weight = float(weight)
-                    height = float(height) / 100  # 转换为米
-                    if height > 0:
-                        bmi = weight / (height * height)
-                except:
-                    pass
-            
             record = FollowupRecord(
                 patient_id=patient_id,
                 followup_date=datetime.strptime(request.form.get('followup_date'), '%Y-%m-%d').date(),
@@ -273,7 +318,6 @@ def add_record():
                 heart_rate=int(request.form.get('heart_rate')) if request.form.get('heart_rate') else None,
                 body_weight=float(request.form.get('body_weight')) if request.form.get('body_weight') else None,
                 height=float(request.form.get('height')) if request.form.get('height') else None,
-                bmi=bmi,
                 urine_protein=request.form.get('urine_protein') or None,
                 urine_rbc=request.form.get('urine_rbc') or None,
                 urine_protein_24h=float(request.form.get('urine_protein_24h')) if request.form.get('urine_protein_24h') else None,
@@ -299,14 +343,17 @@ def add_record():
             flash(f'添加随访记录失败：{str(e)}', 'error')
     
     patient_id = request.args.get('patient_id', type=int)
-    patients = Patient.query.order_by(Patient.name).all()
-    return render_template('record_form.html', record=None, patients=patients, patient_id=patient_id)
+    patient = Patient.query.get(patient_id) if patient_id else None
+    return render_template('record_form.html', record=None, patient=patient)
 
 @app.route('/records/<int:record_id>')
 @login_required
 def record_detail(record_id):
     """随访记录详情"""
-    record = FollowupRecord.query.get_or_404(record_id)
+    record = FollowupRecord.query.options(
+        joinedload(FollowupRecord.patient),
+        joinedload(FollowupRecord.recorder)
+    ).get_or_404(record_id)
     return render_template('record_detail.html', record=record)
 
 @app.route('/records/<int:record_id>/edit', methods=['GET', 'POST'])
@@ -317,19 +364,6 @@ def edit_record(record_id):
     
     if request.method == 'POST':
         try:
-            # 计算BMI
-            bmi = None
-            weight = request.form.get('body_weight')
-            height = request.form.get('height')
-            if weight and height:
-                try:
-                    weight = float(weight)
-                    height = float(height) / 100
-                    if height > 0:
-                        bmi = weight / (height * height)
-                except:
-                    pass
-            
             record.followup_date = datetime.strptime(request.form.get('followup_date'), '%Y-%m-%d').date()
             record.followup_type = request.form.get('followup_type') or None
             record.symptoms = request.form.get('symptoms') or None
@@ -337,7 +371,6 @@ def edit_record(record_id):
             record.heart_rate = int(request.form.get('heart_rate')) if request.form.get('heart_rate') else None
             record.body_weight = float(request.form.get('body_weight')) if request.form.get('body_weight') else None
             record.height = float(request.form.get('height')) if request.form.get('height') else None
-            record.bmi = bmi
             record.urine_protein = request.form.get('urine_protein') or None
             record.urine_rbc = request.form.get('urine_rbc') or None
             record.urine_protein_24h = float(request.form.get('urine_protein_24h')) if request.form.get('urine_protein_24h') else None
@@ -359,8 +392,7 @@ def edit_record(record_id):
             db.session.rollback()
             flash(f'更新随访记录失败：{str(e)}', 'error')
     
-    patients = Patient.query.order_by(Patient.name).all()
-    return render_template('record_form.html', record=record, patients=patients, patient_id=record.patient_id)
+    return render_template('record_form.html', record=record, patient=record.patient)
 
 @app.route('/records/<int:record_id>/delete', methods=['POST'])
 @login_required
@@ -385,7 +417,6 @@ def staff():
         flash('您没有权限访问此页面', 'error')
         return redirect(url_for('dashboard'))
     
-    page = request.args.get('page', 1, type=int)
     per_page = 20
     search = request.args.get('search', '')
     
@@ -398,9 +429,8 @@ def staff():
             )
         )
     
-    pagination = query.order_by(User.created_at.desc()).paginate(
-        page=page, per_page=per_page, error_out=False
-    )
+    pagination = paginate(query, (User.created_at, User.id), per_page=per_page,
+                          count_model=None if search else User)
     
     return render_template('staff.html', 
                          staff_list=pagination.items,
@@ -497,6 +527,10 @@ def delete_staff(staff_id):
         db.session.delete(staff)
         db.session.commit()
         flash('工作人员删除成功', 'success')
+    except IntegrityError:
+        # 启用外键约束时，录入过患者、随访记录或设置的账户不能删除
+        db.session.rollback()
+        flash('该工作人员已录入过数据，不能删除，可以在编辑页面停用该账户', 'error')
     except Exception as e:
         db.session.rollback()
         flash(f'删除工作人员失败：{str(e)}', 'error')
@@ -511,7 +545,9 @@ def settings():
         return redirect(url_for('dashboard'))
     
     settings_list = SystemSetting.query.order_by(SystemSetting.key).all()
-    return render_template('settings.html', settings=settings_list)
+    return render_template('settings.html', settings=settings_list,
+                           slow_queries=slow_query_log.entries(),
+                           slow_query_threshold=slow_query_log.threshold)
 
 @app.route('/settings/add', methods=['POST'])
 @login_required
@@ -577,6 +613,48 @@ def delete_setting(setting_id):
         db.session.rollback()
         return jsonify({'success': False, 'message': f'删除失败：{str(e)}'}), 500
 
+@app.route('/settings/cache/stats')
+@login_required
+def cache_stats():
+    """缓存命中统计"""
+    if current_user.role != 'admin':
+        return jsonify({'success': False, 'message': '没有权限'}), 403
+    
+    return jsonify({'success': True, 'stats': cache.stats()})
+
+@app.route('/settings/slow-queries/clear', methods=['POST'])
+@login_required
+def clear_slow_queries():
+    """清空慢查询记录"""
+    if current_user.role != 'admin':
+        return jsonify({'success': False, 'message': '没有权限'}), 403
+    
+    slow_query_log.clear()
+    return jsonify({'success': True, 'message': '慢查询记录已清空'})
+
+@app.route('/import', methods=['GET', 'POST'])
+@login_required
+def import_data():
+    """批量导入患者和随访记录"""
+    if current_user.role != 'admin':
+        flash('您没有权限访问此页面', 'error')
+        return redirect(url_for('dashboard'))
+    
+    result = None
+    kind = request.form.get('kind', KIND_PATIENTS)
+    if request.method == 'POST':
+        upload = request.files.get('file')
+        if not upload or not upload.filename:
+            flash('请选择要导入的文件', 'error')
+        else:
+            try:
+                result = import_file(upload.stream, upload.filename, kind, current_user.id)
+                flash(result.summary(), 'success' if not result.error_count else 'info')
+            except ImportFileError as e:
+                flash(f'导入失败：{str(e)}', 'error')
+    
+    return render_template('import.html', result=result, kind=kind, kinds=KIND_LABELS)
+
 def init_sample_data():
     """初始化示例数据"""
     # 检查是否已有数据
@@ -0,0 +1,433 @@
+# -*- coding: utf-8 -*-
+"""
+全文检索索引
+
+患者检索使用SQLite FTS5的trigram分词建立影子索引（patients_fts），
+覆盖患者编号、姓名、电话和身份证号，rowid与patients.id一致。
+trigram索引只能匹配3个字符及以上的关键词；更短的关键词（如两个字的姓名、
+电话号码片段）改为编号前缀查询加姓名、电话的LIKE包含查询。
+
+随访记录的症状、备注、用药情况使用单独的索引（records_fts），rowid与
+followup_records.id一致。中文没有空格分词，写入索引前先把连续的汉字切成
+相邻二元组（"蛋白尿" -> "蛋白 白尿 尿"），检索词按同样方式切分后做短语匹配。
+
+两个索引都通过SQLAlchemy的insert/update/delete事件与主表同步维护，
+在同一事务中写入，不会出现主表与索引不一致的情况。
+数据库不支持FTS5时检索回退为LIKE查询。
+"""
+import re
+from flask import current_app
+from markupsafe import Markup, escape
+from sqlalchemy import event, text, inspect, or_, and_, true, bindparam, Integer
+from sqlalchemy.exc import OperationalError
+from database import db
+from models import Patient, FollowupRecord
+
+PATIENT_FTS_TABLE = 'patients_fts'
+PATIENT_FTS_COLUMNS = ('patient_id', 'name', 'phone', 'id_card')
+# bm25列权重：编号和姓名命中优先于电话、身份证号
+PATIENT_FTS_WEIGHTS = (10.0, 5.0, 2.0, 2.0)
+MIN_TRIGRAM_LENGTH = 3
+
+RECORD_FTS_TABLE = 'records_fts'
+RECORD_FTS_COLUMNS = ('symptoms', 'notes', 'medications')
+RECORD_FTS_LABELS = {'symptoms': '症状', 'notes': '备注', 'medications': '用药'}
+REBUILD_CHUNK_SIZE = 1000
+
+_CJK_CHARS = r'\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff'
+# 一段连续汉字（分组1），或一段不含汉字的字母数字
+_TOKEN_RE = re.compile(f'([{_CJK_CHARS}]+)|[^\\W_{_CJK_CHARS}]+')
+
+# 各数据库（按连接URL区分）的索引是否可用
+_index_ready = {}
+
+
+def _index_key(connection_or_engine, table):
+    engine = getattr(connection_or_engine, 'engine', connection_or_engine)
+    return str(engine.url), table
+
+
+def _ensure_index(connection, table, create):
+    """确保FTS索引存在，不存在时调用create创建并填充，返回索引是否可用"""
+    key = _index_key(connection, table)
+    if key in _index_ready:
+        return _index_ready[key]
+    if connection.dialect.name != 'sqlite':
+        _index_ready[key] = False
+        return False
+    try:
+        exists = connection.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)
+        ).first()
+        if not exists:
+            create(connection)
+        _index_ready[key] = True
+    except OperationalError as e:
+        # SQLite未编译FTS5或版本过低不支持trigram分词
+        current_app.logger.warning(f'全文索引 {table} 不可用，检索将回退为LIKE查询：{e}')
+        _index_ready[key] = False
+    return _index_ready[key]
+
+
+def _rebuild_index(table, create):
+    with db.engine.begin() as connection:
+        _index_ready.pop(_index_key(connection, table), None)
+        connection.exec_driver_sql(f'DROP TABLE IF EXISTS {table}')
+        ready = _ensure_index(connection, table, create)
+        if ready:
+            connection.exec_driver_sql(f"INSERT INTO {table}({table}) VALUES ('optimize')")
+    return ready
+
+
+def _index_available(table):
+    return _index_ready.get(_index_key(db.engine, table), False)
+
+
+def _fts_phrase(tokens, prefix=False):
+    phrase = '"' + ' '.join(tokens).replace('"', '""') + '"'
+    return phrase + ' *' if prefix else phrase
+
+
+def _rowid_filter(column, table, match):
+    return column.in_(
+        text(f'SELECT rowid FROM {table} WHERE {table} MATCH :match')
+        .bindparams(match=match).columns(rowid=Integer)
+    )
+
+
+def _create_patient_index(connection):
+    """创建患者FTS索引并从patients表全量填充"""
+    connection.exec_driver_sql(
+        f"CREATE VIRTUAL TABLE {PATIENT_FTS_TABLE} USING fts5("
+        f"{', '.join(PATIENT_FTS_COLUMNS)}, tokenize='trigram')"
+    )
+    connection.exec_driver_sql(
+        f"INSERT INTO {PATIENT_FTS_TABLE}(rowid, {', '.join(PATIENT_FTS_COLUMNS)}) "
+        f"SELECT id, patient_id, name, coalesce(phone, ''), coalesce(id_card, '') FROM patients"
+    )
+
+
+def ensure_patient_index(connection):
+    """确保患者FTS索引存在，返回索引是否可用"""
+    return _ensure_index(connection, PATIENT_FTS_TABLE, _create_patient_index)
+
+
+def rebuild_patient_index():
+    """删除并重建患者FTS索引"""
+    return _rebuild_index(PATIENT_FTS_TABLE, _create_patient_index)
+
+
+def patient_index_available():
+    """当前数据库的患者FTS索引是否可用"""
+    return _index_available(PATIENT_FTS_TABLE)
+
+
+def _patient_values(patient):
+    return {
+        'rowid': patient.id,
+        'patient_id': patient.patient_id,
+        'name': patient.name,
+        'phone': patient.phone or '',
+        'id_card': patient.id_card or '',
+    }
+
+
+@event.listens_for(Patient, 'after_insert')
+def _index_patient_insert(mapper, connection, patient):
+    if ensure_patient_index(connection):
+        # 索引刚被创建时已经包含了本行，用REPLACE避免重复插入
+        connection.execute(text(
+            f"INSERT OR REPLACE INTO {PATIENT_FTS_TABLE}(rowid, {', '.join(PATIENT_FTS_COLUMNS)}) "
+            f"VALUES (:rowid, :patient_id, :name, :phone, :id_card)"
+        ), _patient_values(patient))
+
+
+@event.listens_for(Patient, 'after_update')
+def _index_patient_update(mapper, connection, patient):
+    state = inspect(patient)
+    if not any(state.attrs[column].history.has_changes() for column in PATIENT_FTS_COLUMNS):
+        return
+    if ensure_patient_index(connection):
+        connection.execute(text(
+            f"UPDATE {PATIENT_FTS_TABLE} SET patient_id = :patient_id, name = :name, "
+            f"phone = :phone, id_card = :id_card WHERE rowid = :rowid"
+        ), _patient_values(patient))
+
+
+@event.listens_for(Patient, 'after_delete')
+def _index_patient_delete(mapper, connection, patient):
+    if ensure_patient_index(connection):
+        connection.execute(text(f'DELETE FROM {PATIENT_FTS_TABLE} WHERE rowid = :rowid'),
+                           {'rowid': patient.id})
+
+
+def index_patients(connection, ids):
+    """把批量插入（不经过ORM事件）的患者写入索引"""
+    if ids and ensure_patient_index(connection):
+        connection.execute(text(
+            f"INSERT OR REPLACE INTO {PATIENT_FTS_TABLE}(rowid, {', '.join(PATIENT_FTS_COLUMNS)}) "
+            f"SELECT id, patient_id, name, coalesce(phone, ''), coalesce(id_card, '') "
+            f"FROM patients WHERE id IN :ids"
+        ).bindparams(bindparam('ids', expanding=True)), {'ids': list(ids)})
+
+
+def _patient_fts_query(words):
+    return ' '.join(_fts_phrase([word]) for word in words)
+
+
+def _short_word_filter(word):
+    """短关键词：编号前缀（走索引的范围查询），姓名、电话包含该词（LIKE）"""
+    upper = word + '\uffff'
+    return or_(
+        and_(Patient.patient_id >= word, Patient.patient_id < upper),
+        Patient.name.like(f'%{word}%'),
+        Patient.phone.like(f'%{word}%'),
+    )
+
+
+def _patient_like_filter(word):
+    return or_(
+        Patient.patient_id.like(f'%{word}%'),
+        Patient.name.like(f'%{word}%'),
+        Patient.phone.like(f'%{word}%'),
+        Patient.id_card.like(f'%{word}%'),
+    )
+
+
+def patient_search_filter(term):
+    """返回用于Patient查询的检索条件，多个词之间为AND"""
+    words = term.split()
+    if not words:
+        return true()
+    if not patient_index_available():
+        return and_(*[_patient_like_filter(word) for word in words])
+    long_words = [word for word in words if len(word) >= MIN_TRIGRAM_LENGTH]
+    conditions = [_short_word_filter(word) for word in words if len(word) < MIN_TRIGRAM_LENGTH]
+    if long_words:
+        conditions.append(_rowid_filter(Patient.id, PATIENT_FTS_TABLE, _patient_fts_query(long_words)))
+    return and_(*conditions)
+
+
+def search_patients(term, limit=20):
+    """按相关度排序返回匹配的患者"""
+    words = term.split()
+    if not words:
+        return []
+    if not patient_index_available() or any(len(word) < MIN_TRIGRAM_LENGTH for word in words):
+        return Patient.query.filter(patient_search_filter(term)).order_by(Patient.patient_id).limit(limit).all()
+
+    weights = ', '.join(str(w) for w in PATIENT_FTS_WEIGHTS)
+    ranked_ids = [row[0] for row in db.session.execute(text(
+        f'SELECT rowid FROM {PATIENT_FTS_TABLE} WHERE {PATIENT_FTS_TABLE} MATCH :match '
+        f'ORDER BY bm25({PATIENT_FTS_TABLE}, {weights}) LIMIT :limit'
+    ), {'match': _patient_fts_query(words), 'limit': limit})]
+    patients = {p.id: p for p in Patient.query.filter(Patient.id.in_(ranked_ids))}
+    return [patients[i] for i in ranked_ids if i in patients]
+
+
+def bigram_tokens(value):
+    """中文按相邻二元组切分（每段连续汉字的最后一个字单独保留），其余按单词切分"""
+    tokens = []
+    for match in _TOKEN_RE.finditer(value or ''):
+        run = match.group()
+        if match.group(1):
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+            tokens.append(run[-1])
+        else:
+            tokens.append(run.lower())
+    return tokens
+
+
+def _record_values(record):
+    values = {'rowid': record.id}
+    for column in RECORD_FTS_COLUMNS:
+        values[column] = ' '.join(bigram_tokens(getattr(record, column)))
+    return values
+
+
+def _create_record_index(connection):
+    """创建随访记录FTS索引，按主键分块读取记录、切分后写入"""
+    connection.exec_driver_sql(
+        f"CREATE VIRTUAL TABLE {RECORD_FTS_TABLE} USING fts5("
+        f"{', '.join(RECORD_FTS_COLUMNS)}, tokenize='unicode61')"
+    )
+    insert = text(
+        f"INSERT INTO {RECORD_FTS_TABLE}(rowid, {', '.join(RECORD_FTS_COLUMNS)}) "
+        f"VALUES (:rowid, :symptoms, :notes, :medications)"
+    )
+    last_id = 0
+    while True:
+        rows = connection.exec_driver_sql(
+            f"SELECT id, {', '.join(RECORD_FTS_COLUMNS)} FROM followup_records "
+            f"WHERE id > ? ORDER BY id LIMIT ?", (last_id, REBUILD_CHUNK_SIZE)
+        ).all()
+        if not rows:
+            break
+        connection.execute(insert, [
+            {'rowid': row[0], **{column: ' '.join(bigram_tokens(value))
+                                 for column, value in zip(RECORD_FTS_COLUMNS, row[1:])}}
+            for row in rows
+        ])
+        last_id = rows[-1][0]
+
+
+def ensure_record_index(connection):
+    """确保随访记录FTS索引存在，返回索引是否可用"""
+    return _ensure_index(connection, RECORD_FTS_TABLE, _create_record_index)
+
+
+def rebuild_record_index():
+    """删除并重建随访记录FTS索引"""
+    return _rebuild_index(RECORD_FTS_TABLE, _create_record_index)
+
+
+def record_index_available():
+    """当前数据库的随访记录FTS索引是否可用"""
+    return _index_available(RECORD_FTS_TABLE)
+
+
+@event.listens_for(FollowupRecord, 'after_insert')
+def _index_record_insert(mapper, connection, record):
+    if ensure_record_index(connection):
+        connection.execute(text(
+            f"INSERT OR REPLACE INTO {RECORD_FTS_TABLE}(rowid, {', '.join(RECORD_FTS_COLUMNS)}) "
+            f"VALUES (:rowid, :symptoms, :notes, :medications)"
+        ), _record_values(record))
+
+
+@event.listens_for(FollowupRecord, 'after_update')
+def _index_record_update(mapper, connection, record):
+    state = inspect(record)
+    if not any(state.attrs[column].history.has_changes() for column in RECORD_FTS_COLUMNS):
+        return
+    if ensure_record_index(connection):
+        connection.execute(text(
+            f"UPDATE {RECORD_FTS_TABLE} SET symptoms = :symptoms, notes = :notes, "
+            f"medications = :medications WHERE rowid = :rowid"
+        ), _record_values(record))
+
+
+@event.listens_for(FollowupRecord, 'after_delete')
+def _index_record_delete(mapper, connection, record):
+    if ensure_record_index(connection):
+        connection.execute(text(f'DELETE FROM {RECORD_FTS_TABLE} WHERE rowid = :rowid'),
+                           {'rowid': record.id})
+
+
+def index_records(connection, ids):
+    """把批量插入（不经过ORM事件）的随访记录写入索引"""
+    if not ids or not ensure_record_index(connection):
+        return
+    rows = connection.execute(text(
+        f"SELECT id, {', '.join(RECORD_FTS_COLUMNS)} FROM followup_records WHERE id IN :ids"
+    ).bindparams(bindparam('ids', expanding=True)), {'ids': list(ids)}).all()
+    connection.execute(text(
+        f"INSERT OR REPLACE INTO {RECORD_FTS_TABLE}(rowid, {', '.join(RECORD_FTS_COLUMNS)}) "
+        f"VALUES (:rowid, :symptoms, :notes, :medications)"
+    ), [{'rowid': row[0], **{column: ' '.join(bigram_tokens(value))
+                             for column, value in zip(RECORD_FTS_COLUMNS, row[1:])}}
+        for row in rows])
+
+
+def _record_fts_query(words):
+    """每个检索词切分为二元组短语；以单个汉字或字母数字结尾的词按前缀匹配"""
+    phrases = []
+    for word in words:
+        tokens, prefix = [], False
+        for match in _TOKEN_RE.finditer(word):
+            run = match.group()
+            if match.group(1) and len(run) > 1:
+                tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+                prefix = False
+            else:
+                tokens.append(run.lower())
+                prefix = True
+        if tokens:
+            phrases.append(_fts_phrase(tokens, prefix))
+    return ' '.join(phrases)
+
+
+def record_search_filter(term):
+    """返回用于FollowupRecord查询的内容检索条件，多个词之间为AND"""
+    words = term.split()
+    if not words:
+        return true()
+    match = _record_fts_query(words) if record_index_available() else ''
+    if not match:
+        return and_(*[
+            or_(*[getattr(FollowupRecord, column).like(f'%{word}%') for column in RECORD_FTS_COLUMNS])
+            for word in words
+        ])
+    return _rowid_filter(FollowupRecord.id, RECORD_FTS_TABLE, match)
+
+
+def record_list_filters(search='', q='', patient_id=None):
+    """随访记录列表的筛选条件（需要连接patients表）：患者检索、内容检索、指定患者"""
+    conditions = []
+    if search:
+        conditions.append(patient_search_filter(search))
+    if q:
+        conditions.append(record_search_filter(q))
+    if patient_id:
+        conditions.append(FollowupRecord.patient_id == patient_id)
+    return conditions
+
+
+def highlight(value, term, width=30):
+    """截取value中第一个命中term的片段，并用<mark>标出所有命中的检索词"""
+    if not value or not term:
+        return escape(value or '')
+    words = sorted(set(term.split()), key=len, reverse=True)
+    pattern = re.compile('|'.join(re.escape(word) for word in words), re.IGNORECASE)
+    first = pattern.search(value)
+    if first is None:
+        return escape(value[:width * 2] + ('...' if len(value) > width * 2 else ''))
+
+    start = max(0, first.start() - width)
+    end = min(len(value), first.end() + width)
+    snippet = value[start:end]
+    parts, last = [], 0
+    for match in pattern.finditer(snippet):
+        parts.append(escape(snippet[last:match.start()]))
+        parts.append(Markup('<mark>%s</mark>') % match.group())
+        last = match.end()
+    parts.append(escape(snippet[last:]))
+    return Markup(('...' if start > 0 else '') + ''.join(parts) + ('...' if end < len(value) else ''))
+
+
+def record_highlight(record, term, width=30):
+    """返回随访记录中命中检索词的字段片段，如“症状：...<mark>蛋白</mark>...”"""
+    words = term.split()
+    for column in RECORD_FTS_COLUMNS:
+        value = getattr(record, column)
+        if value and any(word.lower() in value.lower() for word in words):
+            return Markup('%s：') % RECORD_FTS_LABELS[column] + highlight(value, term, width)
+    return escape(record.symptoms or '-')
+
+
+def ensure_indexes():
+    """确保当前数据库的两个FTS索引已检查（不存在时创建）"""
+    if _index_key(db.engine, RECORD_FTS_TABLE) not in _index_ready:
+        with db.engine.begin() as connection:
+            ensure_patient_index(connection)
+            ensure_record_index(connection)
+
+
+def init_search(app):
+    """注册索引初始化、模板过滤器和命令行命令"""
+    app.add_template_filter(highlight, 'highlight')
+    app.add_template_filter(record_highlight, 'record_highlight')
+
+    @app.before_request
+    def ensure_search_indexes():
+        ensure_indexes()
+
+    @app.cli.command('rebuild-search-index')
+    def rebuild_search_index_command():
+        """重建全文检索索引"""
+        patients_ok = rebuild_patient_index()
+        records_ok = rebuild_record_index()
+        if patients_ok and records_ok:
+            print('患者和随访记录全文索引重建完成')
+        else:
+            print('当前数据库不支持FTS5全文索引，检索将使用LIKE查询')
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+编号序列分配
+
+患者编号等序列号保存在计数器表（counters）中。每个进程一次向计数器表
+原子地预留一段连续编号（UPDATE value = value + 块大小），用完前都在内存中分配，
+既不需要查询患者表里的最大编号，多个工作进程同时分配也不会冲突。
+
+进程退出时未用完的编号会被放弃，因此编号可能不连续，但不会重复。
+导入或接口中显式指定的患者编号通过 advance_patient_id 把计数器推进到该编号之后，
+以后自动分配的编号不会与之重复（其他进程已预留、尚未用完的编号块除外）。
+"""
+import os
+import threading
+from flask import current_app
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+from database import db
+
+PATIENT_ID_SEQUENCE = 'patient_id'
+PATIENT_ID_PREFIX = 'IGA-'
+
+# (数据库URL, 序列名) -> [下一个可用编号, 本块最后一个编号]
+_blocks = {}
+_lock = threading.Lock()
+_pid = os.getpid()
+
+
+def allocate_block(name, size, seed=None):
+    """在计数器表中原子地预留 size 个连续编号，返回其中第一个
+
+    计数器不存在时以 seed(connection) 的返回值（默认0）为起点创建。
+    """
+    with db.engine.begin() as connection:
+        updated = connection.execute(
+            text('UPDATE counters SET value = value + :size WHERE name = :name'),
+            {'size': size, 'name': name}
+        ).rowcount
+        if not updated:
+            start = seed(connection) if seed else 0
+            try:
+                with connection.begin_nested():
+                    connection.execute(
+                        text('INSERT INTO counters (name, value) VALUES (:name, :value)'),
+                        {'name': name, 'value': start + size}
+                    )
+            except IntegrityError:
+                # 其他进程已抢先创建了计数器
+                connection.execute(
+                    text('UPDATE counters SET value = value + :size WHERE name = :name'),
+                    {'size': size, 'name': name}
+                )
+        value = connection.execute(
+            text('SELECT value FROM counters WHERE name = :name'), {'name': name}
+        ).scalar_one()
+    return value - size + 1
+
+
+def next_value(name, block_size=1, seed=None):
+    """从本进程预留的编号块中取下一个编号，块用完时再向计数器表预留"""
+    global _pid
+    with _lock:
+        if os.getpid() != _pid:
+            # fork出的子进程不能继续使用父进程预留的编号块
+            _blocks.clear()
+            _pid = os.getpid()
+        key = (str(db.engine.url), name)
+        block = _blocks.get(key)
+        if block is None or block[0] > block[1]:
+            start = allocate_block(name, block_size, seed)
+            block = _blocks[key] = [start, start + block_size - 1]
+        value = block[0]
+        block[0] += 1
+    return value
+
+
+def _seed_patient_id(connection):
+    """计数器首次创建时，以现有患者编号的最大数字部分为起点"""
+    return connection.execute(text(
+        "SELECT coalesce(max(CAST(substr(patient_id, :start) AS INTEGER)), 0) "
+        "FROM patients WHERE patient_id LIKE :prefix"
+    ), {'start': len(PATIENT_ID_PREFIX) + 1, 'prefix': PATIENT_ID_PREFIX + '%'}).scalar()
+
+
+def format_patient_id(number):
+    return f'{PATIENT_ID_PREFIX}{str(number).zfill(6)}'
+
+
+def next_patient_id():
+    """分配一个新的患者编号，如 IGA-000123"""
+    block_size = current_app.config.get('PATIENT_ID_BLOCK_SIZE', 10)
+    return format_patient_id(next_value(PATIENT_ID_SEQUENCE, block_size, _seed_patient_id))
+
+
+def allocate_patient_ids(count):
+    """为批量导入一次性分配 count 个连续的患者编号"""
+    if count <= 0:
+        return []
+    start = allocate_block(PATIENT_ID_SEQUENCE, count, _seed_patient_id)
+    return [format_patient_id(number) for number in range(start, start + count)]
+
+
+def advance_patient_id(connection, codes):
+    """显式指定了患者编号时，把计数器推进到不小于其中最大的编号数字部分
+
+    应与写入患者在同一事务中调用（connection 为连接或会话）。计数器尚未创建时不需要处理，
+    首次分配时会以患者表中的最大编号为起点。
+    """
+    numbers = [int(code[len(PATIENT_ID_PREFIX):]) for code in codes
+               if code and code.startswith(PATIENT_ID_PREFIX) and code[len(PATIENT_ID_PREFIX):].isdigit()]
+    if not numbers:
+        return
+    largest = max(numbers)
+    connection.execute(
+        text('UPDATE counters SET value = max(value, :value) WHERE name = :name'),
+        {'value': largest, 'name': PATIENT_ID_SEQUENCE}
+    )
+    # 本进程已预留的编号块中不大于该编号的部分不再使用
+    with _lock:
+        block = _blocks.get((str(db.engine.url), PATIENT_ID_SEQUENCE))
+        if block is not None:
+            block[0] = max(block[0], largest + 1)
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+生产环境启动脚本
+
+    python serve.py [--bind 0.0.0.0:5001] [--workers 4] [--threads 4] [--pid serve.pid]
+
+- Linux/macOS 使用 gunicorn：主进程先导入应用并预热（建表、全文索引、患者选择器索引、
+  系统设置、模板编译、eGFR斜率），再派生多个工作进程，预热结果随fork共享；每个工作进程启动后
+  丢弃从主进程继承的数据库连接池，各自重新建立连接
+- Windows 或未安装 gunicorn 时使用 waitress（单进程多线程）
+- 多个工作进程的缓存失效通过数据库计数器表（或Redis）共享；设置 CACHE_SHARED_TAGS=0 且未使用
+  Redis 时只启动1个工作进程
+- 参数默认值取自配置 SERVER_*（可用同名环境变量设置），命令行参数优先
+
+gunicorn 运行时的平滑重启：
+    kill -HUP  $(cat serve.pid)   # 按新配置逐个替换工作进程，处理中的请求会先完成
+    kill -USR2 $(cat serve.pid)   # 代码更新后启动新的主进程，确认正常后对旧主进程发送 TERM
+    kill -TERM $(cat serve.pid)   # 等待处理中的请求完成（最多 graceful_timeout 秒）后退出
+"""
+import argparse
+import sys
+import tempfile
+
+from app import app
+from database import db
+from cache import cache
+from metrics import reset_directory
+from sqlite_profile import foreign_key_violations
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='以多进程WSGI服务器运行随访系统')
+    parser.add_argument('--bind', default=app.config['SERVER_BIND'], help='监听地址，如 0.0.0.0:5001')
+    parser.add_argument('--workers', type=int, default=app.config['SERVER_WORKERS'], help='工作进程数')
+    parser.add_argument('--threads', type=int, default=app.config['SERVER_THREADS'], help='每个工作进程的线程数')
+    parser.add_argument('--timeout', type=int, default=app.config['SERVER_TIMEOUT'], help='请求超时（秒）')
+    parser.add_argument('--pid', default=None, help='主进程PID文件，用于发送重启信号')
+    parser.add_argument('--server', choices=('auto', 'gunicorn', 'waitress'), default='auto',
+                        help='WSGI服务器，auto 优先使用 gunicorn')
+    return parser.parse_args()
+
+
+def warm_up():
+    """在主进程中预热：建表和迁移、全文索引、内存索引、设置和模板；最后关闭主进程的数据库连接"""
+    from search import ensure_indexes
+    from migrate import upgrade
+    from analytics import refresh_slopes
+    import settings
+    import typeahead
+    from templating import precompile_templates
+
+    with app.app_context():
+        upgrade()
+        if app.config.get('SQLITE_FOREIGN_KEYS') and db.engine.dialect.name == 'sqlite':
+            with db.engine.connect() as connection:
+                violations = foreign_key_violations(connection)
+            if violations:
+                print(f'警告：{len(violations)}行数据违反外键约束，这些行将无法修改，'
+                      f'详见 flask --app app check-foreign-keys（或设置 SQLITE_FOREIGN_KEYS=0）')
+        ensure_indexes()
+        typeahead.warm()
+        settings.all_settings()
+        precompile_templates(app)
+        refresh_slopes()
+        db.session.remove()
+        # 连接不能跨进程使用，fork之前全部关闭
+        for engine in db.engines.values():
+            engine.dispose()
+
+
+def dispose_inherited_connections():
+    """fork后的子进程丢弃继承的连接池（不关闭父进程的连接），之后按需重新连接"""
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+
+
+def run_gunicorn(args):
+    from gunicorn.app.base import BaseApplication
+
+    class StandaloneApplication(BaseApplication):
+        def __init__(self, application, options):
+            self.application = application
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return self.application
+
+    def post_fork(server, worker):
+        dispose_inherited_connections()
+
+    # 进程内缓存的标签版本号不共享时，其他进程看不到修改后的失效，只能以单进程运行
+    if args.workers > 1 and not cache.shared:
+        print('警告：CACHE_SHARED_TAGS=0 时缓存失效只在本进程生效，改为以1个工作进程启动')
+        args.workers = 1
+
+    # 各工作进程的请求指标写入同一目录，/metrics 输出合计值
+    if args.workers > 1 and not app.config.get('METRICS_DIR'):
+        app.config['METRICS_DIR'] = tempfile.mkdtemp(prefix='iga-metrics-')
+    reset_directory(app.config.get('METRICS_DIR'))
+
+    options = {
+        'bind': args.bind,
+        'workers': args.workers,
+        'threads': args.threads,
+        'worker_class': 'gthread' if args.threads > 1 else 'sync',
+        'timeout': args.timeout,
+        'graceful_timeout': app.config['SERVER_GRACEFUL_TIMEOUT'],
+        'max_requests': app.config['SERVER_MAX_REQUESTS'],
+        'max_requests_jitter': app.config['SERVER_MAX_REQUESTS'] // 10,
+        'preload_app': True,
+        'post_fork': post_fork,
+        'accesslog': '-',
+        'pidfile': args.pid,
+    }
+    StandaloneApplication(app, options).run()
+
+
+def run_waitress(args):
+    from waitress import serve
+
+    # waitress 为单进程，用进程数×线程数作为线程总数
+    serve(app, listen=args.bind, threads=max(1, args.workers * args.threads))
+
+
+def main():
+    args = parse_args()
+    server = args.server
+    if server == 'auto':
+        try:
+            import gunicorn  # noqa: F401
+            server = 'gunicorn' if sys.platform != 'win32' else 'waitress'
+        except ImportError:
+            server = 'waitress'
+
+    print('预热中...')
+    warm_up()
+    print(f'使用 {server} 启动：{args.bind}，{args.workers} 个进程 × {args.threads} 个线程')
+    if server == 'gunicorn':
+        run_gunicorn(args)
+    else:
+        run_waitress(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+系统设置读取
+
+system_settings 表的全部设置一次读入内存，之后按键从字典读取，请求中的功能开关、
+阈值等读取不再查询数据库。
+
+- 版本号保存在计数器表的 system_settings_version 行：设置新增、修改、删除时在同一事务中
+  加一（ORM事件，设置页面的增删改都会触发）
+- 本进程提交修改后立即重新加载；其他工作进程每隔 SETTINGS_CHECK_INTERVAL 秒
+  比较一次版本号（一条按主键的查询），版本变化时重新加载全部设置
+- get_bool、get_int、get_float 把文本值转换为对应类型，值不存在或无法转换时返回默认值
+"""
+import threading
+import time
+from flask import current_app
+from sqlalchemy import event, select, update, insert
+from sqlalchemy.orm import Session, object_session
+from database import db
+from models import SystemSetting, Counter
+
+SETTINGS_VERSION = 'system_settings_version'
+_TRUE_VALUES = {'1', 'true', 'yes', 'on', '是'}
+_FALSE_VALUES = {'0', 'false', 'no', 'off', '否', ''}
+
+
+class _Settings:
+    """进程内的设置副本"""
+
+    def __init__(self):
+        self.values = None
+        self.version = None
+        self.engine = None
+        self.checked_at = 0.0
+        self.lock = threading.Lock()
+
+    def invalidate(self):
+        self.values = None
+
+
+_settings = _Settings()
+
+
+def _current_version(connection):
+    return connection.execute(
+        select(Counter.value).where(Counter.name == SETTINGS_VERSION)
+    ).scalar() or 0
+
+
+def _load():
+    """需要时重新加载全部设置，返回 键 -> 值 字典"""
+    now = time.monotonic()
+    interval = current_app.config.get('SETTINGS_CHECK_INTERVAL', 5)
+    engine = db.engine
+    state = _settings
+    if state.values is not None and state.engine is engine and now - state.checked_at < interval:
+        return state.values
+
+    with state.lock:
+        if state.values is not None and state.engine is engine and now - state.checked_at < interval:
+            return state.values
+        with engine.connect() as connection:
+            version = _current_version(connection)
+            if state.values is None or state.engine is not engine or version != state.version:
+                # 版本号和设置在同一个连接中读取，读到的设置不会比版本号旧
+                state.values = dict(connection.execute(select(SystemSetting.key, SystemSetting.value)).all())
+                state.version = version
+                state.engine = engine
+        state.checked_at = now
+    return state.values
+
+
+def get(key, default=None):
+    """读取设置的文本值"""
+    value = _load().get(key)
+    return default if value is None else value
+
+
+def get_bool(key, default=False):
+    value = get(key)
+    if value is None:
+        return default
+    value = value.strip().lower()
+    if value in _TRUE_VALUES:
+        return True
+    if value in _FALSE_VALUES:
+        return False
+    return default
+
+
+def get_int(key, default=None):
+    try:
+        return int(get(key))
+    except (TypeError, ValueError):
+        return default
+
+
+def get_float(key, default=None):
+    try:
+        return float(get(key))
+    except (TypeError, ValueError):
+        return default
+
+
+def all_settings():
+    """全部设置的副本"""
+    return dict(_load())
+
+
+def bump_version(connection):
+    """设置版本号加一，计数器不存在时创建"""
+    table = Counter.__table__
+    updated = connection.execute(
+        update(table).where(table.c.name == SETTINGS_VERSION).values(value=table.c.value + 1)
+    ).rowcount
+    if not updated:
+        connection.execute(insert(table).values(name=SETTINGS_VERSION, value=1))
+
+
+@event.listens_for(SystemSetting, 'after_insert')
+@event.listens_for(SystemSetting, 'after_update')
+@event.listens_for(SystemSetting, 'after_delete')
+def _setting_written(mapper, connection, setting):
+    bump_version(connection)
+    session = object_session(setting)
+    if session is not None:
+        session.info['settings_changed'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _reload_committed(session):
+    if session.info.pop('settings_changed', None):
+        _settings.invalidate()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changed(session):
+    session.info.pop('settings_changed', None)
+
+
+def init_settings(app):
+    """设置读取函数注册为模板全局函数：{% if setting_bool('show_xxx') %}"""
+    app.config.setdefault('SETTINGS_CHECK_INTERVAL', 5)
+    app.jinja_env.globals.update(setting=get, setting_bool=get_bool)
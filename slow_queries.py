@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+慢查询记录
+
+执行时间超过 SLOW_QUERY_THRESHOLD_MS 毫秒的SQL语句连同参数、发起的请求（方法、路径、端点）
+和 EXPLAIN QUERY PLAN 的结果一起写入日志，并保存在固定长度的环形缓冲区中（最近
+SLOW_QUERY_LOG_SIZE 条），管理员可以在系统设置页面查看，用于发现LIKE全表扫描和缺少的索引。
+
+- 只在语句超过阈值后才获取执行计划，正常语句只多两次计时
+- 执行计划用同一个数据库连接获取（EXPLAIN QUERY PLAN 不执行语句），目前只支持SQLite
+- 缓冲区在每个工作进程中各自保存；多进程部署时完整记录见日志
+- 参数可能包含患者姓名、电话等信息，默认不记录，设置 SLOW_QUERY_LOG_PARAMETERS=1 后才写入日志和缓冲区
+"""
+import logging
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from flask import has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from index_advisor import problems
+
+logger = logging.getLogger(__name__)
+
+# 可以获取执行计划的语句
+_EXPLAINABLE = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE')
+# 记录的语句和参数的最大长度
+_MAX_STATEMENT = 4000
+_MAX_PARAMETERS = 500
+
+
+class SlowQueryLog:
+    """最近的慢查询（环形缓冲区）"""
+
+    def __init__(self, size=100):
+        self.threshold = None
+        self.log_parameters = False
+        self._entries = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def resize(self, size):
+        with self._lock:
+            self._entries = deque(self._entries, maxlen=size)
+
+    def add(self, entry):
+        with self._lock:
+            self._entries.append(entry)
+
+    def entries(self):
+        """最近的慢查询，最新的在前"""
+        with self._lock:
+            return list(reversed(self._entries))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+slow_query_log = SlowQueryLog()
+
+
+def _explain(dbapi_connection, statement, parameters):
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute('EXPLAIN QUERY PLAN ' + statement, parameters)
+        return [row[-1] for row in cursor.fetchall()]
+    except Exception as e:
+        return [f'无法获取执行计划：{e}']
+    finally:
+        cursor.close()
+
+
+def _route():
+    if not has_request_context():
+        return None
+    return f'{request.method} {request.path}' + (f' ({request.endpoint})' if request.endpoint else '')
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._slow_query_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_slow_query_started', None)
+    if started is None:
+        return
+    elapsed = (time.perf_counter() - started) * 1000
+    if elapsed < slow_query_log.threshold:
+        return
+
+    first_parameters = parameters[0] if executemany and parameters else parameters
+    plan = []
+    if conn.dialect.name == 'sqlite' and statement.lstrip().upper().startswith(_EXPLAINABLE):
+        plan = _explain(conn.connection.dbapi_connection, statement, first_parameters or ())
+    entry = {
+        'time': datetime.now(),
+        'duration_ms': round(elapsed, 1),
+        'statement': statement[:_MAX_STATEMENT],
+        'parameters': repr(first_parameters)[:_MAX_PARAMETERS] if slow_query_log.log_parameters else None,
+        'executemany': executemany,
+        'route': _route(),
+        'plan': plan,
+        'problems': problems(plan),
+    }
+    slow_query_log.add(entry)
+    logger.warning('慢查询 %.1fms %s\n%s\n参数：%s\n执行计划：\n%s', elapsed, entry['route'] or '-',
+                   entry['statement'], '未记录' if entry['parameters'] is None else entry['parameters'],
+                   '\n'.join(plan) or '-')
+
+
+def init_slow_queries(app):
+    """按配置启用慢查询记录（SLOW_QUERY_THRESHOLD_MS 未设置或为0时不启用）"""
+    app.config.setdefault('SLOW_QUERY_THRESHOLD_MS', 200)
+    app.config.setdefault('SLOW_QUERY_LOG_SIZE', 100)
+    app.config.setdefault('SLOW_QUERY_LOG_PARAMETERS', False)
+    threshold = app.config['SLOW_QUERY_THRESHOLD_MS']
+    if not threshold:
+        return
+    slow_query_log.threshold = threshold
+    slow_query_log.log_parameters = app.config['SLOW_QUERY_LOG_PARAMETERS']
+    slow_query_log.resize(app.config['SLOW_QUERY_LOG_SIZE'])
+
+    if not getattr(Engine, '_slow_queries_installed', False):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        Engine._slow_queries_installed = True
+    app.extensions['slow_queries'] = slow_query_log
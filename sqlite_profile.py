@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+SQLite连接参数和连接池
+
+每个新建立的SQLite连接按配置执行PRAGMA：
+
+- journal_mode=WAL：读写互不阻塞，读操作不再持有共享锁
+- busy_timeout：遇到写锁时等待的毫秒数，而不是立即报 database is locked
+- synchronous=NORMAL：WAL模式下只在检查点时同步磁盘，断电最多丢失最近的事务，不会损坏数据库
+- cache_size、mmap_size：页缓存和内存映射大小
+- foreign_keys：启用外键约束（SQLite默认不检查）。已有数据库中可能存在引用了已删除行的记录，
+  启用前先执行 flask --app app check-foreign-keys 列出这些行；启用后这些行无法修改，
+  录入过数据的工作人员也不能再删除
+
+连接池大小由 DB_POOL_SIZE、DB_MAX_OVERFLOW、DB_POOL_TIMEOUT 配置，写入 SQLALCHEMY_ENGINE_OPTIONS
+（已显式配置的项不覆盖）；内存数据库使用单连接池，不设置池大小。
+可用 python bench_sqlite.py 比较默认参数和当前配置下的并发读写吞吐量。
+"""
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+# 配置项 -> PRAGMA名称，按此顺序执行（journal_mode 须在其他设置之前）
+_PRAGMA_SETTINGS = (
+    ('SQLITE_JOURNAL_MODE', 'journal_mode'),
+    ('SQLITE_BUSY_TIMEOUT', 'busy_timeout'),
+    ('SQLITE_SYNCHRONOUS', 'synchronous'),
+    ('SQLITE_CACHE_SIZE', 'cache_size'),
+    ('SQLITE_MMAP_SIZE', 'mmap_size'),
+    ('SQLITE_FOREIGN_KEYS', 'foreign_keys'),
+)
+
+
+def sqlite_pragmas(config):
+    """按配置返回 [(PRAGMA名称, 值)]，未配置（None）的项不设置"""
+    pragmas = []
+    for setting, pragma in _PRAGMA_SETTINGS:
+        value = config.get(setting)
+        if value is None:
+            continue
+        if isinstance(value, bool):
+            value = 'ON' if value else 'OFF'
+        pragmas.append((pragma, value))
+    return pragmas
+
+
+def apply_pragmas(dbapi_connection, pragmas):
+    cursor = dbapi_connection.cursor()
+    try:
+        for pragma, value in pragmas:
+            cursor.execute(f'PRAGMA {pragma}={value}')
+    finally:
+        cursor.close()
+
+
+def listen_pragmas(engine, pragmas):
+    """engine 新建立连接时执行 pragmas"""
+    @event.listens_for(engine, 'connect')
+    def _set_pragmas(dbapi_connection, connection_record):
+        apply_pragmas(dbapi_connection, pragmas)
+
+
+def foreign_key_violations(connection):
+    """违反外键约束的行（PRAGMA foreign_key_check，未启用约束时也可检查）
+
+    返回 [(表, rowid, 引用的表, 外键列, 值)]
+    """
+    violations = []
+    columns = {}
+    for table, rowid, parent, fkid in connection.exec_driver_sql('PRAGMA foreign_key_check').all():
+        if table not in columns:
+            columns[table] = {row[0]: row[3] for row in connection.exec_driver_sql(f'PRAGMA foreign_key_list("{table}")')}
+        column = columns[table].get(fkid)
+        value = None
+        if column is not None:
+            value = connection.exec_driver_sql(f'SELECT "{column}" FROM "{table}" WHERE rowid = ?', (rowid,)).scalar()
+        violations.append((table, rowid, parent, column, value))
+    return violations
+
+
+def _is_memory(url):
+    return url.database in (None, '', ':memory:') or 'mode=memory' in str(url)
+
+
+def init_database(app, db):
+    """设置连接池参数、初始化 db，并为SQLite连接注册PRAGMA"""
+    url = make_url(app.config['SQLALCHEMY_DATABASE_URI'])
+    options = app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {})
+    if not (url.get_backend_name() == 'sqlite' and _is_memory(url)):
+        for option, setting in (('pool_size', 'DB_POOL_SIZE'), ('max_overflow', 'DB_MAX_OVERFLOW'),
+                                ('pool_timeout', 'DB_POOL_TIMEOUT')):
+            if app.config.get(setting) is not None:
+                options.setdefault(option, app.config[setting])
+
+    db.init_app(app)
+
+    @app.cli.command('check-foreign-keys')
+    def check_foreign_keys_command():
+        """列出违反外键约束的行（启用 SQLITE_FOREIGN_KEYS 之前检查）"""
+        with db.engine.connect() as connection:
+            violations = foreign_key_violations(connection)
+        for table, rowid, parent, column, value in violations:
+            print(f'{table} rowid={rowid}：{column}={value} 在 {parent} 中不存在')
+        if violations:
+            print(f'共{len(violations)}行违反外键约束，启用外键约束后这些行不能修改，请先修正或删除')
+        else:
+            print('未发现违反外键约束的行')
+
+    pragmas = sqlite_pragmas(app.config)
+    if not pragmas:
+        return
+    with app.app_context():
+        for engine in db.engines.values():
+            if engine.dialect.name == 'sqlite':
+                listen_pragmas(engine, pragmas)
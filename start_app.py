@@ -34,6 +34,7 @@ print("\n端口5001可用，正在启动应用...\n")
 # 导入并运行Flask应用
 from app import app, db
 from routes import init_sample_data
+import typeahead
 
 # 初始化数据库
 with app.app_context():
@@ -48,6 +49,9 @@ with app.app_context():
             print(f"[WARNING] 示例数据初始化错误: {e}")
             import traceback
             traceback.print_exc()
+        # 预加载患者选择器索引
+        typeahead.warm()
+        print("[OK] 患者选择器索引加载成功")
     except Exception as e:
         print(f"[ERROR] 数据库初始化错误: {e}")
         import traceback
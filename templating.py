@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+模板编译和片段缓存
+
+- 字节码缓存：编译后的模板保存在 JINJA_BYTECODE_CACHE_DIR（默认 instance/jinja_cache），
+  重启后直接加载，不再重新解析模板；serve.py 在fork之前预编译全部模板，工作进程共享
+- 片段缓存：模板中用 {% cache %} 包住的部分渲染一次后保存到服务端缓存（cache.py），
+  键由片段名和其后的参数组成，参数中应包含所显示数据的版本：
+
+      {% cache 'records_rows', q, data_version(records, records|map(attribute='patient')) %}
+          ...表格行...
+      {% endcache %}
+
+  data_version() 由各行的ID和 updated_at 计算，任一行被修改、增删或换页时值随之改变。
+  也可以用 tags=('records',) 按缓存标签失效（与 cache.get_or_set 的标签相同），用 ttl= 指定有效期。
+  片段中不要放与当前用户有关的内容；TEMPLATE_FRAGMENT_CACHE=0 时不缓存。
+"""
+import hashlib
+import os
+from jinja2 import FileSystemBytecodeCache, nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+from cache import cache
+
+
+def data_version(*collections):
+    """一组或几组行（ORM对象或字典）的版本：由各行的ID和更新时间计算，None 忽略"""
+    digest = hashlib.sha1()
+    for rows in collections:
+        for row in rows or ():
+            if row is None:
+                continue
+            if isinstance(row, dict):
+                values = (row.get('id'), row.get('updated_at'))
+            else:
+                values = (getattr(row, 'id', None), getattr(row, 'updated_at', None))
+            digest.update(repr(values).encode())
+        digest.update(b'|')
+    return digest.hexdigest()
+
+
+class FragmentCacheExtension(Extension):
+    """{% cache 名称, 键... [, ttl=秒][, tags=(标签, ...)] %}...{% endcache %}"""
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache_enabled=True, fragment_cache_ttl=None)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        parts = [parser.parse_expression()]
+        kwargs = []
+        while parser.stream.skip_if('comma'):
+            if parser.stream.current.type == 'name' and parser.stream.look().type == 'assign':
+                key = parser.stream.current.value
+                parser.stream.skip(2)
+                kwargs.append(nodes.Keyword(key, parser.parse_expression()))
+            else:
+                parts.append(parser.parse_expression())
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        args = [nodes.Const(parser.name), nodes.List(parts)]
+        return nodes.CallBlock(self.call_method('_render', args, kwargs), [], [], body).set_lineno(lineno)
+
+    def _render(self, template_name, parts, caller, ttl=None, tags=()):
+        if not self.environment.fragment_cache_enabled:
+            return caller()
+        key = 'fragment:%s:%s' % (template_name, hashlib.sha1(repr(parts).encode()).hexdigest())
+        tags = tuple(tags)
+        value = cache.get(key, tags)
+        if value is None:
+            value = str(caller())
+            cache.set(key, value, tags, ttl or self.environment.fragment_cache_ttl)
+        return Markup(value)
+
+
+def precompile_templates(app):
+    """编译全部模板（写入字节码缓存并留在内存中）"""
+    for name in app.jinja_env.list_templates(extensions=('html',)):
+        app.jinja_env.get_template(name)
+
+
+def init_templating(app):
+    """配置字节码缓存和片段缓存"""
+    app.config.setdefault('TEMPLATE_FRAGMENT_CACHE', True)
+    app.config.setdefault('TEMPLATE_FRAGMENT_TTL', None)
+
+    directory = app.config.get('JINJA_BYTECODE_CACHE_DIR') or os.path.join(app.instance_path, 'jinja_cache')
+    os.makedirs(directory, exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(directory)
+
+    app.jinja_env.add_extension(FragmentCacheExtension)
+    app.jinja_env.fragment_cache_enabled = app.config['TEMPLATE_FRAGMENT_CACHE']
+    app.jinja_env.fragment_cache_ttl = app.config['TEMPLATE_FRAGMENT_TTL']
+    app.jinja_env.globals['data_version'] = data_version
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""
+pytest 测试的公共夹具
+
+测试使用临时目录中的SQLite数据库（在导入应用之前设置 DATABASE_URL），
+建表后写入示例数据（admin/admin123、doctor1/123456、nurse1/123456）。
+应用以测试模式运行，超出查询预算时抛出 QueryBudgetExceeded。
+"""
+import os
+import sys
+import tempfile
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+_data_dir = tempfile.mkdtemp(prefix='iga-test-')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(_data_dir, 'test.db')
+
+from app import app as flask_app  # noqa: E402
+from cache import cache  # noqa: E402
+from migrate import upgrade  # noqa: E402
+from routes import init_sample_data  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def app():
+    flask_app.config['TESTING'] = True
+    with flask_app.app_context():
+        upgrade()
+        init_sample_data()
+    return flask_app
+
+
+@pytest.fixture
+def client(app):
+    cache.clear()
+    return app.test_client()
+
+
+@pytest.fixture
+def admin_client(client):
+    response = client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+    assert response.status_code == 302
+    return client
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+"""eGFR年变化率"""
+from datetime import date
+from database import db
+from models import Patient, FollowupRecord, EgfrSlope
+from query_counter import count_queries
+
+
+def test_slopes_refresh_after_commit_and_dashboard_only_reads(app, admin_client):
+    with app.app_context():
+        patient = Patient(patient_id='SLOPE-001', name='斜率', gender='男')
+        db.session.add(patient)
+        db.session.flush()
+        db.session.add_all([
+            FollowupRecord(patient_id=patient.id, followup_date=date(year, 1, 1), egfr=egfr)
+            for year, egfr in ((2021, 90.0), (2022, 80.0), (2023, 70.0))
+        ])
+        db.session.commit()
+        slope = db.session.get(EgfrSlope, patient.id)
+        assert slope.pending == 0
+        assert round(slope.slope) == -10
+
+    with count_queries() as counter:
+        assert admin_client.get('/dashboard').status_code == 200
+    writes = [s for s in counter.statements if s.lstrip().upper().startswith(('INSERT', 'UPDATE', 'DELETE'))]
+    assert writes == []
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+"""JSON接口 v1"""
+from sequences import format_patient_id
+
+
+def test_unauthenticated_api_returns_401_and_pages_redirect(client):
+    response = client.get('/api/v1/patients')
+    assert response.status_code == 401
+    assert response.get_json()['success'] is False
+    response = client.get('/patients')
+    assert response.status_code == 302
+    assert '/login' in response.headers['Location']
+
+
+def test_explicit_code_advances_patient_sequence(admin_client):
+    response = admin_client.post('/api/v1/patients', json={'name': '接口之前', 'gender': '男'})
+    assert response.status_code == 201
+    number = int(response.get_json()['patient']['patient_id'].split('-')[1]) + 1000
+    response = admin_client.post('/api/v1/patients',
+                                 json={'patient_id': format_patient_id(number), 'name': '接口编号', 'gender': '女'})
+    assert response.status_code == 201
+    response = admin_client.post('/api/v1/patients', json={'name': '接口之后', 'gender': '男'})
+    assert response.status_code == 201
+    assert response.get_json()['patient']['patient_id'] == format_patient_id(number + 1)
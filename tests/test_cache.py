@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""服务端缓存的标签失效"""
+from datetime import date
+from sqlalchemy import text
+from cache import cache
+from database import db
+from models import Patient, FollowupRecord
+
+
+def test_missing_value_is_not_cached(app):
+    calls = []
+
+    def creator():
+        calls.append(1)
+        return None
+
+    with app.app_context():
+        assert cache.get_or_set('test:missing', creator) is None
+        assert cache.get_or_set('test:missing', creator) is None
+    assert len(calls) == 2
+
+
+def test_moving_record_invalidates_previous_patient(app, admin_client):
+    with app.app_context():
+        first = Patient(patient_id='MOVE-001', name='原患者', gender='男')
+        second = Patient(patient_id='MOVE-002', name='新患者', gender='女')
+        db.session.add_all([first, second])
+        db.session.flush()
+        record = FollowupRecord(patient_id=first.id, followup_date=date(2024, 1, 2), symptoms='转移测试症状')
+        db.session.add(record)
+        db.session.commit()
+        first_id, second_id, record_id = first.id, second.id, record.id
+
+    try:
+        assert '转移测试症状' in admin_client.get(f'/patients/{first_id}').get_data(as_text=True)
+
+        with app.app_context():
+            db.session.get(FollowupRecord, record_id).patient_id = second_id
+            db.session.commit()
+
+        assert '转移测试症状' not in admin_client.get(f'/patients/{first_id}').get_data(as_text=True)
+        assert '转移测试症状' in admin_client.get(f'/patients/{second_id}').get_data(as_text=True)
+    finally:
+        with app.app_context():
+            db.session.delete(db.session.get(FollowupRecord, record_id))
+            db.session.delete(db.session.get(Patient, first_id))
+            db.session.delete(db.session.get(Patient, second_id))
+            db.session.commit()
+
+
+def test_invalidation_from_another_worker_is_seen(app, admin_client):
+    with app.app_context():
+        patient = Patient(patient_id='SHARE-001', name='共享失效前', gender='男')
+        db.session.add(patient)
+        db.session.commit()
+        patient_id = patient.id
+
+    try:
+        assert '共享失效前' in admin_client.get(f'/patients/{patient_id}').get_data(as_text=True)
+        # 模拟其他工作进程：直接修改数据并在同一事务中增加标签版本号，本进程的内存缓存不受影响
+        with app.app_context():
+            with db.engine.begin() as connection:
+                connection.execute(text("UPDATE patients SET name = '共享失效后' WHERE id = :id"), {'id': patient_id})
+                cache.tag_versions.bump(connection, [f'patient:{patient_id}'])
+        assert '共享失效后' in admin_client.get(f'/patients/{patient_id}').get_data(as_text=True)
+    finally:
+        with app.app_context():
+            db.session.delete(db.session.get(Patient, patient_id))
+            db.session.commit()
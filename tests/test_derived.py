@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""派生指标计算"""
+from datetime import date
+import numpy as np
+import pytest
+from sqlalchemy import text
+from database import db
+from models import Patient, FollowupRecord
+from derived import (CREATININE_UMOL_PER_MG_DL, compute_egfr, compute_egfr_array, backfill_derived_metrics)
+
+
+def umol(mg_dl):
+    return mg_dl * CREATININE_UMOL_PER_MG_DL
+
+
+# CKD-EPI 2021 参考值：血肌酐分别低于、高于 κ（女 0.7，男 0.9 mg/dL）
+@pytest.mark.parametrize('mg_dl, gender, age, expected', [
+    (0.6, '女', 50, 109.3),
+    (1.2, '女', 50, 55.1),
+    (0.8, '男', 60, 101.3),
+    (1.5, '男', 60, 53.0),
+])
+def test_ckd_epi_2021_reference_values(mg_dl, gender, age, expected):
+    assert compute_egfr(umol(mg_dl), gender, age) == pytest.approx(expected, abs=0.05)
+
+
+@pytest.mark.parametrize('creatinine, gender, age', [
+    (umol(1.0), '男', 17),
+    (None, '男', 40),
+    ('', '女', 40),
+    (umol(1.0), None, 40),
+    (umol(1.0), '未知', 40),
+    (umol(1.0), '女', None),
+    (0, '女', 40),
+])
+def test_egfr_not_computed_without_valid_inputs(creatinine, gender, age):
+    assert compute_egfr(creatinine, gender, age) is None
+
+
+def test_array_matches_scalar():
+    cases = [
+        (umol(0.6), '女', 50), (umol(1.2), '女', 50), (umol(0.8), '男', 60), (umol(1.5), '男', 60),
+        (umol(1.0), '男', 17), (None, '男', 40), (umol(1.0), None, 40), (umol(1.0), '女', None), (0, '女', 40),
+    ]
+    creatinine = [np.nan if c is None else c for c, _, _ in cases]
+    ages = [np.nan if a is None else a for _, _, a in cases]
+    result = compute_egfr_array(creatinine, [g for _, g, _ in cases], ages)
+    expected = [compute_egfr(c, g, a) for c, g, a in cases]
+    assert [None if np.isnan(x) else float(x) for x in result] == expected
+
+
+@pytest.fixture
+def patient_record(app):
+    with app.app_context():
+        patient = Patient(patient_id='DERIVED-001', name='派生测试', gender='男', birth_date=date(1964, 1, 1))
+        db.session.add(patient)
+        db.session.flush()
+        record = FollowupRecord(patient_id=patient.id, followup_date=date(2024, 6, 1), serum_creatinine=umol(1.5))
+        db.session.add(record)
+        db.session.commit()
+        ids = patient.id, record.id
+    yield ids
+    with app.app_context():
+        db.session.delete(db.session.get(FollowupRecord, ids[1]))
+        db.session.delete(db.session.get(Patient, ids[0]))
+        db.session.commit()
+
+
+def _stored_egfr(record_id):
+    return db.session.execute(text('SELECT egfr FROM followup_records WHERE id = :id'), {'id': record_id}).scalar()
+
+
+def test_backfill_dry_run_reports_without_writing(app, patient_record):
+    _, record_id = patient_record
+    with app.app_context():
+        assert _stored_egfr(record_id) == pytest.approx(53.0)
+        db.session.execute(text('UPDATE followup_records SET egfr = 1 WHERE id = :id'), {'id': record_id})
+        db.session.commit()
+
+        report = backfill_derived_metrics(dry_run=True, sample_size=10000)
+        samples = [item for item in report['samples'] if item['record_id'] == record_id]
+        assert samples and samples[0]['egfr'] == (1.0, pytest.approx(53.0))
+        assert _stored_egfr(record_id) == 1
+
+
+def test_patient_gender_change_recomputes_egfr(app, patient_record):
+    patient_id, record_id = patient_record
+    with app.app_context():
+        db.session.get(Patient, patient_id).gender = '女'
+        db.session.commit()
+        assert _stored_egfr(record_id) == compute_egfr(umol(1.5), '女', 60)
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""批量导入"""
+import io
+import pytest
+from datetime import datetime
+from sqlalchemy import text
+from database import db
+from models import Patient
+from importer import import_file, _to_float, KIND_PATIENTS
+from sequences import format_patient_id
+
+
+def _csv(content):
+    return io.BytesIO(content.encode('utf-8'))
+
+
+def test_explicit_code_advances_patient_sequence(app, admin_client):
+    # 先自动分配一个编号，使计数器和本进程的编号块已经存在
+    assert admin_client.post('/patients/add', data={'name': '导入之前', 'gender': '男'}).status_code == 302
+    with app.app_context():
+        number = int(Patient.query.filter_by(name='导入之前').one().patient_id.split('-')[1]) + 1000
+        result = import_file(_csv(f'患者编号,姓名,性别\n{format_patient_id(number)},导入编号,男\n'),
+                             'patients.csv', KIND_PATIENTS)
+    assert result.inserted == 1 and result.error_count == 0
+
+    response = admin_client.post('/patients/add', data={'name': '导入之后', 'gender': '女'})
+    assert response.status_code == 302
+    with app.app_context():
+        assert Patient.query.filter_by(name='导入之后').one().patient_id == format_patient_id(number + 1)
+
+
+def test_failed_chunk_reports_the_failing_row(app):
+    with app.app_context():
+        db.session.execute(text(
+            "CREATE TRIGGER reject_import BEFORE INSERT ON patients WHEN NEW.name = '触发失败' "
+            "BEGIN SELECT RAISE(ABORT, 'rejected'); END"
+        ))
+        db.session.commit()
+        try:
+            result = import_file(_csv('姓名,性别\n逐行一,男\n触发失败,女\n逐行二,女\n'), 'patients.csv', KIND_PATIENTS)
+        finally:
+            db.session.execute(text('DROP TRIGGER reject_import'))
+            db.session.commit()
+        assert result.inserted == 2
+        assert [line for line, _ in result.errors] == [3]
+        assert Patient.query.filter(Patient.name.in_(['逐行一', '逐行二'])).count() == 2
+
+
+@pytest.mark.parametrize('value', [datetime(2024, 1, 1), True])
+def test_non_numeric_cell_is_a_row_error(value):
+    with pytest.raises(ValueError, match='应为数字'):
+        _to_float(value)
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""登录时的密码校验"""
+import pytest
+from sqlalchemy import text
+from database import db
+import routes
+
+
+@pytest.fixture
+def verified(monkeypatch):
+    calls = []
+    original = routes.verify_password
+
+    def recording(password_hash, password):
+        calls.append(password_hash)
+        return original(password_hash, password)
+
+    monkeypatch.setattr(routes, 'verify_password', recording)
+    return calls
+
+
+def test_unknown_username_still_hashes(client, verified):
+    response = client.post('/login', data={'username': 'no-such-user', 'password': '123456'})
+    assert response.status_code == 200
+    assert len(verified) == 1
+
+
+def test_inactive_account_hashes_before_rejecting(app, client, verified):
+    with app.app_context():
+        db.session.execute(text("UPDATE users SET is_active = 0 WHERE username = 'doctor1'"))
+        db.session.commit()
+    try:
+        response = client.post('/login', data={'username': 'doctor1', 'password': '123456'})
+        assert response.status_code == 200
+        assert '账户已被禁用' in response.get_data(as_text=True)
+        assert len(verified) == 1
+    finally:
+        with app.app_context():
+            db.session.execute(text("UPDATE users SET is_active = 1 WHERE username = 'doctor1'"))
+            db.session.commit()
+
+
+def test_active_account_logs_in(client, verified):
+    assert client.post('/login', data={'username': 'doctor1', 'password': '123456'}).status_code == 302
+    assert len(verified) == 1
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""键集分页"""
+from database import db
+from models import Patient
+from pagination import keyset_paginate
+
+
+def test_rows_with_null_sort_key_are_not_skipped(app):
+    with app.app_context():
+        patients = [Patient(patient_id=f'PAGE-{i:03d}', name=f'分页{i}', gender='男') for i in range(5)]
+        db.session.add_all(patients)
+        db.session.flush()
+        for patient in patients[:2]:
+            patient.created_at = None
+        db.session.commit()
+        try:
+            expected = {patient.id for patient in Patient.query.all()}
+            seen, cursor = [], None
+            while True:
+                page = keyset_paginate(Patient.query, (Patient.created_at, Patient.id), cursor=cursor, per_page=2)
+                seen.extend(patient.id for patient in page.items)
+                if not page.has_next:
+                    break
+                cursor = page.next_cursor
+            assert len(seen) == len(set(seen))
+            assert set(seen) == expected
+
+            # 从最后一页向前翻回第一页
+            back = []
+            cursor = page.prev_cursor
+            while page.has_prev:
+                page = keyset_paginate(Patient.query, (Patient.created_at, Patient.id), cursor=cursor, per_page=2)
+                back = [patient.id for patient in page.items] + back
+                cursor = page.prev_cursor
+            assert back == seen[:len(back)]
+        finally:
+            for patient in patients:
+                db.session.delete(patient)
+            db.session.commit()
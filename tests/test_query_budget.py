@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""列表页面的SQL查询预算（缓存为空时的最坏情况）"""
+import pytest
+from query_counter import QueryBudgetExceeded, count_queries
+
+DASHBOARD_BUDGET = 10
+# 登录用户缓存未命中时：标签版本号、用户、患者计数、患者列表
+PATIENTS_BUDGET = 4
+
+
+def test_dashboard_within_budget(admin_client):
+    with count_queries(budget=DASHBOARD_BUDGET) as counter:
+        response = admin_client.get('/dashboard')
+    assert response.status_code == 200
+    assert counter.count > 0
+
+
+def test_patients_within_budget(admin_client):
+    with count_queries(budget=PATIENTS_BUDGET):
+        response = admin_client.get('/patients')
+    assert response.status_code == 200
+
+
+def test_patients_search_within_budget(admin_client):
+    with count_queries(budget=PATIENTS_BUDGET):
+        response = admin_client.get('/patients?search=王')
+    assert response.status_code == 200
+
+
+def test_count_queries_fails_when_exceeded(admin_client):
+    with pytest.raises(QueryBudgetExceeded):
+        with count_queries(budget=0):
+            admin_client.get('/patients')
+
+
+def test_view_budget_of_zero_is_enforced(app, admin_client, monkeypatch):
+    monkeypatch.setattr(app.view_functions['patients'], 'query_budget', 0, raising=False)
+    with pytest.raises(QueryBudgetExceeded):
+        admin_client.get('/patients')
+
+
+def test_missing_patient_detail_is_404(admin_client):
+    assert admin_client.get('/patients/999999').status_code == 404
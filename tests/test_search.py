@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""患者检索"""
+from datetime import date
+import pytest
+from database import db
+from models import Patient, FollowupRecord
+from search import patient_search_filter, record_search_filter, bigram_tokens, highlight, record_highlight
+
+
+def _names(app, term):
+    with app.app_context():
+        return {patient.name for patient in Patient.query.filter(patient_search_filter(term))}
+
+
+def test_short_term_matches_inside_name(app):
+    assert '王明' in _names(app, '明')
+
+
+def test_short_term_matches_phone_fragment(app):
+    with app.app_context():
+        patient = Patient.query.filter(Patient.phone.isnot(None)).first()
+        phone = patient.phone
+    assert patient.name in _names(app, phone[-2:])
+
+
+def test_long_term_uses_full_text_index(app):
+    with app.app_context():
+        patient = Patient.query.first()
+        name, code = patient.name, patient.patient_id
+    assert name in _names(app, code)
+
+
+def test_bigram_tokens_split_chinese_runs():
+    assert bigram_tokens('蛋白尿') == ['蛋白', '白尿', '尿']
+    assert bigram_tokens('血') == ['血']
+    assert bigram_tokens('IgA肾病 24h') == ['iga', '肾病', '病', '24h']
+
+
+@pytest.fixture
+def hemoptysis_record(app):
+    with app.app_context():
+        patient = Patient.query.first()
+        record = FollowupRecord(patient_id=patient.id, followup_date=date(2024, 3, 1), symptoms='偶有咯血，无发热')
+        db.session.add(record)
+        db.session.commit()
+        record_id = record.id
+    yield record_id
+    with app.app_context():
+        db.session.delete(db.session.get(FollowupRecord, record_id))
+        db.session.commit()
+
+
+@pytest.mark.parametrize('term', ['咯', '咯血', '血 发热'])
+def test_record_search_matches_single_characters_and_words(app, hemoptysis_record, term):
+    with app.app_context():
+        ids = {record.id for record in FollowupRecord.query.filter(record_search_filter(term))}
+    assert hemoptysis_record in ids
+
+
+def test_highlight_escapes_value_and_term():
+    result = str(highlight('<script>alert(1)</script>尿蛋白阳性', '蛋白'))
+    assert '<script>' not in result
+    assert '&lt;script&gt;' in result
+    assert '<mark>蛋白</mark>' in result
+    assert str(highlight('a<b>c', '<b>')) == 'a<mark>&lt;b&gt;</mark>c'
+
+
+def test_highlight_without_match_is_escaped():
+    assert str(highlight('<img src=x onerror=alert(1)>', '蛋白')) == '&lt;img src=x onerror=alert(1)&gt;'
+
+
+def test_record_highlight_escapes_fields():
+    record = FollowupRecord(symptoms='<script>x</script>', notes='<b>血尿</b>加重')
+    result = str(record_highlight(record, '血尿'))
+    assert result.startswith('备注：')
+    assert '<b>' not in result and '<mark>血尿</mark>' in result
+    assert str(record_highlight(record, '无关')) == '&lt;script&gt;x&lt;/script&gt;'
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""系统设置读取"""
+import pytest
+from sqlalchemy import text
+from database import db
+from models import SystemSetting
+import settings
+
+
+@pytest.fixture
+def setting_row(app):
+    with app.app_context():
+        row = SystemSetting(key='test_followup_interval', value='30')
+        db.session.add(row)
+        db.session.commit()
+        setting_id = row.id
+    yield setting_id
+    with app.app_context():
+        db.session.delete(db.session.get(SystemSetting, setting_id))
+        db.session.commit()
+
+
+def _age_check_interval():
+    settings._settings.checked_at = 0.0
+
+
+def test_updated_setting_is_returned_by_template_global(app, setting_row):
+    setting = app.jinja_env.globals['setting']
+    with app.app_context():
+        assert setting('test_followup_interval') == '30'
+        db.session.get(SystemSetting, setting_row).value = '60'
+        db.session.commit()
+        _age_check_interval()
+        assert setting('test_followup_interval') == '60'
+
+
+def test_version_bumped_by_another_connection_is_picked_up(app, setting_row):
+    setting = app.jinja_env.globals['setting']
+    with app.app_context():
+        assert setting('test_followup_interval') == '30'
+        # 模拟其他工作进程修改设置：不经过本进程的ORM事件，只在同一事务中把版本号加一
+        with db.engine.begin() as connection:
+            connection.execute(text('UPDATE system_settings SET value = :value WHERE id = :id'),
+                               {'value': '90', 'id': setting_row})
+            settings.bump_version(connection)
+        # 检查间隔内仍使用进程内的副本
+        assert setting('test_followup_interval') == '30'
+        _age_check_interval()
+        assert setting('test_followup_interval') == '90'
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+"""慢查询记录"""
+from sqlalchemy import text
+from database import db
+from slow_queries import slow_query_log
+
+
+def test_parameters_are_not_logged_by_default(app, monkeypatch):
+    assert app.config['SLOW_QUERY_LOG_PARAMETERS'] is False
+    monkeypatch.setattr(slow_query_log, 'threshold', 0)
+    slow_query_log.clear()
+    with app.app_context():
+        db.session.execute(text('SELECT count(*) FROM patients WHERE name = :name'), {'name': '王明'}).scalar()
+    entries = slow_query_log.entries()
+    slow_query_log.clear()
+    assert entries
+    assert all(entry['parameters'] is None for entry in entries)
+    assert not any('王明' in str(entry) for entry in entries)
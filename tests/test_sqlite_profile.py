@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+"""SQLite连接参数"""
+from datetime import date
+from database import db
+from sqlite_profile import foreign_key_violations
+
+
+def test_orphan_rows_are_reported(app):
+    with app.app_context():
+        with db.engine.connect() as connection:
+            # 模拟未启用外键约束时留下的数据
+            connection.exec_driver_sql('PRAGMA foreign_keys=OFF')
+            try:
+                connection.exec_driver_sql(
+                    'INSERT INTO followup_records (patient_id, followup_date) VALUES (?, ?)',
+                    (999999, date(2024, 1, 1).isoformat()))
+                connection.commit()
+                violations = foreign_key_violations(connection)
+                assert ('followup_records', 'patients', 'patient_id', 999999) in [
+                    (table, parent, column, value) for table, _, parent, column, value in violations]
+                connection.exec_driver_sql('DELETE FROM followup_records WHERE patient_id = 999999')
+                connection.commit()
+                assert foreign_key_violations(connection) == []
+            finally:
+                connection.rollback()
+                connection.exec_driver_sql('PRAGMA foreign_keys=ON')
+                connection.commit()
+
+
+def test_check_foreign_keys_command(app):
+    result = app.test_cli_runner().invoke(args=['check-foreign-keys'])
+    assert result.exit_code == 0
+    assert '未发现违反外键约束的行' in result.output
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+"""趋势降采样（LTTB）"""
+import math
+import pytest
+from trends import lttb
+
+
+def series(n):
+    xs = list(range(n))
+    return xs, [math.sin(x / 5) * 10 + x * 0.1 for x in xs]
+
+
+@pytest.mark.parametrize('n, threshold', [(10, 3), (100, 10), (101, 7), (1000, 200), (500, 499)])
+def test_keeps_endpoints_and_returns_threshold_points(n, threshold):
+    indices = lttb(*series(n), threshold)
+    assert len(indices) == threshold
+    assert indices[0] == 0
+    assert indices[-1] == n - 1
+    assert indices == sorted(set(indices))
+
+
+@pytest.mark.parametrize('n, threshold', [(5, 5), (5, 10), (0, 10)])
+def test_series_within_threshold_is_returned_unchanged(n, threshold):
+    assert lttb(*series(n), threshold) == list(range(n))
+
+
+def test_keeps_isolated_peak():
+    xs = list(range(100))
+    ys = [0.0] * 100
+    ys[42] = 50.0
+    assert 42 in lttb(xs, ys, 10)
+
+
+def test_threshold_below_minimum_does_not_downsample():
+    assert lttb(*series(50), 2) == list(range(50))
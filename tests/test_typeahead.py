@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""患者选择器索引"""
+from sqlalchemy import text
+from database import db
+import typeahead
+
+
+def test_expired_index_reloads_in_background(app):
+    with app.test_request_context():
+        typeahead.warm()
+        db.session.execute(text(
+            "INSERT INTO patients (patient_id, name, gender) VALUES ('BG-000001', '后台加载', '女')"
+        ))
+        db.session.commit()
+        try:
+            typeahead.invalidate()
+            thread = typeahead.refresh_in_background()
+            thread.join(10)
+            assert [item['name'] for item in typeahead.search('BG-000001')] == ['后台加载']
+        finally:
+            db.session.execute(text("DELETE FROM patients WHERE patient_id = 'BG-000001'"))
+            db.session.commit()
+            typeahead.warm()
+
+
+def test_changes_committed_during_reload_are_kept(app):
+    index = typeahead.PrefixIndex()
+    index.load([])
+    assert index.begin_reload()
+    index.add({'id': -1, 'patient_id': 'NEW-000001', 'name': '重载期间', 'gender': '男', 'age': None, 'phone': None})
+    index.load([])
+    assert [item['name'] for item in index.search('NEW-000001')] == ['重载期间']
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""登录用户加载"""
+from sqlalchemy import text
+from database import db
+from cache import cache
+from query_counter import count_queries
+
+
+def _login_nurse(client):
+    assert client.post('/login', data={'username': 'nurse1', 'password': '123456'}).status_code == 302
+    assert client.get('/dashboard').status_code == 200
+
+
+def test_cached_user_is_not_queried(app, client):
+    _login_nurse(client)
+    with count_queries() as counter:
+        assert client.get('/dashboard').status_code == 200
+    assert not any('FROM users' in statement for statement in counter.statements)
+
+
+def test_cached_page_reads_all_tag_versions_in_one_query(app, client):
+    _login_nurse(client)
+    client.get('/dashboard')
+    with count_queries() as counter:
+        assert client.get('/dashboard').status_code == 200
+    assert sum('FROM counters' in statement for statement in counter.statements) == 1
+
+
+def test_account_deactivated_elsewhere_is_rejected_on_next_request(app, client):
+    _login_nurse(client)
+
+    # 模拟其他工作进程停用账户：不经过本进程的ORM事件，只在同一事务中把 user:<id> 标签的版本号加一
+    with app.app_context():
+        with db.engine.begin() as connection:
+            user_id = connection.execute(text("SELECT id FROM users WHERE username = 'nurse1'")).scalar()
+            connection.execute(text('UPDATE users SET is_active = 0 WHERE id = :id'), {'id': user_id})
+            cache.tag_versions.bump(connection, [f'user:{user_id}'])
+    try:
+        response = client.get('/dashboard')
+        assert response.status_code == 302
+        assert '/login' in response.headers['Location']
+    finally:
+        with app.app_context():
+            db.session.execute(text("UPDATE users SET is_active = 1 WHERE username = 'nurse1'"))
+            db.session.commit()
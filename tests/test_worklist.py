@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+"""随访工作清单"""
+import pytest
+
+
+@pytest.mark.parametrize('query', ['horizon=999999999999', 'horizon=-5',
+                                   'bucket=overdue&overdue_days=999999999999'])
+def test_out_of_range_window_is_clamped(admin_client, query):
+    response = admin_client.get(f'/api/worklist?{query}')
+    assert response.status_code == 200
+    assert response.get_json()['success'] is True
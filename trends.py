@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+患者化验指标趋势
+
+只查询随访日期和请求的指标列，按指标返回列式数据（日期数组 + 数值数组），
+图表一次请求即可拿到全部曲线。随访历史很长时可按 max_points 用
+LTTB（Largest-Triangle-Three-Buckets）算法降采样：保留首尾两点，
+中间的点分桶，每桶选出与前一个选中点、下一桶平均点构成三角形面积最大的点，
+点数减少后仍保留曲线的峰谷形状。
+
+结果按患者缓存，该患者的随访记录写入后（标签 patient:<id>）失效。
+"""
+import re
+from sqlalchemy import select
+from database import db
+from models import Patient, FollowupRecord, column_label
+from cache import cache
+
+# 可查询趋势的指标列
+TREND_METRICS = (
+    'egfr', 'serum_creatinine', 'urine_protein_24h', 'serum_albumin',
+    'urine_protein_creatinine_ratio', 'hemoglobin', 'iga_level', 'body_weight', 'bmi', 'heart_rate',
+)
+DEFAULT_TREND_METRICS = ('egfr', 'serum_creatinine', 'urine_protein_24h', 'serum_albumin')
+MIN_TREND_POINTS = 3
+
+
+def metric_info(metric):
+    """指标的名称和单位，取自列注释：'血肌酐(μmol/L)' -> ('血肌酐', 'μmol/L')"""
+    column = FollowupRecord.__table__.columns[metric]
+    unit = re.search(r'\((.*)\)', column.comment or '')
+    return column_label(column) or metric, unit.group(1) if unit else ''
+
+
+def lttb(xs, ys, threshold):
+    """LTTB降采样，返回保留的点的下标（升序），xs须升序"""
+    n = len(xs)
+    if threshold >= n or threshold < MIN_TREND_POINTS:
+        return list(range(n))
+
+    indices = [0]
+    every = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        # 下一个桶（最后一个桶的下一桶就是末点）的平均点
+        next_start = end
+        next_end = max(min(int((i + 2) * every) + 1, n), next_start + 1)
+        avg_x = sum(xs[next_start:next_end]) / (next_end - next_start)
+        avg_y = sum(ys[next_start:next_end]) / (next_end - next_start)
+
+        best, best_area = start, -1.0
+        for j in range(start, end):
+            area = abs((xs[a] - avg_x) * (ys[j] - ys[a]) - (xs[a] - xs[j]) * (avg_y - ys[a]))
+            if area > best_area:
+                best, best_area = j, area
+        indices.append(best)
+        a = best
+    indices.append(n - 1)
+    return indices
+
+
+def _load_trends(patient_id, metrics, max_points):
+    columns = [getattr(FollowupRecord, metric) for metric in metrics]
+    rows = db.session.execute(
+        select(FollowupRecord.followup_date, *columns)
+        .where(FollowupRecord.patient_id == patient_id)
+        .order_by(FollowupRecord.followup_date, FollowupRecord.id)
+    ).all()
+    if not rows and db.session.get(Patient, patient_id) is None:
+        return None
+
+    series = {}
+    for i, metric in enumerate(metrics, start=1):
+        points = [(row[0], row[i]) for row in rows if row[i] is not None]
+        total = len(points)
+        if max_points and total > max_points:
+            keep = lttb([d.toordinal() for d, _ in points], [v for _, v in points], max_points)
+            points = [points[k] for k in keep]
+        label, unit = metric_info(metric)
+        series[metric] = {
+            'label': label,
+            'unit': unit,
+            'dates': [d.isoformat() for d, _ in points],
+            'values': [v for _, v in points],
+            'total': total,
+        }
+    return series
+
+
+def patient_trends(patient_id, metrics=DEFAULT_TREND_METRICS, max_points=None):
+    """返回 {指标: {label, unit, dates, values, total}}，患者不存在时返回None"""
+    key = f'trends:{patient_id}:{",".join(metrics)}:{max_points or 0}'
+    return cache.get_or_set(
+        key, lambda: _load_trends(patient_id, metrics, max_points), tags=(f'patient:{patient_id}',)
+    )
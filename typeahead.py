@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+患者选择器的前缀索引
+
+把全部患者的编号、编号数字部分、姓名、电话放进一个排好序的内存列表，
+输入前缀后用二分查找定位，不需要访问数据库。本进程提交的患者增删改
+在提交后同步到索引；其他工作进程的修改在索引过期（PATIENT_TYPEAHEAD_TTL秒）
+后重新加载时生效。重新加载在后台线程中进行，加载完成前检索继续使用旧索引。
+"""
+import bisect
+import threading
+import time
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from database import db
+from replica import primary
+from models import Patient
+from search import search_patients, MIN_TRIGRAM_LENGTH
+
+_FIELDS = ('id', 'patient_id', 'name', 'gender', 'age', 'phone')
+
+
+def _keys(item):
+    """患者的检索键：编号、编号数字部分、姓名、电话"""
+    keys = {item['patient_id'].lower(), item['name'].lower()}
+    if '-' in item['patient_id']:
+        keys.add(item['patient_id'].split('-')[-1])
+    if item['phone']:
+        keys.add(item['phone'])
+    return keys
+
+
+class PrefixIndex:
+    """按前缀检索患者的有序列表"""
+
+    def __init__(self):
+        self._entries = []
+        self._items = {}
+        self._lock = threading.Lock()
+        # 重新加载期间本进程提交的修改，加载完成后在新列表上重放
+        self._pending = None
+        self.loaded_at = None
+        self.stale = False
+
+    def begin_reload(self):
+        """开始重新加载；已有加载在进行时返回False"""
+        with self._lock:
+            if self._pending is not None:
+                return False
+            self._pending = []
+            return True
+
+    def abort_reload(self):
+        with self._lock:
+            self._pending = None
+
+    def load(self, items):
+        entries = []
+        for item in items:
+            entries.extend((key, item['id']) for key in _keys(item))
+        entries.sort()
+        with self._lock:
+            self._entries = entries
+            self._items = {item['id']: item for item in items}
+            for action, value in self._pending or ():
+                if action == 'add':
+                    self._add(value)
+                else:
+                    self._remove(value)
+            self._pending = None
+            self.loaded_at = time.monotonic()
+            self.stale = False
+
+    def add(self, item):
+        with self._lock:
+            self._add(item)
+            if self._pending is not None:
+                self._pending.append(('add', item))
+
+    def remove(self, patient_id):
+        with self._lock:
+            self._remove(patient_id)
+            if self._pending is not None:
+                self._pending.append(('remove', patient_id))
+
+    def _add(self, item):
+        self._remove(item['id'])
+        self._items[item['id']] = item
+        for key in _keys(item):
+            bisect.insort(self._entries, (key, item['id']))
+
+    def _remove(self, patient_id):
+        old = self._items.pop(patient_id, None)
+        if old is None:
+            return
+        for key in _keys(old):
+            i = bisect.bisect_left(self._entries, (key, patient_id))
+            if i < len(self._entries) and self._entries[i] == (key, patient_id):
+                del self._entries[i]
+
+    def search(self, prefix, limit=10):
+        """返回检索键以 prefix 开头的患者，按检索键排序"""
+        prefix = prefix.strip().lower()
+        if not prefix:
+            return []
+        results, seen = [], set()
+        with self._lock:
+            i = bisect.bisect_left(self._entries, (prefix,))
+            while i < len(self._entries) and len(results) < limit:
+                key, patient_id = self._entries[i]
+                if not key.startswith(prefix):
+                    break
+                if patient_id not in seen:
+                    seen.add(patient_id)
+                    results.append(self._items[patient_id])
+                i += 1
+        return results
+
+    def __len__(self):
+        return len(self._items)
+
+
+patient_index = PrefixIndex()
+
+
+def patient_item(patient):
+    return {field: getattr(patient, field) for field in _FIELDS}
+
+
+def warm():
+    """从数据库加载全部患者到前缀索引（只读取需要的列）"""
+    columns = [getattr(Patient, field) for field in _FIELDS]
+    # 索引在本进程内保留到下次失效，从主库加载
+    with primary():
+        rows = db.session.execute(db.select(*columns)).all()
+    patient_index.load([dict(zip(_FIELDS, row)) for row in rows])
+
+
+def invalidate():
+    """标记索引过期，下次检索时在后台重新加载（用于批量导入等不经过ORM会话的写入）"""
+    patient_index.stale = True
+
+
+def _reload(app):
+    with app.app_context():
+        try:
+            warm()
+        except Exception:
+            patient_index.abort_reload()
+            app.logger.exception('患者选择器索引重新加载失败')
+
+
+def refresh_in_background():
+    """在后台线程中重新加载索引，返回线程（已有加载在进行时返回None）"""
+    if not patient_index.begin_reload():
+        return None
+    thread = threading.Thread(target=_reload, args=(current_app._get_current_object(),),
+                              name='typeahead-reload', daemon=True)
+    thread.start()
+    return thread
+
+
+def _ensure_fresh():
+    # 第一次使用时同步加载；之后过期只在后台重新加载，检索不等待
+    if patient_index.loaded_at is None:
+        warm()
+        return
+    ttl = current_app.config.get('PATIENT_TYPEAHEAD_TTL', 300)
+    if patient_index.stale or time.monotonic() - patient_index.loaded_at > ttl:
+        refresh_in_background()
+
+
+def search(term, limit=10):
+    """患者选择器检索：先按前缀匹配，不足 limit 条时用全文索引补充子串匹配"""
+    _ensure_fresh()
+    results = patient_index.search(term, limit)
+    if len(results) < limit and len(term.strip()) >= MIN_TRIGRAM_LENGTH:
+        seen = {item['id'] for item in results}
+        for patient in search_patients(term, limit):
+            if patient.id not in seen and len(results) < limit:
+                results.append(patient_item(patient))
+    return results
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_patient_changes(session, flush_context):
+    changes = session.info.setdefault('typeahead_changes', [])
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, Patient):
+            changes.append(('add', patient_item(obj)))
+    for obj in session.deleted:
+        if isinstance(obj, Patient):
+            changes.append(('remove', obj.id))
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_patient_changes(session):
+    changes = session.info.pop('typeahead_changes', None)
+    if not changes or patient_index.loaded_at is None:
+        return
+    for action, value in changes:
+        if action == 'add':
+            patient_index.add(value)
+        else:
+            patient_index.remove(value)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_patient_changes(session):
+    session.info.pop('typeahead_changes', None)
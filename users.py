@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""
+登录用户缓存
+
+Flask-Login 每个请求都要按会话中的用户ID加载用户。用户信息很少变化，
+因此缓存用户的列值（不含密码哈希），命中时直接在会话中重建用户对象，不再查询数据库。
+
+- 条目TTL为 USER_CACHE_TTL 秒（设置为0则不缓存），所有缓存后端都缓存
+- 用户被修改或删除后提交时按标签 user:<id> 失效（工作人员编辑、删除、登录时重新哈希等）。
+  标签版本号由所有工作进程共享（redis 后端，或 memory 后端的数据库版本号 CACHE_SHARED_TAGS），
+  一个进程中停用、删除的账户在其他进程中下一个请求即失效；memory 后端的版本号与页面数据
+  的标签在同一条查询中读出，命中时不再单独查询用户
+- 停用的账户直接返回None，会话立即失效
+"""
+from flask import current_app
+from sqlalchemy.orm import make_transient_to_detached
+from database import db
+from models import User, to_dict
+from cache import cache
+from replica import primary
+
+# 不放入缓存的列，访问时再从数据库加载
+_UNCACHED_COLUMNS = ('password_hash',)
+
+
+def _user_values(user_id):
+    user = db.session.get(User, user_id)
+    if user is None:
+        return None
+    values = to_dict(user)
+    for column in _UNCACHED_COLUMNS:
+        values.pop(column)
+    return values
+
+
+def load_user(user_id):
+    """按ID加载启用的用户，优先使用缓存"""
+    ttl = current_app.config.get('USER_CACHE_TTL', 60)
+    if not ttl:
+        # 账户停用须立即生效，不从只读副本读取
+        with primary():
+            user = db.session.get(User, user_id)
+        return user if user is not None and user.is_active else None
+
+    values = cache.get_or_set(f'user:{user_id}', lambda: _user_values(user_id),
+                              tags=(f'user:{user_id}',), ttl=ttl)
+    if values is None or not values['is_active']:
+        return None
+    # 本次请求中已加载过时直接使用会话中的对象
+    user = db.session.identity_map.get(db.session.identity_key(User, user_id))
+    if user is not None:
+        return user
+    user = User(**values)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+随访工作清单
+
+每位患者的随访计划以其最近一次随访记录（按随访日期、记录ID排序）中的
+下次随访日期为准，更早记录里的计划已经被后来的随访取代，不再出现在清单中。
+
+清单查询只在 next_followup_date 索引上做一次范围扫描，
+再按 patient_id 索引逐条确认该记录是否为患者的最近一次记录。
+"""
+from datetime import date, timedelta
+from flask import current_app
+from sqlalchemy import and_, or_, exists
+from sqlalchemy.orm import aliased, joinedload
+from models import FollowupRecord
+from pagination import keyset_paginate
+
+BUCKET_UPCOMING = 'upcoming'
+BUCKET_OVERDUE = 'overdue'
+# 即将随访、已逾期的天数范围上限（约10年），超出的参数按上限处理
+MAX_WINDOW_DAYS = 3650
+
+
+def _is_latest_record():
+    """记录是该患者最近一次随访记录（不存在更晚的记录）"""
+    newer = aliased(FollowupRecord)
+    return ~exists().where(
+        newer.patient_id == FollowupRecord.patient_id,
+        or_(
+            newer.followup_date > FollowupRecord.followup_date,
+            and_(newer.followup_date == FollowupRecord.followup_date, newer.id > FollowupRecord.id),
+        ),
+    )
+
+
+def bucket_range(bucket, today=None, horizon_days=None, overdue_days=None):
+    """返回清单分组对应的下次随访日期范围 (起, 止)，两端都包含"""
+    today = today or date.today()
+    if horizon_days is None:
+        horizon_days = current_app.config.get('WORKLIST_HORIZON_DAYS', 7)
+    if overdue_days is None:
+        overdue_days = current_app.config.get('WORKLIST_OVERDUE_DAYS', 30)
+    horizon_days = max(0, min(horizon_days, MAX_WINDOW_DAYS))
+    overdue_days = max(0, min(overdue_days, MAX_WINDOW_DAYS))
+    if bucket == BUCKET_OVERDUE:
+        return today - timedelta(days=overdue_days), today - timedelta(days=1)
+    return today, today + timedelta(days=horizon_days)
+
+
+def worklist_query(start, end):
+    """下次随访日期在 [start, end] 内、且为患者当前计划的随访记录"""
+    return FollowupRecord.query.options(
+        joinedload(FollowupRecord.patient)
+    ).filter(
+        FollowupRecord.next_followup_date >= start,
+        FollowupRecord.next_followup_date <= end,
+        _is_latest_record(),
+    )
+
+
+def get_worklist(bucket=BUCKET_UPCOMING, today=None, horizon_days=None, overdue_days=None,
+                 per_page=None, cursor=None):
+    """按下次随访日期升序分页返回工作清单"""
+    start, end = bucket_range(bucket, today, horizon_days, overdue_days)
+    if per_page is None:
+        per_page = current_app.config.get('WORKLIST_PAGE_SIZE', 50)
+    return keyset_paginate(
+        worklist_query(start, end),
+        (FollowupRecord.next_followup_date, FollowupRecord.id),
+        cursor=cursor, per_page=per_page, descending=False,
+    )
+
+
+def worklist_item(record, today=None):
+    """清单条目，供仪表盘模板和JSON接口使用"""
+    today = today or date.today()
+    return {
+        'record_id': record.id,
+        'patient_id': record.patient_id,
+        'patient_code': record.patient.patient_id,
+        'patient_name': record.patient.name,
+        'phone': record.patient.phone,
+        'followup_date': record.followup_date,
+        'next_followup_date': record.next_followup_date,
+        'days_until': (record.next_followup_date - today).days,
+    }